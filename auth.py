@@ -1,11 +1,8 @@
-from flask import Blueprint, request, jsonify, current_app
-from extensions import mysql, bcrypt
+from flask import Blueprint, request, jsonify
+from db_pool import mysql
 import random
 import string
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.header import Header
-import smtplib
 import os
 import re
 from dotenv import load_dotenv
@@ -13,33 +10,30 @@ import sys
 import traceback
 import uuid # Importa uuid para generar tokens únicos
 
-# Importar PyJWT (la librería 'jwt')
-import jwt
+from jwt_auth import generar_token
+from mail_queue import cola_correos
+from password_hashing import servicio_hash, ServicioHashSaturado
+from metrics import duracion_encolar_correo
+from rate_limit import limitar
 
 load_dotenv()
 
-auth_bp = Blueprint('auth', _name_)
-
-MAIL_USER = os.getenv('MAIL_USER')
-MAIL_PASS = os.getenv('MAIL_PASS')
-
-# --- Configuración JWT ---
-# JWT_SECRET_KEY se obtiene de app.config (establecido en app.py)
-JWT_EXPIRATION_DELTA = timedelta(hours=1) # El token expirará en 1 hora
+auth_bp = Blueprint('auth', __name__)
 
 
 def generar_codigo_verificacion():
     """Genera un código de verificación numérico de 6 dígitos."""
     return str(random.randint(100000, 999999))
 
-def enviar_correo_verificacion(destinatario, codigo):
+def enviar_correo_verificacion(destinatario, codigo, asunto=None, cuerpo_html=None):
     """
-    Envía un correo electrónico con el código de verificación.
-    Retorna True si el envío es exitoso, False en caso contrario.
+    Encola un correo electrónico con el código de verificación (o el asunto y cuerpo indicados).
+    El envío lo hace mail_queue en segundo plano; la solicitud no espera al servidor SMTP.
+    Retorna True si el correo quedó encolado, False en caso contrario.
     """
-    try:
-        remitente = MAIL_USER
+    if asunto is None:
         asunto = "Código de Verificación para tu Cuenta"
+    if cuerpo_html is None:
         cuerpo_html = f"""
         <html>
         <body>
@@ -53,22 +47,11 @@ def enviar_correo_verificacion(destinatario, codigo):
         </body>
         </html>
         """
-
-        msg = MIMEText(cuerpo_html, 'html', 'utf-8')
-        msg['From'] = Header(remitente, 'utf-8')
-        msg['To'] = Header(destinatario, 'utf-8')
-        msg['Subject'] = Header(asunto, 'utf-8')
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(MAIL_USER, MAIL_PASS)
-            server.sendmail(remitente, destinatario, msg.as_string())
-        return True
-    except Exception as e:
-        print(f"Error al enviar correo: {e}", file=sys.stderr)
-        return False
+    with duracion_encolar_correo.medir():
+        return cola_correos.encolar(destinatario, asunto, cuerpo_html)
 
 @auth_bp.route('/register', methods=['POST', 'OPTIONS'])
+@limitar('register', campos_identidad=('email', 'username'))
 def register():
     if request.method == 'OPTIONS':
         # Manejar la solicitud OPTIONS (preflight CORS)
@@ -103,7 +86,7 @@ def register():
             cursor.close()
             return jsonify({"error": "El nombre de usuario o correo electrónico ya está registrado."}), 409
 
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = servicio_hash.generar_hash(password)
         
         # Generar código de verificación y tiempo de expiración
         verification_code = generar_codigo_verificacion()
@@ -134,6 +117,10 @@ def register():
             "user_id": cursor.lastrowid # lastrowid obtiene el ID del usuario recién insertado
         }), 201
 
+    except ServicioHashSaturado:
+        if 'conn' in locals() and conn.open:
+            conn.rollback()
+        return jsonify({"error": "El servidor está ocupado. Inténtalo de nuevo en unos segundos."}), 503
     except Exception as e:
         # Asegúrate de hacer un rollback si ocurre un error inesperado antes del commit
         if 'conn' in locals() and conn.open: # Verifica si la conexión está abierta
@@ -191,6 +178,7 @@ def verify_email():
         return jsonify({"error": "Error interno del servidor al verificar correo."}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@limitar('login')
 def login():
     try:
         data = request.get_json()
@@ -207,23 +195,31 @@ def login():
         user = cursor.fetchone()
         cursor.close()
 
-        if user and bcrypt.check_password_hash(user[2], password): # user[2] es password_hash
+        if user and servicio_hash.verificar(user[2], password): # user[2] es password_hash
             if user[3] == 0: # user[3] es verificado
                 return jsonify({"error": "Cuenta no verificada. Por favor, verifica tu correo electrónico."}), 403
+
+            # Si el hash se generó con un costo distinto al configurado, se regenera con la contraseña ya validada
+            if servicio_hash.necesita_rehash(user[2]):
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (servicio_hash.generar_hash(password), user[0]))
+                    conn.commit()
+                except ServicioHashSaturado:
+                    pass # Se reintentará en el próximo login
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Error al actualizar el hash de contraseña del usuario {user[0]}: {e}", file=sys.stderr)
+                finally:
+                    cursor.close()
             
-            # Generar el token JWT
-            jwt_secret_key = current_app.config.get('JWT_SECRET_KEY')
-            if not jwt_secret_key:
-                print("ERROR: JWT_SECRET_KEY no está configurada en app.config para la generación de JWT.", file=sys.stderr)
+            # Generar el token JWT con los claims que usan las rutas protegidas (sin consultas extra a la DB)
+            try:
+                token = generar_token(user[0], user[1], email, user[3]) # user[0] es id, user[1] es username
+            except RuntimeError as e:
+                print(f"ERROR: {e}", file=sys.stderr)
                 return jsonify({"error": "Error de configuración del servidor."}), 500
 
-            token_payload = {
-                'user_id': user[0], # user[0] es id
-                'username': user[1], # user[1] es username
-                'exp': datetime.utcnow() + JWT_EXPIRATION_DELTA
-            }
-            token = jwt.encode(token_payload, jwt_secret_key, algorithm='HS256') # Codifica el token
-
             return jsonify({
                 "message": "Inicio de sesión exitoso.",
                 "user": {
@@ -235,6 +231,10 @@ def login():
             }), 200
         else:
             return jsonify({"error": "Credenciales inválidas."}), 401
+    except ServicioHashSaturado:
+        if 'conn' in locals() and conn.open:
+            conn.rollback()
+        return jsonify({"error": "El servidor está ocupado. Inténtalo de nuevo en unos segundos."}), 503
     except Exception as e:
         print(f"Error en /login: {str(e)}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -242,6 +242,7 @@ def login():
 
 
 @auth_bp.route('/request-password-reset', methods=['POST'])
+@limitar('password_reset')
 def request_password_reset():
     try:
         data = request.get_json()
@@ -287,7 +288,7 @@ def request_password_reset():
         </body>
         </html>
         """
-        if not enviar_correo_verificacion(email, reset_token): # Reutilizamos la función de envío
+        if not enviar_correo_verificacion(email, reset_token, asunto, cuerpo_html): # Reutilizamos la función de envío
             print(f"Error al enviar correo de restablecimiento a {email}", file=sys.stderr)
             # Aunque falló el envío, el token se guardó. Podrías decidir cómo manejar esto.
         
@@ -333,7 +334,7 @@ def reset_password():
             cursor.close()
             return jsonify({"error": "El código de restablecimiento ha expirado."}), 400
 
-        hashed_new_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
+        hashed_new_password = servicio_hash.generar_hash(new_password)
         cursor.execute("""
             UPDATE users SET password_hash = %s, reset_token = NULL, reset_token_expira = NULL
             WHERE email = %s
@@ -341,6 +342,10 @@ def reset_password():
         conn.commit()
         cursor.close()
         return jsonify({"message": "Contraseña restablecida exitosamente."}), 200
+    except ServicioHashSaturado:
+        if 'conn' in locals() and conn.open:
+            conn.rollback()
+        return jsonify({"error": "El servidor está ocupado. Inténtalo de nuevo en unos segundos."}), 503
     except Exception as e:
         if 'conn' in locals() and conn.open:
             conn.rollback()
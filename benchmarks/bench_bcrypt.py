@@ -0,0 +1,55 @@
+"""
+Micro-benchmark del servicio de hashing de contraseñas.
+
+Mide hashes por segundo con 1 proceso y con el pool completo, y reporta el
+rendimiento por núcleo para elegir BCRYPT_LOG_ROUNDS y BCRYPT_POOL_SIZE.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_bcrypt --rounds 12 --hashes 64
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from password_hashing import ServicioHash
+
+
+def medir(procesos, rounds, hashes):
+    servicio = ServicioHash(procesos=procesos, max_pendientes=hashes, rounds=rounds)
+    try:
+        servicio.generar_hash("calentamiento") # Arranca los procesos fuera de la medición
+        inicio = time.perf_counter()
+        # Un hilo por trabajo en vuelo, como harían los workers del servidor.
+        with ThreadPoolExecutor(max_workers=procesos * 2) as hilos:
+            list(hilos.map(lambda i: servicio.generar_hash(f"password-{i}"), range(hashes)))
+        duracion = time.perf_counter() - inicio
+    finally:
+        servicio.cerrar()
+    por_segundo = hashes / duracion
+    return {
+        "procesos": procesos,
+        "rounds": rounds,
+        "hashes": hashes,
+        "segundos": round(duracion, 3),
+        "hashes_por_segundo": round(por_segundo, 2),
+        "hashes_por_segundo_por_nucleo": round(por_segundo / procesos, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--hashes', type=int, default=64)
+    parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    resultados = [medir(1, args.rounds, args.hashes)]
+    if args.procesos > 1:
+        resultados.append(medir(args.procesos, args.rounds, args.hashes))
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == '__main__':
+    main()
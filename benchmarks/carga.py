@@ -0,0 +1,509 @@
+"""
+Prueba de carga reproducible de auth_bp y user_bp.
+
+1. Crea la base de datos de pruebas (su nombre debe contener 'bench') con
+   benchmarks/esquema_base.sql + migrations/*.sql y la llena con datos
+   generados a partir de --semilla: usuarios, publicaciones, comentarios e
+   imágenes en los volúmenes indicados.
+2. Levanta un servidor SMTP falso (aiosmtpd) que descarta los correos y arranca
+   la aplicación en un proceso aparte (servidor WSGI con hilos de Werkzeug).
+   Con --url se usa en cambio un servidor ya en marcha (p. ej. gunicorn)
+   configurado contra la misma base de datos.
+3. Durante --duracion segundos, --concurrencia clientes ejecutan escenarios
+   elegidos al azar según --mezcla: feed (páginas y comentarios), buscar,
+   perfil, login, registro, comentar y subir (imagen de publicación).
+4. Escribe en JSON el rendimiento y los percentiles p50/p95/p99 por ruta junto
+   con el commit y los parámetros, para comparar con benchmarks.comparar.
+
+Uso (desde la raíz del repositorio; requiere aiosmtpd y Pillow):
+    MYSQL_USER=root MYSQL_PASSWORD=... python -m benchmarks.carga \\
+        --usuarios 500 --publicaciones 2000 --comentarios 10000 --imagenes 1000 \\
+        --mezcla feed=60,buscar=10,perfil=5,login=10,comentar=10,subir=5 \\
+        --duracion 60 --concurrencia 16 --salida resultados/base.json
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.client import HTTPConnection
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+RAIZ = Path(__file__).resolve().parent.parent
+PASSWORD = 'password-bench'
+PALABRAS = (
+    "dragon espada castillo eternia reino batalla guerrero magia hechizo escudo "
+    "torre bosque montaña tesoro llave misión nivel jefe poción armadura arquero "
+    "caballero sombra fuego hielo trueno leyenda héroe villano aldea camino"
+).split()
+ESCENARIOS = ('feed', 'buscar', 'perfil', 'login', 'registro', 'comentar', 'subir')
+
+
+# --- Base de datos ---
+
+def _conectar(args, db=None):
+    import MySQLdb
+    return MySQLdb.connect(host=args.mysql_host, port=args.mysql_port, user=args.mysql_user,
+                           passwd=args.mysql_password, db=db, charset='utf8mb4', autocommit=False)
+
+
+def _frase(rnd, minimo, maximo):
+    return ' '.join(rnd.choice(PALABRAS) for _ in range(rnd.randint(minimo, maximo)))
+
+
+def sembrar(args):
+    """Recrea la base de pruebas y la llena con datos deterministas. Retorna un resumen."""
+    import bcrypt
+    from migrate import aplicar_migraciones, sentencias
+
+    if 'bench' not in args.mysql_db:
+        raise SystemExit(f"Por seguridad la base de datos debe contener 'bench' en su nombre (recibido: {args.mysql_db}).")
+    rnd = random.Random(args.semilla)
+    inicio = time.perf_counter()
+
+    conexion = _conectar(args)
+    cursor = conexion.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{args.mysql_db}`")
+    cursor.execute(f"CREATE DATABASE `{args.mysql_db}` CHARACTER SET utf8mb4")
+    cursor.execute(f"USE `{args.mysql_db}`")
+    for sentencia in sentencias((RAIZ / 'benchmarks' / 'esquema_base.sql').read_text(encoding='utf-8')):
+        cursor.execute(sentencia)
+
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(args.bcrypt_rounds)).decode('utf-8')
+    cursor.executemany(
+        "INSERT INTO users (id, username, email, password_hash, verificado, DescripUsuario) VALUES (%s, %s, %s, %s, 1, %s)",
+        [(i, f"jugador{i}", f"jugador{i}@bench.local", password_hash, _frase(rnd, 3, 12)) for i in range(1, args.usuarios + 1)]
+    )
+
+    base = datetime(2024, 1, 1)
+    publicaciones = [
+        (i, rnd.randint(1, args.usuarios), _frase(rnd, 2, 6), _frase(rnd, 20, 120), base + timedelta(minutes=i))
+        for i in range(1, args.publicaciones + 1)
+    ]
+    cursor.executemany("INSERT INTO publicaciones (id, autor_id, titulo, texto, created_at) VALUES (%s, %s, %s, %s, %s)", publicaciones)
+
+    for desde in range(0, args.comentarios, 5000):
+        cursor.executemany(
+            "INSERT INTO comentarios (publicacion_id, autor_id, texto, created_at) VALUES (%s, %s, %s, %s)",
+            [(rnd.randint(1, args.publicaciones), rnd.randint(1, args.usuarios), _frase(rnd, 3, 30),
+              base + timedelta(minutes=rnd.randint(1, args.publicaciones * 2)))
+             for _ in range(desde, min(desde + 5000, args.comentarios))]
+        )
+
+    ordenes = defaultdict(int)
+    imagenes = []
+    for _ in range(args.imagenes):
+        publicacion_id = rnd.randint(1, args.publicaciones)
+        imagenes.append((publicacion_id, f"http://bench.local/uploads/seed/{uuid.UUID(int=rnd.getrandbits(128))}.jpg", ordenes[publicacion_id]))
+        ordenes[publicacion_id] += 1
+    cursor.executemany("INSERT INTO imagenes_publicacion (publicacion_id, url, orden) VALUES (%s, %s, %s)", imagenes)
+
+    cursor.executemany(
+        "INSERT INTO partidas (user_id, dificultad_id, puntaje_actual) VALUES (%s, %s, %s)",
+        [(u, d, rnd.randint(0, 100000)) for u in range(1, args.usuarios + 1) for d in (1, 2, 3) if rnd.random() < 0.6]
+    )
+    conexion.commit()
+
+    cursor.close()
+    aplicar_migraciones(conexion, eco=lambda mensaje: None)
+    conexion.close()
+    return {"segundos": round(time.perf_counter() - inicio, 2)}
+
+
+# --- Servidores ---
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_smtp_falso():
+    """Servidor SMTP local que acepta y descarta los mensajes. Retorna (controlador, puerto)."""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise SystemExit("Se requiere aiosmtpd para el servidor SMTP falso: pip install aiosmtpd")
+
+    class Descartar:
+        recibidos = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Descartar.recibidos += 1
+            return '250 OK'
+
+    puerto = _puerto_libre()
+    controlador = Controller(Descartar(), hostname='127.0.0.1', port=puerto)
+    controlador.start()
+    return controlador, puerto
+
+
+def crear_app(config):
+    """Aplicación con los blueprints del repositorio, configurada para la prueba de carga."""
+    from flask import Flask
+
+    import metrics
+    import rate_limit
+    from db_pool import mysql
+    from auth import auth_bp
+    from user import user_bp
+    from leaderboard import leaderboard_bp
+    from uploads import uploads_bp
+
+    app = Flask('benchmark', root_path=str(RAIZ))
+    app.config.update(config)
+    mysql.init_app(app)
+    metrics.init_app(app)
+    rate_limit.init_app(app)
+    for blueprint in (auth_bp, user_bp, leaderboard_bp, uploads_bp):
+        app.register_blueprint(blueprint)
+    return app
+
+
+def _servir(config, puerto):
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # Sin una línea de log por solicitud
+    make_server('127.0.0.1', puerto, crear_app(config), threaded=True).serve_forever()
+
+
+def iniciar_app(args, upload_folder):
+    """Arranca la aplicación en un proceso separado para que el cliente no compita por su GIL."""
+    puerto = _puerto_libre()
+    base_url = f"http://127.0.0.1:{puerto}"
+    config = configuracion_app(args, upload_folder, base_url)
+    proceso = multiprocessing.get_context('spawn').Process(target=_servir, args=(config, puerto), daemon=True)
+    proceso.start()
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=0.5).close()
+            return proceso, base_url
+        except OSError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise SystemExit("La aplicación no empezó a escuchar en 30 segundos.")
+
+
+# --- Cliente ---
+
+class Cliente:
+    """Conexión HTTP persistente de un trabajador; registra la latencia de cada solicitud."""
+
+    def __init__(self, base_url, registrar):
+        partes = urlsplit(base_url)
+        self._host, self._puerto = partes.hostname, partes.port or 80
+        self._registrar = registrar
+        self._conexion = None
+
+    def solicitar(self, nombre, metodo, ruta, cuerpo=None, cabeceras=None):
+        cabeceras = dict(cabeceras or {})
+        if isinstance(cuerpo, dict):
+            cuerpo = json.dumps(cuerpo).encode('utf-8')
+            cabeceras['Content-Type'] = 'application/json'
+        inicio = time.perf_counter()
+        try:
+            if self._conexion is None:
+                self._conexion = HTTPConnection(self._host, self._puerto, timeout=60)
+            self._conexion.request(metodo, ruta, body=cuerpo, headers=cabeceras)
+            respuesta = self._conexion.getresponse()
+            datos = respuesta.read()
+            estado = respuesta.status
+            if respuesta.getheader('Connection', '').lower() == 'close':
+                self._conexion.close()
+                self._conexion = None
+        except (OSError, ValueError) as e:
+            if self._conexion is not None:
+                self._conexion.close()
+            self._conexion = None
+            datos, estado = str(e).encode('utf-8'), 0
+        self._registrar(nombre, time.perf_counter() - inicio, estado)
+        return estado, datos
+
+    def json(self, *args, **kwargs):
+        estado, datos = self.solicitar(*args, **kwargs)
+        try:
+            return estado, json.loads(datos) if 200 <= estado < 300 else None
+        except ValueError:
+            return estado, None
+
+
+def _imagen_jpeg(rnd):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), tuple(rnd.randint(0, 255) for _ in range(3))).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def _multipart(campo, nombre_archivo, contenido, tipo):
+    limite = uuid.uuid4().hex
+    cuerpo = (
+        f"--{limite}\r\nContent-Disposition: form-data; name=\"{campo}\"; filename=\"{nombre_archivo}\"\r\n"
+        f"Content-Type: {tipo}\r\n\r\n"
+    ).encode('utf-8') + contenido + f"\r\n--{limite}--\r\n".encode('utf-8')
+    return cuerpo, {'Content-Type': f"multipart/form-data; boundary={limite}"}
+
+
+class Escenarios:
+    def __init__(self, args, cliente, rnd, sesiones):
+        self.args = args
+        self.cliente = cliente
+        self.rnd = rnd
+        self.sesiones = sesiones # [(token, publicacion_id propia)]
+
+    def _auth(self):
+        token, publicacion_id = self.rnd.choice(self.sesiones)
+        return {'Authorization': f"Bearer {token}"}, publicacion_id
+
+    def feed(self):
+        _, pagina = self.cliente.json('GET /publicaciones', 'GET', '/publicaciones?limit=20')
+        if not pagina:
+            return
+        ids = [p['id'] for p in pagina['publicaciones']]
+        if ids:
+            self.cliente.solicitar('GET /publicaciones/comentarios', 'GET',
+                                   '/publicaciones/comentarios?' + urlencode({'ids': ','.join(map(str, ids))}))
+        if pagina['next_cursor'] and self.rnd.random() < 0.5:
+            self.cliente.solicitar('GET /publicaciones (cursor)', 'GET',
+                                   '/publicaciones?' + urlencode({'limit': 20, 'cursor': pagina['next_cursor']}))
+
+    def buscar(self):
+        consulta = ' '.join(self.rnd.sample(PALABRAS, 2))
+        self.cliente.solicitar('GET /publicaciones/buscar', 'GET', '/publicaciones/buscar?' + urlencode({'q': consulta}))
+
+    def perfil(self):
+        cabeceras, _ = self._auth()
+        self.cliente.solicitar('GET /perfil', 'GET', '/perfil', cabeceras=cabeceras)
+
+    def login(self):
+        usuario = self.rnd.randint(1, self.args.usuarios)
+        self.cliente.solicitar('POST /login', 'POST', '/login',
+                               {'email': f"jugador{usuario}@bench.local", 'password': PASSWORD})
+
+    def registro(self):
+        nombre = f"nuevo_{uuid.uuid4().hex[:12]}"
+        self.cliente.solicitar('POST /register', 'POST', '/register',
+                               {'username': nombre, 'email': f"{nombre}@bench.local", 'password': PASSWORD})
+
+    def comentar(self):
+        cabeceras, _ = self._auth()
+        self.cliente.solicitar('POST /comentar-publicacion', 'POST', '/comentar-publicacion',
+                               {'publicacion_id': self.rnd.randint(1, self.args.publicaciones), 'comentario': _frase(self.rnd, 3, 20)},
+                               cabeceras=cabeceras)
+
+    def subir(self):
+        cabeceras, publicacion_id = self._auth()
+        cuerpo, cabeceras_multipart = _multipart('imagen_publicacion', 'bench.jpg', _imagen_jpeg(self.rnd), 'image/jpeg')
+        self.cliente.solicitar('POST /publicaciones/<id>/upload_imagen', 'POST',
+                               f"/publicaciones/{publicacion_id}/upload_imagen", cuerpo, {**cabeceras, **cabeceras_multipart})
+
+
+def iniciar_sesiones(args, base_url, cantidad):
+    """Inicia sesión con algunos usuarios sembrados y crea una publicación propia para cada uno."""
+    sesiones = []
+    cliente = Cliente(base_url, lambda *a: None)
+    for usuario in range(1, min(cantidad, args.usuarios) + 1):
+        estado, datos = cliente.json('login', 'POST', '/login', {'email': f"jugador{usuario}@bench.local", 'password': PASSWORD})
+        if not datos or 'access_token' not in datos:
+            raise SystemExit(f"No se pudo iniciar sesión con jugador{usuario} (HTTP {estado}).")
+        cabeceras = {'Authorization': f"Bearer {datos['access_token']}"}
+        estado, creada = cliente.json('crear', 'POST', '/crear-publicacion',
+                                      {'titulo': 'Publicación de benchmark', 'texto': 'Imágenes subidas durante la prueba.'}, cabeceras)
+        if not creada:
+            raise SystemExit(f"No se pudo crear la publicación de benchmark (HTTP {estado}).")
+        sesiones.append((datos['access_token'], creada['publicacion_id']))
+    return sesiones
+
+
+def _percentil(ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not ordenados:
+        return None
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumir(muestras, duracion):
+    rutas = {}
+    for nombre, registros in sorted(muestras.items()):
+        latencias = sorted(l for l, _ in registros)
+        estados = defaultdict(int)
+        for _, estado in registros:
+            estados[str(estado)] += 1
+        rutas[nombre] = {
+            "solicitudes": len(registros),
+            "errores": sum(1 for _, estado in registros if estado == 0 or estado >= 500),
+            "por_segundo": round(len(registros) / duracion, 2),
+            "p50_ms": round(_percentil(latencias, 50) * 1000, 2),
+            "p95_ms": round(_percentil(latencias, 95) * 1000, 2),
+            "p99_ms": round(_percentil(latencias, 99) * 1000, 2),
+            "max_ms": round(latencias[-1] * 1000, 2),
+            "estados": dict(estados),
+        }
+    total = sum(r["solicitudes"] for r in rutas.values())
+    return {"solicitudes": total, "por_segundo": round(total / duracion, 2), "rutas": rutas}
+
+
+def ejecutar_carga(args, base_url, sesiones, mezcla):
+    muestras = defaultdict(list)
+    lock = threading.Lock()
+    midiendo = threading.Event()
+    fin = time.monotonic() + args.calentamiento + args.duracion
+    nombres, pesos = zip(*mezcla.items())
+
+    def registrar(nombre, latencia, estado):
+        if midiendo.is_set():
+            with lock:
+                muestras[nombre].append((latencia, estado))
+
+    def trabajador(indice):
+        rnd = random.Random(args.semilla * 1000 + indice)
+        escenarios = Escenarios(args, Cliente(base_url, registrar), rnd, sesiones)
+        while time.monotonic() < fin:
+            getattr(escenarios, rnd.choices(nombres, pesos)[0])()
+
+    hilos = [threading.Thread(target=trabajador, args=(i,), daemon=True) for i in range(args.concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    time.sleep(args.calentamiento)
+    midiendo.set()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    return resumir(muestras, time.perf_counter() - inicio)
+
+
+def _mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        if nombre.strip() not in ESCENARIOS:
+            raise argparse.ArgumentTypeError(f"Escenario desconocido: {nombre!r}. Opciones: {', '.join(ESCENARIOS)}")
+        mezcla[nombre.strip()] = float(peso or 1)
+    return mezcla
+
+
+def argumentos_de_siembra(parser):
+    """Opciones de volumen de datos y de conexión a MySQL que usa sembrar()."""
+    parser.add_argument('--usuarios', type=int, default=200)
+    parser.add_argument('--publicaciones', type=int, default=1000)
+    parser.add_argument('--comentarios', type=int, default=5000)
+    parser.add_argument('--imagenes', type=int, default=500)
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--bcrypt-rounds', type=int, default=int(os.getenv('BCRYPT_LOG_ROUNDS', '12')))
+    parser.add_argument('--mysql-host', default=os.getenv('MYSQL_HOST', '127.0.0.1'))
+    parser.add_argument('--mysql-port', type=int, default=int(os.getenv('MYSQL_PORT', '3306')))
+    parser.add_argument('--mysql-user', default=os.getenv('MYSQL_USER', 'root'))
+    parser.add_argument('--mysql-password', default=os.getenv('MYSQL_PASSWORD', ''))
+    parser.add_argument('--mysql-db', default=os.getenv('BENCH_MYSQL_DB', 'pagina_bench'))
+
+
+def configuracion_app(args, upload_folder, base_url):
+    """app.config para crear_app() contra la base de pruebas."""
+    return {
+        'MYSQL_HOST': args.mysql_host,
+        'MYSQL_PORT': args.mysql_port,
+        'MYSQL_USER': args.mysql_user,
+        'MYSQL_PASSWORD': args.mysql_password,
+        'MYSQL_DB': args.mysql_db,
+        'MYSQL_CHARSET': 'utf8mb4',
+        'JWT_SECRET_KEY': 'clave-de-benchmark',
+        'UPLOAD_FOLDER': upload_folder,
+        'API_BASE_URL': base_url,
+    }
+
+
+def preparar_entorno(args, puerto_smtp, limites_reales=False):
+    """
+    Variables de entorno de la aplicación de pruebas. mail_queue, password_hashing y
+    rate_limit las leen al importarse: se fijan antes de importar la aplicación.
+    """
+    os.environ.update({'MAIL_HOST': '127.0.0.1', 'MAIL_PORT': str(puerto_smtp), 'MAIL_USE_TLS': '0',
+                       'MAIL_USER': '', 'MAIL_PASS': '', 'MAIL_FROM': 'bench@bench.local',
+                       'BCRYPT_LOG_ROUNDS': str(args.bcrypt_rounds)})
+    if not limites_reales:
+        # Todos los clientes salen de 127.0.0.1 y repiten usuarios: sin esto la prueba mide los 429.
+        for regla in ('LOGIN', 'REGISTER', 'RESET'):
+            os.environ[f'RATE_LIMIT_{regla}_IP'] = os.environ[f'RATE_LIMIT_{regla}_IDENTIDAD'] = '1000000/1'
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos_de_siembra(parser)
+    parser.add_argument('--mezcla', type=_mezcla, default=_mezcla('feed=60,buscar=10,perfil=5,login=10,comentar=10,subir=5'))
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos medidos')
+    parser.add_argument('--calentamiento', type=float, default=5, help='Segundos previos sin medir')
+    parser.add_argument('--concurrencia', type=int, default=8)
+    parser.add_argument('--sesiones', type=int, default=20, help='Usuarios con sesión para las rutas autenticadas')
+    parser.add_argument('--url', help='Usar un servidor ya en marcha en lugar de arrancar la aplicación')
+    parser.add_argument('--limites-reales', action='store_true', help='Mantener los límites de tasa configurados en auth')
+    parser.add_argument('--sin-sembrar', action='store_true', help='Reutilizar la base de datos de una ejecución anterior')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, la salida estándar)')
+    args = parser.parse_args()
+
+    siembra = None if args.sin_sembrar else sembrar(args)
+
+    smtp = proceso = None
+    upload_folder = tempfile.mkdtemp(prefix='bench_uploads_')
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            smtp, puerto_smtp = iniciar_smtp_falso()
+            preparar_entorno(args, puerto_smtp, args.limites_reales)
+            proceso, base_url = iniciar_app(args, upload_folder)
+
+        sesiones = iniciar_sesiones(args, base_url, args.sesiones)
+        resumen = ejecutar_carga(args, base_url, sesiones, args.mezcla)
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+        if smtp is not None:
+            smtp.stop()
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    resultado = {
+        "commit": _commit_actual(),
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "parametros": {
+            "usuarios": args.usuarios, "publicaciones": args.publicaciones, "comentarios": args.comentarios,
+            "imagenes": args.imagenes, "mezcla": args.mezcla, "duracion": args.duracion,
+            "calentamiento": args.calentamiento, "concurrencia": args.concurrencia, "semilla": args.semilla,
+            "bcrypt_rounds": args.bcrypt_rounds, "servidor": args.url or 'werkzeug (hilos)',
+        },
+        "siembra": siembra,
+        **resumen,
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.salida).write_text(texto + '\n', encoding='utf-8')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
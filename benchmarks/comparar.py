@@ -0,0 +1,66 @@
+"""
+Compara dos resultados de benchmarks.carga (p. ej. de dos commits) ruta por ruta.
+
+Muestra el cambio relativo de rendimiento y de p50/p95/p99; con --umbral
+termina con código 1 si algún percentil empeora más de ese porcentaje, para
+usarlo en CI.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.comparar resultados/base.json resultados/nuevo.json --umbral 10
+"""
+import argparse
+import json
+import sys
+
+METRICAS = ('por_segundo', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def _cambio(antes, despues):
+    if not antes:
+        return None
+    return round((despues - antes) / antes * 100, 1)
+
+
+def comparar(base, nuevo):
+    filas = []
+    for ruta in sorted(set(base["rutas"]) | set(nuevo["rutas"])):
+        antes, despues = base["rutas"].get(ruta), nuevo["rutas"].get(ruta)
+        if antes is None or despues is None:
+            filas.append({"ruta": ruta, "solo_en": "nuevo" if antes is None else "base"})
+            continue
+        fila = {"ruta": ruta}
+        for metrica in METRICAS:
+            fila[metrica] = {"base": antes[metrica], "nuevo": despues[metrica], "cambio_pct": _cambio(antes[metrica], despues[metrica])}
+        filas.append(fila)
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('nuevo')
+    parser.add_argument('--umbral', type=float, help='Porcentaje de empeoramiento de latencia que se considera regresión')
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding='utf-8') as f:
+        nuevo = json.load(f)
+    if base.get("parametros") != nuevo.get("parametros"):
+        print("Aviso: los parámetros de las dos ejecuciones no coinciden.", file=sys.stderr)
+
+    filas = comparar(base, nuevo)
+    regresiones = [
+        f"{fila['ruta']} {metrica}: {fila[metrica]['cambio_pct']:+}%"
+        for fila in filas if 'solo_en' not in fila
+        for metrica in ('p50_ms', 'p95_ms', 'p99_ms')
+        if args.umbral is not None and (fila[metrica]['cambio_pct'] or 0) > args.umbral
+    ]
+    print(json.dumps({"base": base.get("commit"), "nuevo": nuevo.get("commit"), "rutas": filas, "regresiones": regresiones},
+                     indent=2, ensure_ascii=False))
+    if regresiones:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
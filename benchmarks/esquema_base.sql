@@ -0,0 +1,51 @@
+-- Tablas base que usan auth.py y user.py, tal como existen antes de migrations/.
+-- benchmarks/carga.py las crea en una base de datos vacía y luego aplica migrations/*.sql en orden.
+CREATE TABLE users (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    username VARCHAR(50) NOT NULL,
+    email VARCHAR(100) NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    token VARCHAR(36) NULL,
+    verificado TINYINT(1) NOT NULL DEFAULT 0,
+    verification_code VARCHAR(6) NULL,
+    code_expiration DATETIME NULL,
+    reset_token VARCHAR(6) NULL,
+    reset_token_expira DATETIME NULL,
+    DescripUsuario TEXT NULL,
+    foto_perfil VARCHAR(255) NULL
+);
+
+CREATE TABLE publicaciones (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    autor_id INT NOT NULL,
+    titulo VARCHAR(255) NOT NULL,
+    texto TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (autor_id) REFERENCES users (id)
+);
+
+CREATE TABLE comentarios (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    publicacion_id INT NOT NULL,
+    autor_id INT NOT NULL,
+    texto TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (publicacion_id) REFERENCES publicaciones (id) ON DELETE CASCADE,
+    FOREIGN KEY (autor_id) REFERENCES users (id)
+);
+
+CREATE TABLE imagenes_publicacion (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    publicacion_id INT NOT NULL,
+    url VARCHAR(255) NOT NULL,
+    orden INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (publicacion_id) REFERENCES publicaciones (id) ON DELETE CASCADE
+);
+
+CREATE TABLE partidas (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    dificultad_id INT NOT NULL,
+    puntaje_actual INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
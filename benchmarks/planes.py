@@ -0,0 +1,159 @@
+"""
+Comprueba con EXPLAIN que las consultas de la aplicación usan índices.
+
+1. Recrea la base de pruebas igual que benchmarks.carga (esquema_base.sql +
+   migrations/*.sql) con volúmenes suficientes para que el optimizador no
+   prefiera recorrer tablas pequeñas.
+2. Construye la aplicación con SQL_EXPLICAR y recorre con app.test_client()
+   todas las rutas de auth, user y leaderboard: registro, verificación, login,
+   perfil, publicaciones, feed, búsqueda, comentarios, subidas, partidas y
+   restablecimiento de contraseña.
+3. Informa de cada tabla leída con un escaneo completo (type = ALL) que no esté
+   en ESCANEOS_PERMITIDOS y de cada respuesta 5xx. Termina con código 1 si hay
+   alguno, para usarlo en CI o antes de fusionar una migración.
+
+Uso (desde la raíz del repositorio; requiere aiosmtpd y Pillow):
+    MYSQL_USER=root MYSQL_PASSWORD=... python -m benchmarks.planes
+"""
+import argparse
+import io
+import random
+import shutil
+import sys
+import tempfile
+
+import sql_instrumentation
+from benchmarks.carga import (
+    PASSWORD, _conectar, _imagen_jpeg, argumentos_de_siembra, configuracion_app, crear_app,
+    iniciar_smtp_falso, preparar_entorno, sembrar,
+)
+
+# Recorridos completos intencionados: (fragmento de la huella, tabla).
+ESCANEOS_PERMITIDOS = (
+    ('from partidas pa', 'pa'),                                       # leaderboard: carga inicial de las clasificaciones
+    ('select id, titulo, texto from publicaciones', 'publicaciones'), # search_index: reconstrucción del índice
+)
+
+
+def _permitido(escaneo):
+    texto = escaneo['huella'].lower()
+    return any(fragmento in texto and escaneo['tabla'] == tabla for fragmento, tabla in ESCANEOS_PERMITIDOS)
+
+
+class Recorrido:
+    """Ejecuta las rutas en orden con el cliente de pruebas de Flask y anota las respuestas 5xx."""
+
+    def __init__(self, app, conexion_directa):
+        self.cliente = app.test_client()
+        self.conexion = conexion_directa
+        self.errores = []
+
+    def llamar(self, metodo, ruta, token=None, **kwargs):
+        cabeceras = {'Authorization': f"Bearer {token}"} if token else {}
+        respuesta = self.cliente.open(ruta, method=metodo, headers=cabeceras, **kwargs)
+        if respuesta.status_code >= 500:
+            self.errores.append(f"{metodo} {ruta}: HTTP {respuesta.status_code}")
+        return respuesta
+
+    def _valor(self, sql, parametros):
+        cursor = self.conexion.cursor()
+        try:
+            cursor.execute(sql, parametros)
+            fila = cursor.fetchone()
+            return fila[0] if fila else None
+        finally:
+            cursor.close()
+
+    def ejecutar(self, args):
+        rnd = random.Random(args.semilla)
+        email = 'planes@bench.local'
+
+        self.llamar('POST', '/register', json={'username': 'planes', 'email': email, 'password': PASSWORD})
+        codigo = self._valor("SELECT verification_code FROM users WHERE email = %s", (email,))
+        self.llamar('POST', '/verificar', json={'email': email, 'verification_code': codigo})
+        token = self.llamar('POST', '/login', json={'email': email, 'password': PASSWORD}).get_json()['access_token']
+        user_id = self._valor("SELECT id FROM users WHERE email = %s", (email,))
+
+        self.llamar('GET', '/logeado', token)
+        self.llamar('GET', '/perfil', token)
+        self.llamar('PUT', '/perfil', token, json={'descripcion': 'Perfil de planes', 'username': 'planes2'})
+
+        publicacion_id = self.llamar('POST', '/crear-publicacion', token,
+                                     json={'titulo': 'dragon castillo', 'texto': 'magia espada'}).get_json()['publicacion_id']
+        self.llamar('PUT', f'/editar-publicacion/{publicacion_id}', token, json={'titulo': 'dragon torre', 'texto': 'magia escudo'})
+
+        pagina = self.llamar('GET', '/publicaciones?limit=20').get_json()
+        ids = [p['id'] for p in pagina['publicaciones']]
+        self.llamar('GET', '/publicaciones', query_string={'limit': 20, 'cursor': pagina['next_cursor']})
+        self.llamar('GET', '/publicaciones/buscar', query_string={'q': 'dragon magia'})
+
+        self.llamar('POST', '/comentar-publicacion', token, json={'publicacion_id': publicacion_id, 'comentario': 'primer comentario'})
+        comentarios = self.llamar('GET', '/publicaciones/comentarios',
+                                  query_string={'ids': ','.join(map(str, ids + [publicacion_id]))}).get_json()['comentarios']
+        comentario_id = comentarios[str(publicacion_id)][0]['id']
+        self.llamar('PUT', f'/editar-comentario/{comentario_id}', token, json={'comentario': 'comentario editado'})
+        self.llamar('DELETE', f'/eliminar-comentario/{comentario_id}', token)
+
+        self.llamar('POST', f'/publicaciones/{publicacion_id}/upload_imagen', token,
+                    data={'imagen_publicacion': (io.BytesIO(_imagen_jpeg(rnd)), 'planes.jpg', 'image/jpeg')})
+        self.llamar('POST', f'/publicaciones/{publicacion_id}/upload_imagenes', token,
+                    data={'imagenes_publicacion': [(io.BytesIO(_imagen_jpeg(rnd)), f'planes{i}.jpg', 'image/jpeg') for i in range(3)]})
+        self.llamar('PUT', '/perfil/foto', token,
+                    data={'profile_picture': (io.BytesIO(_imagen_jpeg(rnd)), 'perfil.jpg', 'image/jpeg')})
+
+        self.llamar('POST', '/player', token, json={'dificultad_id': 1, 'puntaje': 1234})
+        self.llamar('GET', '/leaderboard/1')
+        self.llamar('GET', f'/leaderboard/1/usuario/{user_id}')
+        self.llamar('GET', '/leaderboard/1/alrededor', token)
+
+        self.llamar('POST', '/request-password-reset', json={'email': email})
+        codigo = self._valor("SELECT reset_token FROM users WHERE email = %s", (email,))
+        self.llamar('POST', '/reset-password', json={'reset_code': codigo, 'new_password': PASSWORD + '2'})
+
+        self.llamar('DELETE', f'/eliminar-publicacion/{publicacion_id}', token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos_de_siembra(parser)
+    parser.set_defaults(usuarios=2000, publicaciones=5000, comentarios=20000, imagenes=2000, bcrypt_rounds=4)
+    args = parser.parse_args()
+
+    sembrar(args)
+    smtp, puerto_smtp = iniciar_smtp_falso()
+    preparar_entorno(args, puerto_smtp)
+    upload_folder = tempfile.mkdtemp(prefix='planes_uploads_')
+    try:
+        # crear_app importa los blueprints aquí, después de preparar_entorno.
+        config = configuracion_app(args, upload_folder, 'http://localhost')
+        config.update({'SQL_EXPLICAR': True, 'SQL_MUESTREO_LENTAS': 0.0})
+        app = crear_app(config)
+        conexion = _conectar(args, args.mysql_db)
+        try:
+            recorrido = Recorrido(app, conexion)
+            recorrido.ejecutar(args)
+        finally:
+            conexion.close()
+    finally:
+        smtp.stop()
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    vistos = set()
+    problemas = []
+    for escaneo in sql_instrumentation.escaneos_completos:
+        clave = (escaneo['huella'], escaneo['tabla'])
+        if clave in vistos or _permitido(escaneo):
+            continue
+        vistos.add(clave)
+        problemas.append(f"Escaneo completo de {escaneo['tabla']} (~{escaneo['filas']} filas) en {escaneo['ruta']}:\n    {escaneo['huella'][:300]}")
+    problemas.extend(recorrido.errores)
+
+    for problema in problemas:
+        print(problema, file=sys.stderr)
+    if problemas:
+        raise SystemExit(1)
+    print(f"Sin escaneos completos inesperados ({len(sql_instrumentation.escaneos_completos)} permitidos).")
+
+
+if __name__ == '__main__':
+    main()
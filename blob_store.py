@@ -0,0 +1,131 @@
+"""
+Almacenamiento de archivos subidos direccionado por contenido.
+
+Cada archivo se guarda una sola vez en UPLOAD_FOLDER/blobs/ab/cd/<sha256>.<ext>,
+escribiéndolo por bloques mientras se calcula su hash. Como el contenido de
+una URL nunca cambia, puede servirse con cabeceras de caché inmutables.
+
+La tabla `blobs` lleva la cuenta de referencias (imágenes de publicaciones,
+fotos de perfil y sus variantes). Las funciones que reciben un cursor no hacen
+commit: las referencias cambian en la misma transacción que la fila que las usa.
+Los archivos que se quedan sin referencias los borra upload_gc en segundo plano.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter, namedtuple
+
+TAMANO_BLOQUE = 64 * 1024
+CARPETA_BLOBS = 'blobs'
+
+Blob = namedtuple('Blob', 'hash ruta_relativa tamano nuevo')
+
+
+def _ruta_relativa(hash_hex, extension):
+    return f"{CARPETA_BLOBS}/{hash_hex[:2]}/{hash_hex[2:4]}/{hash_hex}.{extension}"
+
+
+def guardar_stream(stream, extension, upload_folder):
+    """
+    Copia el stream a un archivo temporal calculando su SHA-256 y lo publica en su ruta definitiva.
+    Si ya existía un archivo idéntico, se descarta la copia (Blob.nuevo es False).
+    """
+    carpeta_tmp = os.path.join(upload_folder, CARPETA_BLOBS, 'tmp')
+    os.makedirs(carpeta_tmp, exist_ok=True)
+    hasher = hashlib.sha256()
+    tamano = 0
+    with tempfile.NamedTemporaryFile(dir=carpeta_tmp, delete=False) as tmp:
+        try:
+            while True:
+                bloque = stream.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                hasher.update(bloque)
+                tmp.write(bloque)
+                tamano += len(bloque)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+    ruta_relativa = _ruta_relativa(hasher.hexdigest(), extension.lower())
+    destino = os.path.join(upload_folder, ruta_relativa)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    try:
+        # os.link falla si el destino ya existe: la creación es exclusiva aunque haya subidas concurrentes.
+        os.link(tmp.name, destino)
+        nuevo = True
+    except FileExistsError:
+        nuevo = False
+    finally:
+        os.remove(tmp.name)
+    return Blob(hasher.hexdigest(), ruta_relativa, tamano, nuevo)
+
+
+def guardar_archivo(ruta_local, extension, upload_folder):
+    with open(ruta_local, 'rb') as f:
+        return guardar_stream(f, extension, upload_folder)
+
+
+def url_de_blob(base_url, ruta_relativa):
+    return f"{base_url}/uploads/{ruta_relativa}"
+
+
+def ruta_relativa_de_url(url):
+    """Extrae 'blobs/...' de una URL de blob, o None si la URL no pertenece al almacén."""
+    marcador = f"/uploads/{CARPETA_BLOBS}/"
+    if not url or marcador not in url:
+        return None
+    return url[url.index(marcador) + len('/uploads/'):]
+
+
+def agregar_referencia(cursor, blob):
+    cursor.execute("""
+        INSERT INTO blobs (ruta, hash, tamano, referencias) VALUES (%s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE referencias = referencias + 1
+    """, (blob.ruta_relativa, blob.hash, blob.tamano))
+
+
+def agregar_referencias(cursor, blobs):
+    """Una referencia por cada blob (repetidos incluidos) en una sola sentencia."""
+    if not blobs:
+        return
+    cursor.executemany("""
+        INSERT INTO blobs (ruta, hash, tamano, referencias) VALUES (%s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE referencias = referencias + 1
+    """, [(blob.ruta_relativa, blob.hash, blob.tamano) for blob in blobs])
+
+
+def comprobar_reutilizados(upload_folder, blobs):
+    """
+    Llamar después de agregar las referencias y antes del commit. Un blob que ya existía
+    (Blob.nuevo es False) pudo borrarlo upload_gc entre guardar_stream y el INSERT en `blobs`;
+    ese INSERT espera a que termine el borrado, así que aquí ya se ve si el archivo falta.
+    """
+    for blob in blobs:
+        if not blob.nuevo and not os.path.exists(os.path.join(upload_folder, blob.ruta_relativa)):
+            raise FileNotFoundError(f"El blob {blob.ruta_relativa} se borró mientras se volvía a usar")
+
+
+def liberar_referencias(cursor, rutas_relativas):
+    """
+    Descuenta una referencia por cada ruta y elimina las filas que quedan sin referencias.
+    Retorna las rutas cuyos archivos ya no usa nadie (para upload_gc.programar_borrado).
+    """
+    rutas_relativas = [r for r in rutas_relativas if r]
+    if not rutas_relativas:
+        return []
+    # Una sola sentencia para todas las rutas; una ruta repetida descuenta tantas referencias como veces aparece.
+    cuentas = Counter(rutas_relativas)
+    casos = ' '.join(['WHEN %s THEN %s'] * len(cuentas))
+    marcadores = ', '.join(['%s'] * len(cuentas))
+    cursor.execute(
+        f"UPDATE blobs SET referencias = referencias - CASE ruta {casos} END WHERE ruta IN ({marcadores})",
+        [valor for ruta, veces in cuentas.items() for valor in (ruta, veces)] + list(cuentas)
+    )
+    cursor.execute(f"SELECT ruta FROM blobs WHERE ruta IN ({marcadores}) AND referencias <= 0 FOR UPDATE", list(cuentas))
+    sin_referencias = [fila[0] for fila in cursor.fetchall()]
+    if sin_referencias:
+        marcadores = ', '.join(['%s'] * len(sin_referencias))
+        cursor.execute(f"DELETE FROM blobs WHERE ruta IN ({marcadores})", sin_referencias)
+    return sin_referencias
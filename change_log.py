@@ -0,0 +1,91 @@
+"""
+Registro de cambios de publicaciones y comentarios (tabla `cambios`), para que
+los clientes se sincronicen pidiendo solo lo que cambió desde su última versión.
+
+Cada escritura registra (entidad, id, publicación, operación) con una versión
+creciente en la misma transacción, sin hacer commit. La versión sale de la fila
+única de `cambios_secuencia`: el UPDATE la bloquea hasta el commit, así que las
+versiones quedan en el orden en que se confirman las transacciones y un cliente
+que ya vio la versión N nunca se salta un cambio con versión menor que se
+confirme después. Conviene registrar el cambio justo antes del commit, para
+retener ese bloqueo lo menos posible.
+
+Las filas antiguas se eliminan con `flask user podar-cambios`; una versión
+anterior a lo podado ya no se puede sincronizar (el cliente debe recargar todo).
+Las funciones esperan un cursor de tuplas (el predeterminado de MySQLdb).
+"""
+
+def registrar_cambio(cursor, entidad, entidad_id, publicacion_id, operacion):
+    """
+    Anota un cambio ('crear', 'editar' o 'eliminar') dentro de la transacción actual.
+    Retorna el cambio como diccionario, para publicarlo después del commit.
+    """
+    cursor.execute("UPDATE cambios_secuencia SET version = LAST_INSERT_ID(version + 1) WHERE id = 1")
+    version = cursor.lastrowid # mysql_insert_id() retorna el valor asignado con LAST_INSERT_ID(expr)
+    cursor.execute("""
+        INSERT INTO cambios (version, entidad, entidad_id, publicacion_id, operacion)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (version, entidad, entidad_id, publicacion_id, operacion))
+    return como_evento(version, entidad, entidad_id, publicacion_id, operacion)
+
+
+def registrar_cambios(cursor, cambios):
+    """
+    Como registrar_cambio para varias filas (entidad, entidad_id, publicacion_id, operacion)
+    a la vez: reserva el rango de versiones con un solo UPDATE. Retorna la lista de eventos.
+    """
+    if not cambios:
+        return []
+    cursor.execute("UPDATE cambios_secuencia SET version = LAST_INSERT_ID(version + %s) WHERE id = 1", (len(cambios),))
+    primera = cursor.lastrowid - len(cambios) + 1
+    filas = [(primera + i, *cambio) for i, cambio in enumerate(cambios)]
+    cursor.executemany("""
+        INSERT INTO cambios (version, entidad, entidad_id, publicacion_id, operacion)
+        VALUES (%s, %s, %s, %s, %s)
+    """, filas)
+    return [como_evento(*fila) for fila in filas]
+
+
+def como_evento(version, entidad, entidad_id, publicacion_id, operacion):
+    return {
+        "version": version,
+        "entidad": entidad,
+        "id": entidad_id,
+        "publicacion_id": publicacion_id,
+        "operacion": operacion,
+    }
+
+
+def estado_secuencia(cursor):
+    """Retorna (versión actual, versión hasta la que se podó el registro)."""
+    cursor.execute("SELECT version, podado_hasta FROM cambios_secuencia WHERE id = 1")
+    return cursor.fetchone()
+
+
+def cambios_desde(cursor, version, limite):
+    """
+    Cambios con versión mayor que 'version', en orden, hasta 'limite' filas.
+    Retorna una lista de (version, entidad, entidad_id, publicacion_id, operacion).
+    """
+    cursor.execute("""
+        SELECT version, entidad, entidad_id, publicacion_id, operacion
+        FROM cambios
+        WHERE version > %s
+        ORDER BY version
+        LIMIT %s
+    """, (version, limite))
+    return list(cursor.fetchall())
+
+
+def podar_cambios(cursor, dias):
+    """
+    Elimina los cambios de más de 'dias' días y avanza podado_hasta. No hace commit.
+    Retorna la cantidad de filas eliminadas.
+    """
+    cursor.execute("SELECT MAX(version) FROM cambios WHERE created_at < NOW() - INTERVAL %s DAY", (dias,))
+    hasta = cursor.fetchone()[0]
+    if hasta is None:
+        return 0
+    cursor.execute("UPDATE cambios_secuencia SET podado_hasta = GREATEST(podado_hasta, %s) WHERE id = 1", (hasta,))
+    cursor.execute("DELETE FROM cambios WHERE version <= %s", (hasta,))
+    return cursor.rowcount
@@ -0,0 +1,47 @@
+"""
+Contadores de comentarios por publicación (tabla `publicacion_contadores`).
+
+Las funciones reciben el cursor de la transacción en curso y no hacen commit:
+el contador se actualiza en la misma transacción que el comentario.
+"""
+
+
+def incrementar_comentarios(cursor, publicacion_id):
+    cursor.execute("""
+        INSERT INTO publicacion_contadores (publicacion_id, cantidad_comentarios)
+        VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE cantidad_comentarios = cantidad_comentarios + 1
+    """, (publicacion_id,))
+
+
+def decrementar_comentarios(cursor, publicacion_id):
+    # GREATEST evita que un contador desincronizado baje de cero (columna UNSIGNED).
+    cursor.execute("""
+        UPDATE publicacion_contadores
+        SET cantidad_comentarios = GREATEST(CAST(cantidad_comentarios AS SIGNED) - 1, 0)
+        WHERE publicacion_id = %s
+    """, (publicacion_id,))
+
+
+def eliminar_contadores(cursor, publicacion_id):
+    cursor.execute("DELETE FROM publicacion_contadores WHERE publicacion_id = %s", (publicacion_id,))
+
+
+def reconstruir_contadores(cursor):
+    """
+    Recalcula todos los contadores a partir de `comentarios`.
+    Retorna el total de filas afectadas reportado por MySQL (0 si no había desviación).
+    """
+    cursor.execute("""
+        INSERT INTO publicacion_contadores (publicacion_id, cantidad_comentarios)
+        SELECT publicacion_id, COUNT(*) FROM comentarios GROUP BY publicacion_id
+        ON DUPLICATE KEY UPDATE cantidad_comentarios = VALUES(cantidad_comentarios)
+    """)
+    # ON DUPLICATE KEY reporta 0 filas para los contadores que ya eran correctos.
+    corregidos = cursor.rowcount
+    cursor.execute("""
+        DELETE pc FROM publicacion_contadores pc
+        LEFT JOIN comentarios c ON c.publicacion_id = pc.publicacion_id
+        WHERE c.id IS NULL
+    """)
+    return corregidos + cursor.rowcount
@@ -0,0 +1,313 @@
+"""
+Eventos en vivo de publicaciones y comentarios por Server-Sent Events (GET /eventos).
+
+Las rutas de escritura de user.py publican, después del commit, un evento por
+cada cambio que anotan en el registro de cambios (change_log). El id del evento
+es la versión de ese cambio. El evento solo avisa qué cambió
+({version, entidad, id, publicacion_id, operacion}); el cliente trae los datos
+con /publicaciones/sync. Con ?publicaciones=1,2,3 se reciben solo los eventos
+de esas publicaciones.
+
+- Reanudación: al reconectar, EventSource envía Last-Event-ID (o se pasa
+  ?ultimo_id=N) y los cambios posteriores se reenvían desde la tabla
+  `cambios`. Si son más de EVENTOS_REPLAY_MAX o ya se podaron, se envía un
+  único evento 'sincronizar' para que el cliente use /publicaciones/sync.
+- Cada EVENTOS_HEARTBEAT segundos sin eventos se envía un comentario, para que
+  los proxies no cierren la conexión y para detectar clientes desconectados.
+- Cada conexión espera en una condición, sin consultas periódicas. Aun así, con
+  el servidor de hilos cada conexión ocupa un hilo: para muchas conexiones
+  inactivas conviene gunicorn con workers gevent. EVENTOS_MAX_SUSCRIPTORES
+  limita las conexiones por proceso (503 al superarlo).
+- Un suscriptor que acumula EVENTOS_COLA_MAX eventos sin leer se desconecta;
+  al reconectar se repone con Last-Event-ID.
+
+Con EVENTOS_REDIS_URL (requiere el paquete redis) los eventos se publican en un
+canal de Redis y cada proceso los reparte a sus suscriptores, así que un cambio
+hecho en un worker llega a los clientes conectados a cualquier otro. Sin Redis
+el broker es local al proceso.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import Blueprint, Response, jsonify, request
+
+from db_pool import mysql
+from change_log import estado_secuencia, cambios_desde, como_evento
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+eventos_bp = Blueprint('eventos', __name__)
+
+EVENTOS_HEARTBEAT = float(os.getenv('EVENTOS_HEARTBEAT', '15'))
+EVENTOS_MAX_SUSCRIPTORES = int(os.getenv('EVENTOS_MAX_SUSCRIPTORES', '1000'))
+EVENTOS_COLA_MAX = int(os.getenv('EVENTOS_COLA_MAX', '500'))
+EVENTOS_REPLAY_MAX = int(os.getenv('EVENTOS_REPLAY_MAX', '500'))
+EVENTOS_REDIS_URL = os.getenv('EVENTOS_REDIS_URL')
+EVENTOS_REDIS_CANAL = os.getenv('EVENTOS_REDIS_CANAL', 'eventos_publicaciones')
+EVENTOS_RETRY_MS = 5000 # Espera que EventSource aplica antes de reconectar
+FILTRO_MAX_PUBLICACIONES = 50
+
+
+class DemasiadosSuscriptores(Exception):
+    """Se alcanzó EVENTOS_MAX_SUSCRIPTORES en este proceso."""
+
+
+class Suscripcion:
+    __slots__ = ('publicaciones', 'desbordada', '_pendientes', '_cond')
+
+    def __init__(self, publicaciones):
+        self.publicaciones = publicaciones # frozenset de IDs, o None para todas
+        self.desbordada = False
+        self._pendientes = deque()
+        self._cond = threading.Condition()
+
+    def interesa(self, evento):
+        return self.publicaciones is None or evento['publicacion_id'] in self.publicaciones
+
+    def entregar(self, evento):
+        with self._cond:
+            if len(self._pendientes) >= EVENTOS_COLA_MAX:
+                self.desbordada = True
+            else:
+                self._pendientes.append(evento)
+            self._cond.notify()
+
+    def esperar(self, espera):
+        """Retorna los eventos pendientes, esperando hasta 'espera' segundos si no hay ninguno."""
+        with self._cond:
+            if not self._pendientes and not self.desbordada:
+                self._cond.wait(espera)
+            eventos = list(self._pendientes)
+            self._pendientes.clear()
+            return eventos
+
+
+class BrokerLocal:
+    """Reparte los eventos entre las suscripciones de este proceso."""
+
+    def __init__(self, max_suscriptores=EVENTOS_MAX_SUSCRIPTORES):
+        self.max_suscriptores = max_suscriptores
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+        self.publicados = 0
+        self.entregados = 0
+        self.desbordes = 0
+
+    def suscribir(self, publicaciones=None):
+        suscripcion = Suscripcion(publicaciones)
+        with self._lock:
+            if len(self._suscripciones) >= self.max_suscriptores:
+                raise DemasiadosSuscriptores()
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            if suscripcion in self._suscripciones:
+                self._suscripciones.remove(suscripcion)
+                if suscripcion.desbordada:
+                    self.desbordes += 1
+
+    def _contar_publicado(self):
+        with self._lock:
+            self.publicados += 1
+
+    def publicar(self, evento):
+        self._contar_publicado()
+        self.repartir(evento)
+
+    def repartir(self, evento):
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        entregados = 0
+        for suscripcion in suscripciones:
+            if suscripcion.interesa(evento):
+                suscripcion.entregar(evento)
+                entregados += 1
+        with self._lock:
+            self.entregados += entregados
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "suscriptores": len(self._suscripciones),
+                "max_suscriptores": self.max_suscriptores,
+                "publicados": self.publicados,
+                "entregados": self.entregados,
+                "desbordes": self.desbordes,
+            }
+
+
+class BrokerRedis(BrokerLocal):
+    """
+    Publica en un canal de Redis; un hilo por proceso escucha el canal y reparte
+    localmente, incluidos los eventos que publicó este mismo proceso.
+    """
+
+    def __init__(self, url, canal=EVENTOS_REDIS_CANAL, max_suscriptores=EVENTOS_MAX_SUSCRIPTORES):
+        super().__init__(max_suscriptores)
+        self._cliente = redis.Redis.from_url(url, socket_connect_timeout=0.5)
+        self._canal = canal
+        self._hilo = None
+        self.errores_redis = 0
+
+    def suscribir(self, publicaciones=None):
+        suscripcion = super().suscribir(publicaciones)
+        with self._lock:
+            # El hilo se inicia con el primer suscriptor: un proceso sin conexiones SSE no escucha el canal.
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escuchar, name='eventos-redis', daemon=True)
+                self._hilo.start()
+        return suscripcion
+
+    def publicar(self, evento):
+        self._contar_publicado()
+        try:
+            self._cliente.publish(self._canal, json.dumps(evento))
+        except Exception as e:
+            # Al menos los suscriptores de este proceso reciben el evento.
+            self.errores_redis += 1
+            print(f"Error al publicar el evento {evento.get('version')} en Redis: {e}", file=sys.stderr)
+            self.repartir(evento)
+
+    def _escuchar(self):
+        while True:
+            try:
+                pubsub = self._cliente.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._canal)
+                for mensaje in pubsub.listen():
+                    if mensaje.get('type') == 'message':
+                        self.repartir(json.loads(mensaje['data']))
+            except Exception as e:
+                self.errores_redis += 1
+                print(f"Error escuchando eventos en Redis, se reintenta en 1 s: {e}", file=sys.stderr)
+                time.sleep(1)
+
+    def estadisticas(self):
+        estadisticas = super().estadisticas()
+        estadisticas["errores_redis"] = self.errores_redis
+        return estadisticas
+
+
+def _crear_broker():
+    if EVENTOS_REDIS_URL:
+        if redis is None:
+            print("EVENTOS_REDIS_URL está configurado pero el paquete redis no está instalado; se usan eventos por proceso.", file=sys.stderr)
+        else:
+            return BrokerRedis(EVENTOS_REDIS_URL)
+    return BrokerLocal()
+
+
+broker = _crear_broker()
+
+
+def publicar_cambio(cambio):
+    """Publica un cambio de change_log.registrar_cambio ya confirmado. Nunca falla la solicitud que lo llama."""
+    try:
+        broker.publicar(cambio)
+    except Exception as e:
+        print(f"Error al publicar el evento {cambio.get('version')}: {e}", file=sys.stderr)
+
+
+def _formatear(evento, nombre='cambio'):
+    return f"id: {evento['version']}\nevent: {nombre}\ndata: {json.dumps(evento)}\n\n"
+
+
+def _eventos_perdidos(ultimo_id, publicaciones):
+    """
+    Cambios posteriores a ultimo_id (filtrados) desde el registro, como eventos.
+    Retorna None si no se pueden reponer: demasiados o ya podados.
+    """
+    # Del primario: una réplica atrasada omitiría cambios que la suscripción ya no volverá a recibir.
+    cursor = mysql.connection.cursor()
+    try:
+        _, podado_hasta = estado_secuencia(cursor)
+        if ultimo_id < podado_hasta:
+            return None
+        cambios = cambios_desde(cursor, ultimo_id, EVENTOS_REPLAY_MAX + 1)
+    finally:
+        cursor.close()
+    if len(cambios) > EVENTOS_REPLAY_MAX:
+        return None
+    eventos = [como_evento(*cambio) for cambio in cambios]
+    return [evento for evento in eventos if publicaciones is None or evento['publicacion_id'] in publicaciones]
+
+
+def _flujo(suscripcion, iniciales, ultimo_id):
+    try:
+        yield f"retry: {EVENTOS_RETRY_MS}\n\n"
+        yield from iniciales
+        while True:
+            eventos = suscripcion.esperar(EVENTOS_HEARTBEAT)
+            if suscripcion.desbordada:
+                return # El cliente reconecta con Last-Event-ID y se repone desde el registro
+            if not eventos:
+                yield ": ping\n\n"
+                continue
+            for evento in eventos:
+                # Los publicados mientras se consultaba el registro ya se enviaron en la reposición.
+                if ultimo_id is None or evento['version'] > ultimo_id:
+                    yield _formatear(evento)
+    finally:
+        broker.cancelar(suscripcion)
+
+
+@eventos_bp.route('/eventos', methods=['GET'])
+def eventos():
+    # Público, igual que /publicaciones. Uso: new EventSource('/eventos?publicaciones=1,2,3')
+    try:
+        publicaciones = request.args.get('publicaciones')
+        if publicaciones:
+            publicaciones = frozenset(int(i) for i in publicaciones.split(',') if i.strip())
+            if len(publicaciones) > FILTRO_MAX_PUBLICACIONES:
+                return jsonify({"error": f"Se permiten como máximo {FILTRO_MAX_PUBLICACIONES} publicaciones por conexión."}), 400
+        else:
+            publicaciones = None
+        ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        return jsonify({"error": "Los parámetros 'publicaciones' y 'ultimo_id' deben ser números enteros."}), 400
+
+    try:
+        # Primero la suscripción y después la reposición: un cambio publicado entre ambas no se pierde.
+        suscripcion = broker.suscribir(publicaciones)
+    except DemasiadosSuscriptores:
+        respuesta = jsonify({"error": "Demasiadas conexiones de eventos. Inténtalo más tarde."})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = '30'
+        return respuesta
+
+    iniciales = []
+    if ultimo_id is not None:
+        try:
+            # Se consulta aquí y no en el generador: la conexión vuelve al pool al terminar la vista,
+            # no cuando se cierra el flujo.
+            perdidos = _eventos_perdidos(ultimo_id, publicaciones)
+        except Exception as e:
+            print(f"Error al reponer eventos desde {ultimo_id}: {e}", file=sys.stderr)
+            perdidos = None
+        if perdidos is None:
+            iniciales.append(f"event: sincronizar\ndata: {json.dumps({'desde': ultimo_id})}\n\n")
+        else:
+            iniciales.extend(_formatear(evento) for evento in perdidos)
+            if perdidos:
+                ultimo_id = perdidos[-1]['version']
+
+    respuesta = Response(
+        _flujo(suscripcion, iniciales, ultimo_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no', # Que un proxy nginx entregue cada evento en cuanto se escribe
+        },
+    )
+    # También si el cliente se desconecta antes de que el generador empiece a ejecutarse.
+    respuesta.call_on_close(lambda: broker.cancelar(suscripcion))
+    return respuesta
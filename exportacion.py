@@ -0,0 +1,165 @@
+"""
+Exportación completa de tablas como JSON por línea (NDJSON), para analítica y respaldos.
+
+Las filas se leen con un cursor sin búfer del lado del servidor (SSDictCursor)
+en lotes de EXPORT_LOTE con fetchmany, y cada una se escribe en cuanto llega
+desde un generador: la memoria del worker no depende del tamaño de la tabla.
+El recorrido es por clave primaria (ORDER BY id), así que un volcado cortado
+se retoma con desde_id = último id recibido.
+
+La exportación usa una conexión propia fuera del pool (de la réplica si está
+configurada), para no ocupar un cupo de MYSQL_POOL_SIZE mientras dura. Como
+mucho EXPORT_MAX_CONCURRENTES exportaciones por proceso a la vez.
+
+- GET /exportar/<tabla>?desde_id=N con la cabecera X-Export-Token igual a
+  EXPORT_TOKEN. Sin EXPORT_TOKEN configurado la ruta responde 404.
+- flask exportacion volcar <tabla> [--salida archivo] [--desde-id N]
+"""
+import hmac
+import json
+import os
+import sys
+import threading
+import traceback
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from MySQLdb.cursors import SSDictCursor
+
+from db_pool import mysql
+
+exportacion_bp = Blueprint('exportacion', __name__)
+
+EXPORT_TOKEN = os.getenv('EXPORT_TOKEN')
+EXPORT_LOTE = int(os.getenv('EXPORT_LOTE', '1000'))
+EXPORT_MAX_CONCURRENTES = int(os.getenv('EXPORT_MAX_CONCURRENTES', '2'))
+EXPORT_NET_WRITE_TIMEOUT = 600 # segundos que MySQL espera a un lector lento antes de cortar el resultado
+
+# tabla -> (columnas, columnas JSON que se decodifican)
+TABLAS_EXPORTABLES = {
+    'publicaciones': (('id', 'autor_id', 'titulo', 'texto', 'created_at'), ()),
+    'comentarios': (('id', 'publicacion_id', 'autor_id', 'texto', 'created_at'), ()),
+    'imagenes_publicacion': (('id', 'publicacion_id', 'url', 'orden', 'variantes'), ('variantes',)),
+}
+
+_cupos = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENTES)
+
+
+def _valor_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, bytes):
+        return valor.decode('utf-8', 'replace')
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def filas_ndjson(conexion, tabla, desde_id=0, lote=EXPORT_LOTE):
+    """
+    Genera cada fila de 'tabla' con id > desde_id como una línea JSON.
+    No cierra la conexión; el cursor se cierra aunque el consumidor abandone el generador.
+    """
+    columnas, columnas_json = TABLAS_EXPORTABLES[tabla]
+    cursor = conexion.cursor(SSDictCursor)
+    try:
+        cursor.execute(f"SET SESSION net_write_timeout = {EXPORT_NET_WRITE_TIMEOUT}")
+        cursor.execute(
+            f"SELECT {', '.join(columnas)} FROM {tabla} WHERE id > %s ORDER BY id",
+            (desde_id,)
+        )
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            for fila in filas:
+                for columna in columnas_json:
+                    if isinstance(fila[columna], (str, bytes)):
+                        fila[columna] = json.loads(fila[columna])
+                yield json.dumps(fila, ensure_ascii=False, default=_valor_json) + '\n'
+    finally:
+        # Con un cursor sin búfer, close() descarta en el servidor las filas que no se leyeron.
+        cursor.close()
+
+
+def _token_valido():
+    recibido = request.headers.get('X-Export-Token', '')
+    return hmac.compare_digest(recibido.encode('utf-8'), EXPORT_TOKEN.encode('utf-8'))
+
+
+@exportacion_bp.route('/exportar/<tabla>', methods=['GET'])
+def exportar(tabla):
+    if not EXPORT_TOKEN:
+        return jsonify({"error": "Recurso no encontrado."}), 404
+    if not _token_valido():
+        return jsonify({"error": "No autorizado."}), 401
+    if tabla not in TABLAS_EXPORTABLES:
+        return jsonify({"error": f"Tabla no exportable. Opciones: {', '.join(TABLAS_EXPORTABLES)}."}), 404
+    try:
+        desde_id = int(request.args.get('desde_id', 0))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'desde_id' debe ser un número entero."}), 400
+
+    if not _cupos.acquire(blocking=False):
+        respuesta = jsonify({"error": "Ya hay demasiadas exportaciones en curso. Inténtalo más tarde."})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = '30'
+        return respuesta
+    try:
+        conexion = mysql.conexion_dedicada()
+    except Exception as e:
+        _cupos.release()
+        print(f"Error al abrir la conexión para exportar {tabla}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al exportar."}), 500
+
+    def generar():
+        try:
+            yield from filas_ndjson(conexion, tabla, desde_id)
+        except Exception as e:
+            # El 200 ya se envió: relanzar corta la conexión sin el último fragmento, y el cliente ve
+            # una transferencia incompleta en lugar de un archivo truncado que parece válido.
+            print(f"Error durante la exportación de {tabla}: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            raise
+
+    def liberar():
+        try:
+            conexion.close()
+        finally:
+            _cupos.release()
+
+    respuesta = Response(
+        stream_with_context(generar()),
+        mimetype='application/x-ndjson',
+        headers={
+            'Content-Disposition': f'attachment; filename="{tabla}.ndjson"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no', # Que un proxy nginx no acumule la respuesta completa
+        },
+    )
+    # Se libera al cerrar la respuesta, también si el cliente se desconecta antes de empezar a leer.
+    respuesta.call_on_close(liberar)
+    return respuesta
+
+
+@exportacion_bp.cli.command('volcar')
+@click.argument('tabla', type=click.Choice(list(TABLAS_EXPORTABLES)))
+@click.option('--salida', type=click.Path(dir_okay=False, writable=True), help='Archivo NDJSON (por defecto, la salida estándar).')
+@click.option('--desde-id', type=int, default=0, help='Exportar solo las filas con id mayor.')
+def volcar(tabla, salida, desde_id):
+    """Exporta TABLA como JSON por línea."""
+    conexion = mysql.conexion_dedicada()
+    archivo = open(salida, 'w', encoding='utf-8') if salida else sys.stdout
+    filas = 0
+    try:
+        for linea in filas_ndjson(conexion, tabla, desde_id):
+            archivo.write(linea)
+            filas += 1
+    finally:
+        if salida:
+            archivo.close()
+        conexion.close()
+    click.echo(f"{filas} filas de {tabla} exportadas.", err=True)
@@ -0,0 +1,91 @@
+"""
+Caché en memoria (por proceso) de las páginas serializadas de /publicaciones.
+
+Cada entrada guarda el cuerpo JSON ya serializado, su ETag fuerte y la versión
+del registro de cambios (`cambios_secuencia`) con la que se calculó. Cada
+solicitud lee la versión actual del primario (una consulta por clave primaria) y
+solo acepta entradas de esa misma versión: toda escritura que cambia el feed
+registra un cambio, así que una escritura hecha en otro worker también deja
+obsoletas las páginas de este. Un acierto con If-None-Match coincidente se
+resuelve con 304 sin consultar las publicaciones.
+Las rutas de escritura llaman además a invalidar() después de su commit, lo que
+libera enseguida la memoria de las páginas del worker que escribió.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class FeedCache:
+    def __init__(self, max_entradas=256, max_bytes=8 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (cuerpo, etag, version)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    @staticmethod
+    def calcular_etag(cuerpo):
+        return hashlib.sha256(cuerpo).hexdigest()
+
+    def obtener(self, clave, version):
+        """
+        Retorna (cuerpo, etag) si hay una entrada calculada con 'version', marcándola
+        como usada recientemente; si no hay o es de otra versión, None.
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[2] != version:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[:2]
+
+    def guardar(self, clave, cuerpo, version):
+        """
+        Guarda una página serializada calculada con 'version' (leída antes de consultar)
+        y retorna su ETag. Si mientras tanto se confirmó otra escritura, la versión
+        siguiente ya no acepta la entrada.
+        """
+        etag = self.calcular_etag(cuerpo)
+        if len(cuerpo) > self.max_bytes:
+            return etag
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[0])
+            self._entradas[clave] = (cuerpo, etag, version)
+            self._bytes += len(cuerpo)
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (cuerpo_expulsado, _, _) = self._entradas.popitem(last=False)
+                self._bytes -= len(cuerpo_expulsado)
+                self.expulsiones += 1
+        return etag
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_entradas": self.max_entradas,
+                "max_bytes": self.max_bytes,
+            }
+
+
+feed_cache = FeedCache(
+    max_entradas=int(os.getenv('FEED_CACHE_MAX_ENTRIES', '256')),
+    max_bytes=int(os.getenv('FEED_CACHE_MAX_BYTES', str(8 * 1024 * 1024))),
+)
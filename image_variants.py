@@ -0,0 +1,143 @@
+"""
+Generación de variantes de imágenes subidas (miniaturas redimensionadas en WebP y,
+si Pillow lo soporta, AVIF) en un pool de hilos, fuera de la solicitud.
+
+Las variantes se guardan en el almacén direccionado por contenido (blob_store)
+y sus URLs se registran como JSON junto a la original:
+    imagenes_publicacion.variantes / users.foto_perfil_variantes
+con la forma {"thumb": {"webp": url, "avif": url}, "card": {...}}.
+"""
+import json
+import os
+import sys
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from db_pool import mysql
+from blob_store import guardar_archivo, url_de_blob, ruta_relativa_de_url, agregar_referencia, comprobar_reutilizados
+from feed_cache import feed_cache
+from change_log import registrar_cambio
+from eventos import publicar_cambio
+from upload_gc import descartar_nuevos
+
+try:
+    import pillow_avif # noqa: F401  Registra AVIF en versiones de Pillow sin soporte nativo
+except ImportError:
+    pass
+
+# Ancho máximo de cada variante, en píxeles
+TAMANOS_VARIANTES = {
+    'thumb': 320,  # Imágenes adicionales y fotos de perfil
+    'card': 800,   # Imagen principal de una publicación en el feed
+}
+CALIDAD = {'webp': 80, 'avif': 60}
+
+Image.init()
+FORMATOS_VARIANTES = ['webp'] + (['avif'] if 'AVIF' in Image.SAVE else [])
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='variantes')
+
+
+def generar_variantes(ruta_original, upload_folder, base_url):
+    """
+    Genera las variantes en un directorio temporal y las guarda en el almacén de blobs.
+    Retorna (diccionario de URLs por tamaño y formato, lista de Blob guardados).
+    """
+    variantes = {}
+    blobs = []
+    with tempfile.TemporaryDirectory() as directorio, Image.open(ruta_original) as original:
+        imagen = ImageOps.exif_transpose(original)
+        if imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGBA' if 'transparency' in imagen.info else 'RGB')
+        for nombre, ancho in TAMANOS_VARIANTES.items():
+            copia = imagen.copy()
+            copia.thumbnail((ancho, ancho * 4)) # Solo limita el ancho; nunca amplía
+            for formato in FORMATOS_VARIANTES:
+                ruta_tmp = os.path.join(directorio, f"{nombre}.{formato}")
+                copia.save(ruta_tmp, formato.upper(), quality=CALIDAD[formato])
+                blob = guardar_archivo(ruta_tmp, formato, upload_folder)
+                blobs.append(blob)
+                variantes.setdefault(nombre, {})[formato] = url_de_blob(base_url, blob.ruta_relativa)
+    return variantes, blobs
+
+
+def rutas_de_variantes(variantes_json):
+    """Retorna las rutas relativas de blob de todas las variantes de un JSON de variantes."""
+    if not variantes_json:
+        return []
+    variantes = json.loads(variantes_json) if isinstance(variantes_json, str) else variantes_json
+    return [ruta_relativa_de_url(url) for formatos in variantes.values() for url in formatos.values()]
+
+
+def _procesar(app, descripcion, ruta_original, base_url, sql, parametros, antes_del_commit=None):
+    """
+    Genera las variantes y ejecuta 'sql' (un UPDATE con un marcador inicial para el JSON).
+    Si el UPDATE no afecta filas, la imagen ya no está en uso: se descartan las variantes nuevas.
+    'antes_del_commit(cursor)' se ejecuta en la misma transacción, justo antes del commit.
+    """
+    blobs = []
+    upload_folder = app.config.get('UPLOAD_FOLDER')
+    try:
+        variantes, blobs = generar_variantes(ruta_original, upload_folder, base_url)
+        with app.app_context():
+            cursor = mysql.connection.cursor()
+            try:
+                cursor.execute(sql, (json.dumps(variantes),) + parametros)
+                if cursor.rowcount == 0:
+                    mysql.connection.rollback()
+                    descartar_nuevos(blobs)
+                    return False
+                for blob in blobs:
+                    agregar_referencia(cursor, blob)
+                comprobar_reutilizados(upload_folder, blobs)
+                if antes_del_commit is not None:
+                    antes_del_commit(cursor)
+                mysql.connection.commit()
+                return True
+            except Exception:
+                mysql.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+    except Exception as e:
+        with app.app_context():
+            descartar_nuevos(blobs)
+        print(f"Error al generar variantes de {descripcion}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return False
+
+
+def _procesar_imagen_publicacion(app, imagen_id, ruta_original, base_url):
+    # Las URLs del feed pasan a las variantes: los clientes sincronizados deben volver a pedir la publicación.
+    cambios = []
+
+    def registrar(cursor):
+        cursor.execute("SELECT publicacion_id FROM imagenes_publicacion WHERE id = %s", (imagen_id,))
+        publicacion_id = cursor.fetchone()[0]
+        cambios.append(registrar_cambio(cursor, 'publicacion', publicacion_id, publicacion_id, 'editar'))
+
+    if _procesar(app, f"la imagen de publicación {imagen_id}", ruta_original, base_url,
+                 "UPDATE imagenes_publicacion SET variantes = %s WHERE id = %s AND variantes IS NULL",
+                 (imagen_id,), registrar):
+        feed_cache.invalidar()
+        for cambio in cambios:
+            publicar_cambio(cambio)
+
+
+def _procesar_foto_perfil(app, user_id, ruta_original, base_url, url):
+    # La condición sobre foto_perfil evita asignar variantes a una foto que ya fue reemplazada.
+    _procesar(app, f"la foto de perfil del usuario {user_id}", ruta_original, base_url,
+              "UPDATE users SET foto_perfil_variantes = %s WHERE id = %s AND foto_perfil = %s AND foto_perfil_variantes IS NULL",
+              (user_id, url))
+
+
+def programar_variantes_publicacion(app, imagen_id, ruta_original, base_url):
+    _pool.submit(_procesar_imagen_publicacion, app, imagen_id, ruta_original, base_url)
+
+
+def programar_variantes_perfil(app, user_id, ruta_original, base_url, url):
+    _pool.submit(_procesar_foto_perfil, app, user_id, ruta_original, base_url, url)
@@ -0,0 +1,112 @@
+"""
+Autenticación JWT compartida por los blueprints.
+
+El token emitido por auth.login lleva todos los claims que necesitan las rutas
+(user_id, username, email, verificado), así que autorizar una solicitud no
+requiere consultar MySQL.
+"""
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+import jwt
+from jwt.algorithms import HMACAlgorithm
+
+JWT_ALGORITMO = 'HS256'
+JWT_EXPIRATION_DELTA = timedelta(hours=1) # El token expirará en 1 hora
+
+_SIN_USUARIO = object()
+
+
+@dataclass(frozen=True)
+class UsuarioActual:
+    user_id: int
+    username: str
+    email: str
+    verificado: bool
+
+    @classmethod
+    def desde_claims(cls, claims):
+        # Los tokens emitidos antes de incluir 'verificado' y 'email' se tratan como inválidos
+        # para forzar un nuevo login en lugar de responder 403 a un usuario verificado.
+        if 'user_id' not in claims or 'verificado' not in claims:
+            return None
+        return cls(
+            user_id=claims['user_id'],
+            username=claims.get('username'),
+            email=claims.get('email'),
+            verificado=bool(claims['verificado']),
+        )
+
+
+def _clave_jwt():
+    """
+    Retorna la clave HS256 ya preparada, calculada una vez por aplicación.
+    Lanza RuntimeError si JWT_SECRET_KEY no está configurada.
+    """
+    estado = current_app.extensions.setdefault('jwt_auth', {})
+    clave = estado.get('clave')
+    if clave is None:
+        secreto = current_app.config.get('JWT_SECRET_KEY')
+        if not secreto:
+            raise RuntimeError("JWT_SECRET_KEY no está configurada en app.config.")
+        clave = HMACAlgorithm(HMACAlgorithm.SHA256).prepare_key(secreto)
+        estado['clave'] = clave
+    return clave
+
+
+def generar_token(user_id, username, email, verificado):
+    payload = {
+        'user_id': user_id,
+        'username': username,
+        'email': email,
+        'verificado': bool(verificado),
+        'exp': datetime.utcnow() + JWT_EXPIRATION_DELTA
+    }
+    return jwt.encode(payload, _clave_jwt(), algorithm=JWT_ALGORITMO)
+
+
+def usuario_desde_request():
+    """
+    Decodifica el token Bearer de la solicitud actual (una sola vez por solicitud).
+    Retorna un UsuarioActual o None si el token falta, expiró o es inválido.
+    """
+    usuario = g.get('_usuario_jwt', _SIN_USUARIO)
+    if usuario is not _SIN_USUARIO:
+        return usuario
+
+    usuario = None
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            claims = jwt.decode(auth_header[7:], _clave_jwt(), algorithms=[JWT_ALGORITMO])
+            usuario = UsuarioActual.desde_claims(claims)
+        except jwt.InvalidTokenError: # Incluye ExpiredSignatureError
+            usuario = None
+        except RuntimeError as e:
+            # Sin JWT_SECRET_KEY ningún token es verificable: se responde como a un token inválido, no con 500.
+            print(f"Error al verificar el token JWT: {e}", file=sys.stderr)
+            usuario = None
+    g._usuario_jwt = usuario
+    return usuario
+
+
+def requiere_auth(verificado=True):
+    """
+    Decorador para rutas protegidas. Deja el usuario autenticado en g.usuario.
+    Con verificado=True además exige que la cuenta esté verificada.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            usuario = usuario_desde_request()
+            if usuario is None:
+                return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
+            if verificado and not usuario.verificado:
+                return jsonify({"error": "Usuario no verificado."}), 403
+            g.usuario = usuario
+            return vista(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,368 @@
+"""
+Clasificación en memoria por dificultad sobre la tabla `partidas`.
+
+Cada dificultad mantiene una skip list indexable (con la distancia de cada
+enlace, como los sorted sets de Redis) ordenada por (-puntaje, user_id), lo que
+permite top-K, posición de un jugador y "jugadores alrededor" en O(log n) sin
+ordenar `partidas` en cada consulta. Se carga desde MySQL la primera vez que se
+consulta y después se actualiza con registrar_puntaje() en cada escritura de puntaje.
+
+Las tablas viven en memoria de cada proceso: con varios workers, cada uno solo
+aplica al instante sus propios puntajes. Para ver los de los demás, las tablas se
+recargan desde `partidas` en un hilo aparte cuando tienen más de
+CLASIFICACION_REFRESCO segundos. Los puntajes registrados en el proceso durante
+los CLASIFICACION_MARGEN segundos previos a una recarga se vuelven a aplicar
+encima, porque con la escritura diferida de score_ingest pueden no estar aún en
+MySQL.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+from flask import Blueprint, current_app, g, jsonify, request
+
+from db_pool import mysql
+from jwt_auth import requiere_auth
+
+leaderboard_bp = Blueprint('leaderboard', __name__)
+
+NIVEL_MAXIMO = 32
+PROBABILIDAD_NIVEL = 0.25
+TOP_POR_DEFECTO = 10
+TOP_MAXIMO = 100
+RADIO_MAXIMO = 25
+CLASIFICACION_REFRESCO = float(os.getenv('CLASIFICACION_REFRESCO', '60'))
+CLASIFICACION_MARGEN = float(os.getenv('CLASIFICACION_MARGEN', '60'))
+MAX_RECIENTES = 10000
+
+
+class _Nodo:
+    __slots__ = ('clave', 'siguientes', 'saltos')
+
+    def __init__(self, clave, nivel):
+        self.clave = clave
+        self.siguientes = [None] * nivel
+        self.saltos = [0] * nivel # Cuántas posiciones avanza cada enlace
+
+
+class ListaSaltos:
+    """Skip list indexable: insertar, eliminar, posición de una clave y acceso por posición en O(log n)."""
+
+    def __init__(self):
+        self._cabeza = _Nodo(None, NIVEL_MAXIMO)
+        self._nivel = 1
+        self._tamano = 0
+
+    def __len__(self):
+        return self._tamano
+
+    @staticmethod
+    def _nivel_aleatorio():
+        nivel = 1
+        while nivel < NIVEL_MAXIMO and random.random() < PROBABILIDAD_NIVEL:
+            nivel += 1
+        return nivel
+
+    def insertar(self, clave):
+        actualizar = [None] * NIVEL_MAXIMO
+        posiciones = [0] * NIVEL_MAXIMO
+        x = self._cabeza
+        posicion = 0
+        for i in reversed(range(self._nivel)):
+            while x.siguientes[i] is not None and x.siguientes[i].clave < clave:
+                posicion += x.saltos[i]
+                x = x.siguientes[i]
+            actualizar[i] = x
+            posiciones[i] = posicion
+
+        nivel = self._nivel_aleatorio()
+        if nivel > self._nivel:
+            for i in range(self._nivel, nivel):
+                actualizar[i] = self._cabeza
+                posiciones[i] = 0
+                self._cabeza.saltos[i] = self._tamano
+            self._nivel = nivel
+
+        nodo = _Nodo(clave, nivel)
+        for i in range(nivel):
+            nodo.siguientes[i] = actualizar[i].siguientes[i]
+            actualizar[i].siguientes[i] = nodo
+            nodo.saltos[i] = actualizar[i].saltos[i] - (posicion - posiciones[i])
+            actualizar[i].saltos[i] = posicion - posiciones[i] + 1
+        for i in range(nivel, self._nivel):
+            actualizar[i].saltos[i] += 1
+        self._tamano += 1
+
+    def eliminar(self, clave):
+        actualizar = [None] * NIVEL_MAXIMO
+        x = self._cabeza
+        for i in reversed(range(self._nivel)):
+            while x.siguientes[i] is not None and x.siguientes[i].clave < clave:
+                x = x.siguientes[i]
+            actualizar[i] = x
+        x = x.siguientes[0]
+        if x is None or x.clave != clave:
+            return False
+
+        for i in range(self._nivel):
+            if actualizar[i].siguientes[i] is x:
+                actualizar[i].saltos[i] += x.saltos[i] - 1
+                actualizar[i].siguientes[i] = x.siguientes[i]
+            else:
+                actualizar[i].saltos[i] -= 1
+        while self._nivel > 1 and self._cabeza.siguientes[self._nivel - 1] is None:
+            self._nivel -= 1
+        self._tamano -= 1
+        return True
+
+    def posicion(self, clave):
+        """Posición (desde 1) de la clave, o None si no está."""
+        x = self._cabeza
+        posicion = 0
+        for i in reversed(range(self._nivel)):
+            while x.siguientes[i] is not None and x.siguientes[i].clave <= clave:
+                posicion += x.saltos[i]
+                x = x.siguientes[i]
+            if x.clave == clave:
+                return posicion
+        return None
+
+    def desde(self, posicion, cantidad):
+        """Retorna hasta 'cantidad' claves a partir de la posición indicada (desde 1)."""
+        if posicion < 1 or posicion > self._tamano:
+            return []
+        x = self._cabeza
+        recorrido = 0
+        for i in reversed(range(self._nivel)):
+            while x.siguientes[i] is not None and recorrido + x.saltos[i] <= posicion:
+                recorrido += x.saltos[i]
+                x = x.siguientes[i]
+            if recorrido == posicion:
+                break
+        claves = []
+        while x is not None and len(claves) < cantidad:
+            claves.append(x.clave)
+            x = x.siguientes[0]
+        return claves
+
+
+class TablaClasificacion:
+    """Clasificación de una dificultad. Guarda el mejor puntaje de cada jugador."""
+
+    def __init__(self):
+        self._lista = ListaSaltos()
+        self._claves = {} # user_id -> (-puntaje, user_id)
+
+    def __len__(self):
+        return len(self._lista)
+
+    def registrar(self, user_id, puntaje):
+        """Registra un puntaje; solo reemplaza al anterior si es mejor. Retorna True si cambió."""
+        anterior = self._claves.get(user_id)
+        if anterior is not None:
+            if -anterior[0] >= puntaje:
+                return False
+            self._lista.eliminar(anterior)
+        clave = (-puntaje, user_id)
+        self._lista.insertar(clave)
+        self._claves[user_id] = clave
+        return True
+
+    def _entradas(self, posicion, claves):
+        return [(posicion + i, clave[1], -clave[0]) for i, clave in enumerate(claves)]
+
+    def top(self, k):
+        return self._entradas(1, self._lista.desde(1, k))
+
+    def posicion(self, user_id):
+        clave = self._claves.get(user_id)
+        return self._lista.posicion(clave) if clave else None
+
+    def alrededor(self, user_id, radio):
+        posicion = self.posicion(user_id)
+        if posicion is None:
+            return []
+        inicio = max(1, posicion - radio)
+        return self._entradas(inicio, self._lista.desde(inicio, posicion - inicio + radio + 1))
+
+
+class Clasificaciones:
+    def __init__(self):
+        self._tablas = {}     # dificultad_id -> TablaClasificacion
+        self._nombres = {}    # user_id -> username
+        self._recientes = {}  # (dificultad_id, user_id) -> (puntaje, instante) registrados en este proceso
+        self._lock = threading.RLock()
+        self._lock_carga = threading.Lock() # Una sola consulta a `partidas` a la vez
+        self._cargada = False
+        self._cargada_en = float('-inf')
+        self._tope_recientes = MAX_RECIENTES
+
+    def calentar(self):
+        """Carga el mejor puntaje de cada jugador por dificultad. Requiere contexto de aplicación."""
+        with self._lock_carga:
+            self._cargar()
+
+    def _cargar(self):
+        # La consulta se hace sin self._lock: mientras tanto se sigue respondiendo con las tablas anteriores.
+        inicio = time.monotonic()
+        cursor = mysql.connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT pa.dificultad_id, pa.user_id, u.username, MAX(pa.puntaje_actual)
+                FROM partidas pa
+                JOIN users u ON u.id = pa.user_id
+                GROUP BY pa.dificultad_id, pa.user_id, u.username
+            """)
+            filas = cursor.fetchall()
+        finally:
+            cursor.close()
+        tablas = {}
+        nombres = {}
+        for dificultad_id, user_id, username, puntaje in filas:
+            tablas.setdefault(dificultad_id, TablaClasificacion()).registrar(user_id, puntaje)
+            nombres[user_id] = username
+        with self._lock:
+            # Lo registrado aquí durante la consulta, o aún sin volcar por la escritura diferida, puede no
+            # estar en 'filas': se vuelve a aplicar encima (registrar conserva el mejor puntaje).
+            self._podar_recientes(inicio)
+            for (dificultad_id, user_id), (puntaje, _) in self._recientes.items():
+                tablas.setdefault(dificultad_id, TablaClasificacion()).registrar(user_id, puntaje)
+                if user_id not in nombres and user_id in self._nombres:
+                    nombres[user_id] = self._nombres[user_id]
+            self._tablas = tablas
+            self._nombres = nombres
+            self._cargada = True
+            self._cargada_en = inicio
+
+    def _podar_recientes(self, referencia):
+        limite = referencia - CLASIFICACION_MARGEN
+        self._recientes = {clave: valor for clave, valor in self._recientes.items() if valor[1] >= limite}
+        # Si casi todo es reciente, no se vuelve a podar en cada registro.
+        self._tope_recientes = max(MAX_RECIENTES, 2 * len(self._recientes))
+
+    def _asegurar_cargada(self):
+        if not self._cargada:
+            with self._lock_carga:
+                if not self._cargada:
+                    self._cargar()
+        elif time.monotonic() - self._cargada_en >= CLASIFICACION_REFRESCO:
+            self._refrescar_en_segundo_plano()
+
+    def _refrescar_en_segundo_plano(self):
+        """Recarga las tablas en otro hilo, para incluir los puntajes que registraron otros workers."""
+        if not self._lock_carga.acquire(blocking=False):
+            return # Ya hay una carga en curso
+        self._cargada_en = time.monotonic() # Si la recarga falla, se reintenta tras otro intervalo
+        app = current_app._get_current_object()
+
+        def refrescar():
+            try:
+                with app.app_context():
+                    self._cargar()
+            except Exception as e:
+                print(f"Error al refrescar las clasificaciones: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                self._lock_carga.release()
+
+        threading.Thread(target=refrescar, name='refresco-clasificaciones', daemon=True).start()
+
+    def registrar_puntaje(self, user_id, dificultad_id, puntaje, username=None):
+        # Sin consultas: antes de la primera carga solo se anota, y la carga lo aplica encima.
+        ahora = time.monotonic()
+        with self._lock:
+            anterior = self._recientes.get((dificultad_id, user_id))
+            self._recientes[(dificultad_id, user_id)] = (max(puntaje, anterior[0]) if anterior else puntaje, ahora)
+            if len(self._recientes) >= self._tope_recientes:
+                self._podar_recientes(ahora)
+            # El nombre que llega del token puede ser anterior a un cambio de username: solo se usa para
+            # usuarios aún sin nombre; los conocidos se mantienen desde la carga y desde renombrar().
+            if username and user_id not in self._nombres:
+                self._nombres[user_id] = username
+            if self._cargada:
+                self._tablas.setdefault(dificultad_id, TablaClasificacion()).registrar(user_id, puntaje)
+
+    def renombrar(self, user_id, username):
+        with self._lock:
+            if user_id in self._nombres:
+                self._nombres[user_id] = username
+
+    def _serializar(self, entradas):
+        return [
+            {"posicion": posicion, "user_id": user_id, "username": self._nombres.get(user_id), "puntaje": puntaje}
+            for posicion, user_id, puntaje in entradas
+        ]
+
+    def top(self, dificultad_id, k):
+        self._asegurar_cargada()
+        with self._lock:
+            tabla = self._tablas.get(dificultad_id)
+            return (len(tabla), self._serializar(tabla.top(k))) if tabla else (0, [])
+
+    def posicion(self, dificultad_id, user_id):
+        self._asegurar_cargada()
+        with self._lock:
+            tabla = self._tablas.get(dificultad_id)
+            return (len(tabla), tabla.posicion(user_id)) if tabla else (0, None)
+
+    def alrededor(self, dificultad_id, user_id, radio):
+        self._asegurar_cargada()
+        with self._lock:
+            tabla = self._tablas.get(dificultad_id)
+            return (len(tabla), self._serializar(tabla.alrededor(user_id, radio))) if tabla else (0, [])
+
+
+clasificaciones = Clasificaciones()
+
+
+def _entero_acotado(nombre, por_defecto, maximo):
+    return max(1, min(int(request.args.get(nombre, por_defecto)), maximo))
+
+
+@leaderboard_bp.route('/leaderboard/<int:dificultad_id>', methods=['GET'])
+def top_jugadores(dificultad_id):
+    try:
+        limite = _entero_acotado('limite', TOP_POR_DEFECTO, TOP_MAXIMO)
+    except ValueError:
+        return jsonify({"error": "El parámetro 'limite' debe ser un número entero."}), 400
+    try:
+        total, jugadores = clasificaciones.top(dificultad_id, limite)
+        return jsonify({"dificultad": dificultad_id, "total": total, "jugadores": jugadores}), 200
+    except Exception as e:
+        print(f"Error en /leaderboard/{dificultad_id}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al obtener la clasificación."}), 500
+
+
+@leaderboard_bp.route('/leaderboard/<int:dificultad_id>/usuario/<int:user_id>', methods=['GET'])
+def posicion_jugador(dificultad_id, user_id):
+    try:
+        total, posicion = clasificaciones.posicion(dificultad_id, user_id)
+        if posicion is None:
+            return jsonify({"error": "El jugador no tiene puntaje en esta dificultad."}), 404
+        return jsonify({"dificultad": dificultad_id, "user_id": user_id, "posicion": posicion, "total": total}), 200
+    except Exception as e:
+        print(f"Error en /leaderboard/{dificultad_id}/usuario/{user_id}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al obtener la posición."}), 500
+
+
+@leaderboard_bp.route('/leaderboard/<int:dificultad_id>/alrededor', methods=['GET'])
+@requiere_auth()
+def jugadores_alrededor(dificultad_id):
+    try:
+        radio = _entero_acotado('radio', 5, RADIO_MAXIMO)
+    except ValueError:
+        return jsonify({"error": "El parámetro 'radio' debe ser un número entero."}), 400
+    try:
+        total, jugadores = clasificaciones.alrededor(dificultad_id, g.usuario.user_id, radio)
+        if not jugadores:
+            return jsonify({"error": "No tienes puntaje en esta dificultad."}), 404
+        return jsonify({"dificultad": dificultad_id, "total": total, "jugadores": jugadores}), 200
+    except Exception as e:
+        print(f"Error en /leaderboard/{dificultad_id}/alrededor: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al obtener la clasificación."}), 500
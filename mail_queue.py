@@ -0,0 +1,236 @@
+"""
+Cola de envío de correos en segundo plano.
+
+Las rutas solo encolan el mensaje y responden; un grupo de hilos trabajadores
+lo entrega reutilizando una sesión SMTP autenticada por hilo. Los envíos
+fallidos se reintentan con espera exponencial y, agotados los intentos, se
+guardan en un archivo de mensajes muertos (JSON por línea).
+
+Para pruebas locales basta con un servidor SMTP de depuración, por ejemplo:
+    python -m aiosmtpd -n -l localhost:8025
+    MAIL_HOST=localhost MAIL_PORT=8025 MAIL_USE_TLS=0 MAIL_USER= MAIL_PASS=
+"""
+import atexit
+import heapq
+import itertools
+import json
+import os
+import smtplib
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from email.header import Header
+from email.mime.text import MIMEText
+
+from dotenv import load_dotenv
+
+from metrics import duracion_smtp
+
+load_dotenv()
+
+MAIL_USER = os.getenv('MAIL_USER')
+MAIL_PASS = os.getenv('MAIL_PASS')
+MAIL_FROM = os.getenv('MAIL_FROM') or MAIL_USER or 'no-reply@localhost'
+MAIL_HOST = os.getenv('MAIL_HOST', 'smtp.gmail.com')
+MAIL_PORT = int(os.getenv('MAIL_PORT', '587'))
+MAIL_USE_TLS = os.getenv('MAIL_USE_TLS', '1') == '1'
+MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', '2'))
+MAIL_MAX_INTENTOS = int(os.getenv('MAIL_MAX_INTENTOS', '5'))
+MAIL_BACKOFF_BASE = float(os.getenv('MAIL_BACKOFF_BASE', '2'))      # segundos; se duplica en cada intento
+MAIL_SESION_INACTIVA = float(os.getenv('MAIL_SESION_INACTIVA', '60')) # tras este tiempo sin uso se hace NOOP
+MAIL_DEAD_LETTER_PATH = os.getenv('MAIL_DEAD_LETTER_PATH', 'correos_fallidos.jsonl')
+SMTP_TIMEOUT = 30
+
+
+def construir_mensaje(destinatario, asunto, cuerpo_html):
+    msg = MIMEText(cuerpo_html, 'html', 'utf-8')
+    msg['From'] = Header(MAIL_FROM, 'utf-8')
+    msg['To'] = Header(destinatario, 'utf-8')
+    msg['Subject'] = Header(asunto, 'utf-8')
+    return msg
+
+
+class _SesionSMTP:
+    """Conexión SMTP autenticada que se reutiliza entre envíos de un mismo hilo."""
+
+    def __init__(self):
+        self._smtp = None
+        self._ultimo_uso = 0.0
+
+    def _conectar(self):
+        smtp = smtplib.SMTP(MAIL_HOST, MAIL_PORT, timeout=SMTP_TIMEOUT)
+        if MAIL_USE_TLS:
+            smtp.starttls()
+        if MAIL_USER:
+            smtp.login(MAIL_USER, MAIL_PASS)
+        self._smtp = smtp
+
+    def _sigue_viva(self):
+        if time.monotonic() - self._ultimo_uso < MAIL_SESION_INACTIVA:
+            return True
+        try:
+            return self._smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def enviar(self, correo):
+        if self._smtp is None or not self._sigue_viva():
+            self.cerrar()
+            self._conectar()
+        msg = construir_mensaje(correo['destinatario'], correo['asunto'], correo['cuerpo_html'])
+        try:
+            self._smtp.sendmail(MAIL_FROM, correo['destinatario'], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+            # El servidor cerró la sesión reutilizada: un reintento inmediato con una conexión nueva.
+            self.cerrar()
+            self._conectar()
+            self._smtp.sendmail(MAIL_FROM, correo['destinatario'], msg.as_string())
+        self._ultimo_uso = time.monotonic()
+
+    def cerrar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class ColaCorreos:
+    def __init__(self, trabajadores=MAIL_WORKERS):
+        self.trabajadores = trabajadores
+        self._pendientes = []  # heap de (listo_en, secuencia, correo)
+        self._secuencia = itertools.count()
+        self._cond = threading.Condition()
+        self._hilos = []
+        self._en_curso = 0
+        self._detenida = False
+        self._lock_muertos = threading.Lock() # Solo para el archivo: escribir en disco no bloquea la cola
+        self.muertos = deque(maxlen=100) # Últimos mensajes muertos, para inspección
+        self.enviados = 0
+        self.reintentos = 0
+        self.fallidos = 0
+
+    def _iniciar(self):
+        # Los hilos se crean con el primer envío para no arrancarlos al solo importar el módulo.
+        if self._hilos:
+            return
+        for i in range(self.trabajadores):
+            hilo = threading.Thread(target=self._trabajador, name=f"correo-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def encolar(self, destinatario, asunto, cuerpo_html):
+        """Encola un correo para su envío. Retorna False si la cola ya se detuvo."""
+        correo = {'destinatario': destinatario, 'asunto': asunto, 'cuerpo_html': cuerpo_html, 'intentos': 0}
+        with self._cond:
+            if self._detenida:
+                return False
+            self._iniciar()
+            heapq.heappush(self._pendientes, (time.monotonic(), next(self._secuencia), correo))
+            self._cond.notify()
+        return True
+
+    def _siguiente(self):
+        with self._cond:
+            while True:
+                if self._detenida:
+                    return None
+                if self._pendientes:
+                    espera = self._pendientes[0][0] - time.monotonic()
+                    if espera <= 0:
+                        self._en_curso += 1
+                        return heapq.heappop(self._pendientes)[2]
+                    self._cond.wait(espera)
+                else:
+                    self._cond.wait()
+
+    def _terminar(self, correo, error):
+        correo['intentos'] += 1
+        muerto = None
+        with self._cond:
+            self._en_curso -= 1
+            if error is None:
+                self.enviados += 1
+            elif correo['intentos'] < MAIL_MAX_INTENTOS:
+                self.reintentos += 1
+                listo_en = time.monotonic() + MAIL_BACKOFF_BASE * (2 ** (correo['intentos'] - 1))
+                heapq.heappush(self._pendientes, (listo_en, next(self._secuencia), correo))
+            else:
+                self.fallidos += 1
+                muerto = self._registrar_muerto(correo, error)
+            self._cond.notify_all()
+        if muerto is not None:
+            self._guardar_muertos([muerto])
+
+    def _registrar_muerto(self, correo, error):
+        """Anota el mensaje muerto en memoria (con self._cond tomado) y retorna el registro para guardarlo."""
+        registro = dict(correo, error=str(error), fecha=datetime.now().isoformat())
+        self.muertos.append(registro)
+        return registro
+
+    def _guardar_muertos(self, registros):
+        """Añade los registros al archivo de mensajes muertos. Se llama sin self._cond tomado."""
+        try:
+            with self._lock_muertos, open(MAIL_DEAD_LETTER_PATH, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(registro, ensure_ascii=False) + '\n' for registro in registros)
+        except OSError as e:
+            print(f"Error al guardar {len(registros)} correos fallidos en {MAIL_DEAD_LETTER_PATH}: {e}", file=sys.stderr)
+
+    def _trabajador(self):
+        sesion = _SesionSMTP()
+        try:
+            while True:
+                correo = self._siguiente()
+                if correo is None:
+                    break
+                inicio = time.perf_counter()
+                try:
+                    sesion.enviar(correo)
+                    duracion_smtp.observar(time.perf_counter() - inicio, resultado='ok')
+                    self._terminar(correo, None)
+                except Exception as e:
+                    duracion_smtp.observar(time.perf_counter() - inicio, resultado='error')
+                    print(f"Error al enviar correo a {correo['destinatario']} (intento {correo['intentos'] + 1}): {e}", file=sys.stderr)
+                    sesion.cerrar()
+                    self._terminar(correo, e)
+        finally:
+            sesion.cerrar()
+
+    def detener(self, espera=10):
+        """
+        Espera hasta 'espera' segundos a que se vacíe la cola y detiene los trabajadores.
+        Los correos que queden sin enviar se guardan como mensajes muertos.
+        """
+        limite = time.monotonic() + espera
+        with self._cond:
+            while (self._pendientes or self._en_curso) and time.monotonic() < limite:
+                self._cond.wait(max(0.0, limite - time.monotonic()))
+            self._detenida = True
+            restantes = [correo for _, _, correo in self._pendientes]
+            self._pendientes = []
+            muertos = [self._registrar_muerto(correo, "Cola detenida antes del envío") for correo in restantes]
+            self._cond.notify_all()
+        if muertos:
+            self._guardar_muertos(muertos)
+        for hilo in self._hilos:
+            hilo.join(timeout=SMTP_TIMEOUT)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "pendientes": len(self._pendientes),
+                "en_curso": self._en_curso,
+                "enviados": self.enviados,
+                "reintentos": self.reintentos,
+                "fallidos": self.fallidos,
+            }
+
+
+cola_correos = ColaCorreos()
+atexit.register(cola_correos.detener)
@@ -0,0 +1,239 @@
+"""
+Métricas en formato de texto de Prometheus, expuestas en GET /metrics.
+
+- http_solicitud_duracion_segundos: histograma por blueprint, ruta (la regla,
+  no la URL), método y código de estado.
+- bcrypt_duracion_segundos, correo_encolar_duracion_segundos,
+  smtp_envio_duracion_segundos y upload_guardado_duracion_segundos: tiempos de
+  las operaciones costosas, incluida la espera por un cupo en su pool.
+- upload_bytes_total: bytes recibidos por tipo de subida.
+- Medidores (caché del feed, pool MySQL, cola de correos, eventos SSE...) que
+  se leen de sus estadisticas() en el momento del scrape.
+
+Observar una muestra cuesta un bisect y un incremento bajo un lock por métrica,
+y generar /metrics solo recorre los contadores, así que se puede consultar cada
+pocos segundos. Las métricas son por proceso: con varios workers, Prometheus
+debe consultar cada uno (o agregarlas el balanceador).
+"""
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, g, request
+
+metricas_bp = Blueprint('metricas', __name__)
+
+BUCKETS_POR_DEFECTO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)] + list(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if isinstance(valor, bool):
+        return '1' if valor else '0'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def exponer(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}" for clave, valor in valores]
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_POR_DEFECTO):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # etiquetas -> [conteo por bucket (no acumulado) + desbordes, suma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exponer(self):
+        with self._lock:
+            series = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._series.items()]
+        lineas = []
+        for clave, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                le = 'le="+Inf"' if limite == float('inf') else f'le="{limite!r}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, [le])} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {repr(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+
+class Medidores:
+    """Valores leídos en cada scrape desde una función que retorna {nombre_de_estadistica: número}."""
+    tipo = 'gauge'
+
+    def __init__(self, prefijo, ayuda, funcion):
+        self.nombre = prefijo
+        self.ayuda = ayuda
+        self._funcion = funcion
+
+    def exponer(self):
+        return [
+            f"{self.nombre}_{clave} {_numero(valor)}"
+            for clave, valor in self._funcion().items()
+            if isinstance(valor, (int, float)) # bool incluido; los diccionarios anidados se omiten
+        ]
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self.registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_POR_DEFECTO):
+        return self.registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def medidores(self, prefijo, ayuda, funcion):
+        return self.registrar(Medidores(prefijo, ayuda, funcion))
+
+    def exponer(self):
+        with self._lock:
+            metricas = list(self._metricas)
+        lineas = []
+        for metrica in metricas:
+            try:
+                cuerpo = metrica.exponer()
+            except Exception as e:
+                # Un medidor que falla (p. ej. el pool sin inicializar) no debe romper todo el scrape.
+                print(f"Error al exponer la métrica {metrica.nombre}: {e}", file=sys.stderr)
+                continue
+            if metrica.tipo == 'gauge':
+                # Cada estadística es una métrica distinta: su propia línea TYPE antes del valor.
+                for linea in cuerpo:
+                    lineas.append(f"# TYPE {linea.split(' ', 1)[0]} gauge")
+                    lineas.append(linea)
+                continue
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(cuerpo)
+        return '\n'.join(lineas) + '\n'
+
+
+registro = Registro()
+
+duracion_solicitudes = registro.histograma(
+    'http_solicitud_duracion_segundos', 'Duración de las solicitudes HTTP.',
+    ('blueprint', 'ruta', 'metodo', 'estado'))
+duracion_bcrypt = registro.histograma(
+    'bcrypt_duracion_segundos', 'Duración de generar o verificar un hash bcrypt, incluida la espera por el pool.',
+    ('operacion',), buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0, 10.0))
+duracion_encolar_correo = registro.histograma(
+    'correo_encolar_duracion_segundos', 'Duración de enviar_correo_verificacion (encolar el correo).',
+    (), buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+duracion_smtp = registro.histograma(
+    'smtp_envio_duracion_segundos', 'Duración de la entrega SMTP de un correo por los trabajadores de mail_queue.',
+    ('resultado',), buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+duracion_guardado_upload = registro.histograma(
+    'upload_guardado_duracion_segundos', 'Duración de guardar un archivo subido en el almacén de blobs.',
+    ('tipo',))
+bytes_upload = registro.contador('upload_bytes_total', 'Bytes de archivos subidos.', ('tipo',))
+
+
+def init_app(app):
+    """Registra /metrics, la medición de todas las solicitudes y los medidores de los servicios internos."""
+    # Imports diferidos: estos módulos importan metrics para sus temporizadores.
+    from db_pool import mysql
+    from eventos import broker as broker_eventos
+    from feed_cache import feed_cache
+    from mail_queue import cola_correos
+    from password_hashing import servicio_hash
+    from score_ingest import ingesta_puntajes
+    from upload_gc import recolector_archivos
+
+    app.register_blueprint(metricas_bp)
+    app.before_request(_inicio_solicitud)
+    app.after_request(_fin_solicitud)
+    if not _medidores_registrados.is_set():
+        _medidores_registrados.set()
+        registro.medidores('feed_cache', 'Caché de páginas del feed.', feed_cache.estadisticas)
+        registro.medidores('mysql_pool', 'Pool de conexiones MySQL.', mysql.estadisticas)
+        registro.medidores('cola_correos', 'Cola de envío de correos.', cola_correos.estadisticas)
+        registro.medidores('bcrypt_pool', 'Pool de hashing de contraseñas.', servicio_hash.estadisticas)
+        registro.medidores('puntajes', 'Ingesta diferida de puntajes.', ingesta_puntajes.estadisticas)
+        registro.medidores('eventos', 'Suscripciones SSE y eventos publicados.', broker_eventos.estadisticas)
+        registro.medidores('archivos', 'Borrado diferido y reconciliación de archivos subidos.', recolector_archivos.estadisticas)
+
+
+_medidores_registrados = threading.Event()
+
+
+def _inicio_solicitud():
+    g._metricas_inicio = time.perf_counter()
+
+
+def _fin_solicitud(respuesta):
+    inicio = g.pop('_metricas_inicio', None)
+    if inicio is not None:
+        regla = request.url_rule
+        duracion_solicitudes.observar(
+            time.perf_counter() - inicio,
+            blueprint=request.blueprint or '',
+            ruta=regla.rule if regla is not None else 'sin_ruta', # La URL concreta dispararía la cardinalidad
+            metodo=request.method,
+            estado=respuesta.status_code,
+        )
+    return respuesta
+
+
+@metricas_bp.route('/metrics', methods=['GET'])
+def exponer_metricas():
+    return registro.exponer(), 200, {'Content-Type': TIPO_CONTENIDO}
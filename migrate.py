@@ -0,0 +1,129 @@
+"""
+Aplicación versionada de migrations/*.sql.
+
+Cada archivo se aplica una sola vez, en orden de nombre, y se registra en la
+tabla schema_migrations. En MySQL las sentencias DDL confirman por sí mismas,
+así que una migración que falla a medias no se deshace: se informa cuál falló
+y, una vez corregida la base, se vuelve a ejecutar.
+
+Comandos (con el blueprint registrado en la aplicación):
+    flask migraciones estado
+    flask migraciones aplicar
+    flask migraciones marcar 0004   # Base existente: registra hasta 0004 sin ejecutarlas
+"""
+import sys
+from pathlib import Path
+
+import click
+from flask import Blueprint
+
+from db_pool import mysql
+
+migraciones_bp = Blueprint('migraciones', __name__)
+
+CARPETA_MIGRACIONES = Path(__file__).resolve().parent / 'migrations'
+
+
+def sentencias(sql):
+    """Separa un script en sentencias, descartando las líneas de comentario."""
+    sin_comentarios = '\n'.join(l for l in sql.splitlines() if not l.strip().startswith('--'))
+    return [s.strip() for s in sin_comentarios.split(';') if s.strip()]
+
+
+def migraciones_disponibles(carpeta=CARPETA_MIGRACIONES):
+    """Lista ordenada de (versión, ruta); la versión es el nombre del archivo sin .sql."""
+    return [(ruta.stem, ruta) for ruta in sorted(Path(carpeta).glob('*.sql'))]
+
+
+def _asegurar_tabla(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) NOT NULL PRIMARY KEY,
+            aplicada_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def versiones_aplicadas(cursor):
+    _asegurar_tabla(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def aplicar_migraciones(conexion, carpeta=CARPETA_MIGRACIONES, eco=print):
+    """Aplica las migraciones pendientes con la conexión MySQLdb dada. Retorna las versiones aplicadas."""
+    cursor = conexion.cursor()
+    try:
+        aplicadas = versiones_aplicadas(cursor)
+        nuevas = []
+        for version, ruta in migraciones_disponibles(carpeta):
+            if version in aplicadas:
+                continue
+            eco(f"Aplicando {version}...")
+            try:
+                for sentencia in sentencias(ruta.read_text(encoding='utf-8')):
+                    cursor.execute(sentencia)
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                conexion.commit()
+            except Exception:
+                conexion.rollback()
+                print(f"La migración {version} falló; las sentencias DDL previas a la falla ya quedaron aplicadas.", file=sys.stderr)
+                raise
+            nuevas.append(version)
+        return nuevas
+    finally:
+        cursor.close()
+
+
+def marcar_aplicadas(conexion, hasta, carpeta=CARPETA_MIGRACIONES):
+    """Registra como aplicadas, sin ejecutarlas, las migraciones hasta la versión 'hasta' (por prefijo)."""
+    cursor = conexion.cursor()
+    try:
+        _asegurar_tabla(cursor)
+        marcadas = []
+        for version, _ in migraciones_disponibles(carpeta):
+            cursor.execute("INSERT IGNORE INTO schema_migrations (version) VALUES (%s)", (version,))
+            marcadas.append(version)
+            if version.startswith(hasta):
+                break
+        else:
+            conexion.rollback()
+            raise ValueError(f"No existe una migración que empiece por {hasta!r}.")
+        conexion.commit()
+        return marcadas
+    finally:
+        cursor.close()
+
+
+@migraciones_bp.cli.command('estado')
+def estado():
+    """Muestra qué migraciones están aplicadas y cuáles pendientes."""
+    cursor = mysql.connection.cursor()
+    try:
+        aplicadas = versiones_aplicadas(cursor)
+    finally:
+        cursor.close()
+    for version, _ in migraciones_disponibles():
+        click.echo(f"[{'x' if version in aplicadas else ' '}] {version}")
+
+
+@migraciones_bp.cli.command('aplicar')
+def aplicar():
+    """Aplica las migraciones pendientes."""
+    try:
+        nuevas = aplicar_migraciones(mysql.connection, eco=click.echo)
+    except Exception as e:
+        print(f"Error al aplicar migraciones: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    click.echo(f"{len(nuevas)} migraciones aplicadas." if nuevas else "La base de datos está al día.")
+
+
+@migraciones_bp.cli.command('marcar')
+@click.argument('hasta')
+def marcar(hasta):
+    """Registra como aplicadas las migraciones hasta HASTA sin ejecutarlas (bases creadas a mano)."""
+    try:
+        marcadas = marcar_aplicadas(mysql.connection, hasta)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Marcadas como aplicadas: {', '.join(marcadas)}")
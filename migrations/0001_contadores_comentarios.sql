@@ -0,0 +1,10 @@
+-- Contadores de comentarios por publicación, mantenidos en escritura por
+-- comentar_publicacion / eliminar_comentario y limpiados por eliminar_publicacion.
+-- Se reconstruyen desde `comentarios` con: flask user recontar-comentarios
+CREATE TABLE publicacion_contadores (
+    publicacion_id INT NOT NULL PRIMARY KEY,
+    cantidad_comentarios INT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT INTO publicacion_contadores (publicacion_id, cantidad_comentarios)
+SELECT publicacion_id, COUNT(*) FROM comentarios GROUP BY publicacion_id;
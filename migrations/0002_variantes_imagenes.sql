@@ -0,0 +1,4 @@
+-- URLs de las variantes redimensionadas (WebP/AVIF) generadas por image_variants,
+-- con la forma {"thumb": {"webp": url, "avif": url}, "card": {...}}.
+ALTER TABLE imagenes_publicacion ADD COLUMN variantes JSON NULL;
+ALTER TABLE users ADD COLUMN foto_perfil_variantes JSON NULL;
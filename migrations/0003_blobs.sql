@@ -0,0 +1,11 @@
+-- Almacén de archivos direccionado por contenido (blob_store): una fila por archivo
+-- en UPLOAD_FOLDER/blobs/ab/cd/<sha256>.<ext>, con la cuenta de registros que lo usan
+-- (imagenes_publicacion.url, users.foto_perfil y las URLs de sus variantes).
+CREATE TABLE blobs (
+    ruta VARCHAR(255) NOT NULL PRIMARY KEY,
+    hash CHAR(64) NOT NULL,
+    tamano BIGINT UNSIGNED NOT NULL,
+    referencias INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_blobs_hash (hash)
+);
@@ -0,0 +1,4 @@
+-- Una fila por jugador y dificultad: score_ingest escribe con
+-- INSERT ... ON DUPLICATE KEY UPDATE puntaje_actual = GREATEST(...).
+-- Si existen filas repetidas deben consolidarse (conservando el mejor puntaje) antes de aplicarla.
+ALTER TABLE partidas ADD UNIQUE KEY uq_partidas_usuario_dificultad (user_id, dificultad_id);
@@ -0,0 +1,19 @@
+-- Índices de las búsquedas frecuentes de auth.py y user.py.
+-- Los UNIQUE fallan si ya hay emails o usernames repetidos: deben depurarse antes de aplicarla.
+
+-- register (username OR email, resuelto con index_merge), login, verificar, request-password-reset
+-- y la comprobación de username disponible en /perfil.
+CREATE UNIQUE INDEX uq_users_email ON users (email);
+CREATE UNIQUE INDEX uq_users_username ON users (username);
+
+-- reset-password busca por el código de 6 dígitos.
+CREATE INDEX idx_users_reset_token ON users (reset_token);
+
+-- Feed con cursor: ORDER BY created_at DESC, id DESC y WHERE (created_at, id) < cursor.
+CREATE INDEX idx_publicaciones_created_id ON publicaciones (created_at, id);
+
+-- Comentarios por publicación en orden (ROW_NUMBER en /publicaciones/comentarios y recontar-comentarios).
+CREATE INDEX idx_comentarios_publicacion_created ON comentarios (publicacion_id, created_at, id);
+
+-- Imágenes de una publicación en su orden (GROUP_CONCAT ... ORDER BY orden).
+CREATE INDEX idx_imagenes_publicacion_orden ON imagenes_publicacion (publicacion_id, orden);
@@ -0,0 +1,19 @@
+-- Registro de cambios para /publicaciones/sync (change_log.py). La versión sale de la
+-- fila única de cambios_secuencia, bloqueada hasta el commit de cada escritura.
+CREATE TABLE cambios_secuencia (
+    id TINYINT NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL,
+    podado_hasta BIGINT UNSIGNED NOT NULL DEFAULT 0
+);
+
+INSERT INTO cambios_secuencia (id, version, podado_hasta) VALUES (1, 0, 0);
+
+CREATE TABLE cambios (
+    version BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+    entidad ENUM('publicacion', 'comentario') NOT NULL,
+    entidad_id INT NOT NULL,
+    publicacion_id INT NOT NULL,
+    operacion ENUM('crear', 'editar', 'eliminar') NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_cambios_created (created_at)
+);
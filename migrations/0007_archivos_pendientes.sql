@@ -0,0 +1,10 @@
+-- Archivos de UPLOAD_FOLDER pendientes de borrar (upload_gc.py). Las rutas de escritura
+-- los anotan en la misma transacción que libera sus referencias y un hilo los borra
+-- después; el reconciliador anota también los huérfanos que encuentra en disco.
+CREATE TABLE archivos_pendientes (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    ruta VARCHAR(512) NOT NULL,
+    intentos INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uk_archivos_pendientes_ruta (ruta)
+);
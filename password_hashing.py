@@ -0,0 +1,109 @@
+"""
+Hashing de contraseñas (bcrypt) en un pool de procesos acotado.
+
+bcrypt es CPU intensivo; ejecutarlo en el hilo de la solicitud bloquea al
+worker y, bajo una ráfaga de logins, deja sin CPU al resto de rutas. Aquí se
+delega a procesos separados con un número máximo de trabajos en espera: si el
+pool está saturado se lanza ServicioHashSaturado y la ruta responde 503.
+
+El costo (BCRYPT_LOG_ROUNDS) es configurable; necesita_rehash() indica si un
+hash guardado usa un costo distinto del actual para regenerarlo tras un login.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from metrics import duracion_bcrypt
+
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+BCRYPT_POOL_SIZE = int(os.getenv('BCRYPT_POOL_SIZE', str(os.cpu_count() or 1)))
+BCRYPT_MAX_PENDIENTES = int(os.getenv('BCRYPT_MAX_PENDIENTES', str(BCRYPT_POOL_SIZE * 4)))
+BCRYPT_ESPERA = float(os.getenv('BCRYPT_ESPERA', '5')) # segundos máximos esperando un cupo en el pool
+
+
+class ServicioHashSaturado(Exception):
+    """No hubo cupo en el pool de hashing dentro del tiempo de espera."""
+
+
+# Funciones de nivel de módulo para que el pool de procesos pueda importarlas.
+def _generar_hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _verificar_hash(password_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError: # Hash con formato inválido
+        return False
+
+
+def costo_de_hash(password_hash):
+    """Extrae el costo de un hash bcrypt ('$2b$12$...'). Retorna None si no se reconoce el formato."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class ServicioHash:
+    def __init__(self, procesos=BCRYPT_POOL_SIZE, max_pendientes=BCRYPT_MAX_PENDIENTES, rounds=BCRYPT_LOG_ROUNDS):
+        self.procesos = procesos
+        self.rounds = rounds
+        self.max_pendientes = max_pendientes
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._en_curso = 0
+        self.rechazados = 0
+
+    def _obtener_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # 'spawn' evita heredar por fork el estado de los hilos del servidor.
+                contexto = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos, mp_context=contexto)
+            return self._pool
+
+    def _ejecutar(self, operacion, funcion, *args):
+        with duracion_bcrypt.medir(operacion=operacion):
+            if not self._cupos.acquire(timeout=BCRYPT_ESPERA):
+                with self._lock:
+                    self.rechazados += 1
+                raise ServicioHashSaturado("El servicio de hashing está saturado.")
+            with self._lock:
+                self._en_curso += 1
+            try:
+                return self._obtener_pool().submit(funcion, *args).result()
+            finally:
+                with self._lock:
+                    self._en_curso -= 1
+                self._cupos.release()
+
+    def generar_hash(self, password):
+        return self._ejecutar('generar', _generar_hash, password, self.rounds)
+
+    def verificar(self, password_hash, password):
+        return self._ejecutar('verificar', _verificar_hash, password_hash, password)
+
+    def necesita_rehash(self, password_hash):
+        return costo_de_hash(password_hash) != self.rounds
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "procesos": self.procesos,
+                "en_curso": self._en_curso,
+                "max_pendientes": self.max_pendientes,
+                "rechazados": self.rechazados,
+            }
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+servicio_hash = ServicioHash()
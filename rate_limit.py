@@ -0,0 +1,231 @@
+"""
+Límites de tasa (token bucket) para las rutas de auth que hacen trabajo caro.
+
+/login y /register cuestan un bcrypt; /register y /request-password-reset
+además envían un correo. Cada regla tiene dos cubetas: una por IP y otra por
+identidad (el email o username del cuerpo JSON). El decorador @limitar
+consume un token de cada una antes de que la ruta toque bcrypt o MySQL. Si
+alguna está vacía, responde 429 con Retry-After.
+
+Los límites se configuran como "tokens/segundos" (capacidad de ráfaga y
+ventana de recarga), p. ej. RATE_LIMIT_LOGIN_IP=20/60.
+
+Las cubetas viven en una tabla en memoria repartida en RATE_LIMIT_SHARDS
+fragmentos, cada uno con su lock. Una cubeta que ya se recargó por completo
+equivale a no tenerla, así que se elimina en barridos periódicos (TTL).
+
+La IP es request.remote_addr. Detrás de un proxy inverso sería la del proxy
+y todos los clientes compartirían una cubeta: con PROXIES_CONFIABLES=N,
+init_app(app) envuelve la aplicación en ProxyFix y la IP se toma de
+X-Forwarded-For, confiando solo en los N últimos saltos (los que añaden
+nuestros propios proxies; lo anterior lo puede falsear el cliente). También
+afecta a request.scheme y request.host, y a las claves de afinidad de db_pool.
+
+Con RATE_LIMIT_REDIS_URL (requiere el paquete redis) las cubetas se guardan
+en Redis con un script Lua atómico, y el límite se comparte entre todos los
+workers. Si Redis falla, se usa la tabla local hasta que vuelva a responder.
+"""
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from functools import wraps
+
+from flask import jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from metrics import registro
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RATE_LIMIT_SHARDS = int(os.getenv('RATE_LIMIT_SHARDS', '16'))
+RATE_LIMIT_BARRIDO = float(os.getenv('RATE_LIMIT_BARRIDO', '60')) # segundos entre barridos de un fragmento
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+RATE_LIMIT_REDIS_REINTENTO = 30 # segundos usando la tabla local tras un fallo de Redis
+PROXIES_CONFIABLES = int(os.getenv('PROXIES_CONFIABLES', '0'))
+
+rechazos = registro.contador('rate_limit_rechazos_total', 'Solicitudes rechazadas por límite de tasa.', ('regla', 'clave'))
+
+
+@dataclass(frozen=True)
+class Limite:
+    capacidad: float
+    por_segundo: float
+
+    @classmethod
+    def desde_texto(cls, texto):
+        """'20/60' -> hasta 20 solicitudes en ráfaga, recargando 20 cada 60 segundos."""
+        tokens, _, segundos = texto.partition('/')
+        tokens, segundos = float(tokens), float(segundos or 1)
+        return cls(capacidad=tokens, por_segundo=tokens / segundos)
+
+    @property
+    def ttl(self):
+        """Segundos tras los que una cubeta vacía vuelve a estar llena."""
+        return self.capacidad / self.por_segundo
+
+
+def _limite(variable, por_defecto):
+    return Limite.desde_texto(os.getenv(variable, por_defecto))
+
+
+REGLAS = {
+    'login': (_limite('RATE_LIMIT_LOGIN_IP', '20/60'), _limite('RATE_LIMIT_LOGIN_IDENTIDAD', '5/60')),
+    'register': (_limite('RATE_LIMIT_REGISTER_IP', '5/600'), _limite('RATE_LIMIT_REGISTER_IDENTIDAD', '3/600')),
+    'password_reset': (_limite('RATE_LIMIT_RESET_IP', '5/900'), _limite('RATE_LIMIT_RESET_IDENTIDAD', '3/900')),
+}
+
+
+class _Fragmento:
+    __slots__ = ('lock', 'cubetas', 'proximo_barrido')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cubetas = {} # clave -> [tokens, último instante, instante en que vuelve a estar llena]
+        self.proximo_barrido = time.monotonic() + RATE_LIMIT_BARRIDO
+
+
+class TablaCubetas:
+    """Cubetas en memoria repartidas en fragmentos con lock propio, para no serializar todas las solicitudes."""
+
+    def __init__(self, fragmentos=RATE_LIMIT_SHARDS):
+        self._fragmentos = [_Fragmento() for _ in range(fragmentos)]
+
+    def _fragmento(self, clave):
+        return self._fragmentos[zlib.crc32(clave.encode('utf-8')) % len(self._fragmentos)]
+
+    def consumir(self, clave, limite):
+        """Consume un token. Retorna 0 si se permitió o los segundos hasta que haya uno disponible."""
+        fragmento = self._fragmento(clave)
+        ahora = time.monotonic()
+        with fragmento.lock:
+            if ahora >= fragmento.proximo_barrido:
+                fragmento.cubetas = {k: c for k, c in fragmento.cubetas.items() if c[2] > ahora}
+                fragmento.proximo_barrido = ahora + RATE_LIMIT_BARRIDO
+            cubeta = fragmento.cubetas.get(clave)
+            if cubeta is None:
+                tokens = limite.capacidad
+            else:
+                tokens = min(limite.capacidad, cubeta[0] + (ahora - cubeta[1]) * limite.por_segundo)
+            if tokens < 1:
+                fragmento.cubetas[clave] = [tokens, ahora, ahora + (limite.capacidad - tokens) / limite.por_segundo]
+                return (1 - tokens) / limite.por_segundo
+            tokens -= 1
+            fragmento.cubetas[clave] = [tokens, ahora, ahora + (limite.capacidad - tokens) / limite.por_segundo]
+            return 0
+
+    def __len__(self):
+        return sum(len(f.cubetas) for f in self._fragmentos)
+
+
+# Token bucket atómico en Redis: KEYS[1] = clave; ARGV = capacidad, tokens por segundo, ahora (s).
+# Guarda tokens e instante en un hash que expira cuando la cubeta vuelve a estar llena.
+_SCRIPT_REDIS = """
+local capacidad = tonumber(ARGV[1])
+local por_segundo = tonumber(ARGV[2])
+local ahora = tonumber(ARGV[3])
+local estado = redis.call('HMGET', KEYS[1], 'tokens', 'instante')
+local tokens = tonumber(estado[1])
+if tokens == nil then
+    tokens = capacidad
+else
+    tokens = math.min(capacidad, tokens + (ahora - tonumber(estado[2])) * por_segundo)
+end
+local espera = 0
+if tokens < 1 then
+    espera = (1 - tokens) / por_segundo
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'instante', ahora)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacidad - tokens) / por_segundo * 1000) + 1000)
+return tostring(espera)
+"""
+
+
+class BackendRedis:
+    def __init__(self, url):
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._script = self._cliente.register_script(_SCRIPT_REDIS)
+
+    def consumir(self, clave, limite):
+        # Se usa el reloj de Redis para que todos los workers compartan la misma referencia.
+        segundos, microsegundos = self._cliente.time()
+        return float(self._script(keys=[f"rate_limit:{clave}"], args=[limite.capacidad, limite.por_segundo, segundos + microsegundos / 1e6]))
+
+
+class LimitadorTasa:
+    def __init__(self, url_redis=RATE_LIMIT_REDIS_URL):
+        self._local = TablaCubetas()
+        self._redis = None
+        self._redis_caido_hasta = 0.0
+        if url_redis:
+            if redis is None:
+                print("RATE_LIMIT_REDIS_URL está configurado pero el paquete redis no está instalado; se usan límites por proceso.", file=sys.stderr)
+            else:
+                self._redis = BackendRedis(url_redis)
+
+    def consumir(self, clave, limite):
+        if self._redis is not None and time.monotonic() >= self._redis_caido_hasta:
+            try:
+                return self._redis.consumir(clave, limite)
+            except Exception as e:
+                self._redis_caido_hasta = time.monotonic() + RATE_LIMIT_REDIS_REINTENTO
+                print(f"Error en el backend Redis de límites de tasa, se usa la tabla local: {e}", file=sys.stderr)
+        return self._local.consumir(clave, limite)
+
+
+limitador = LimitadorTasa()
+
+
+def init_app(app):
+    """Con PROXIES_CONFIABLES > 0, toma la IP del cliente (y el esquema y host) de las cabeceras X-Forwarded-*."""
+    proxies = int(app.config.setdefault('PROXIES_CONFIABLES', PROXIES_CONFIABLES))
+    if proxies > 0 and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+
+def _respuesta_limitada(espera):
+    respuesta = jsonify({"error": "Demasiadas solicitudes. Inténtalo de nuevo más tarde."})
+    respuesta.status_code = 429
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+
+def limitar(regla, campos_identidad=('email',)):
+    """
+    Aplica la regla a la ruta: una cubeta por IP y una por cada campo de identidad presente
+    en el cuerpo JSON. Se evalúa antes de la ruta, así que un rechazo no cuesta bcrypt ni MySQL.
+    """
+    limite_ip, limite_identidad = REGLAS[regla]
+
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            if request.method == 'OPTIONS': # El preflight de CORS no consume tokens
+                return f(*args, **kwargs)
+
+            espera = limitador.consumir(f"{regla}:ip:{request.remote_addr}", limite_ip)
+            if espera:
+                rechazos.incrementar(regla=regla, clave='ip')
+                return _respuesta_limitada(espera)
+
+            datos = request.get_json(silent=True)
+            if isinstance(datos, dict):
+                for campo in campos_identidad:
+                    valor = datos.get(campo)
+                    if not isinstance(valor, str) or not valor.strip():
+                        continue
+                    espera = limitador.consumir(f"{regla}:{campo}:{valor.strip().lower()}", limite_identidad)
+                    if espera:
+                        rechazos.incrementar(regla=regla, clave=campo)
+                        return _respuesta_limitada(espera)
+            return f(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,185 @@
+"""
+Ingesta de puntajes con escritura diferida (write-behind).
+
+Los puntajes recibidos se acumulan en memoria; para cada (user_id, dificultad_id)
+solo se conserva el mejor. Un hilo vuelca el buffer a `partidas` con un único
+INSERT ... ON DUPLICATE KEY UPDATE de varias filas cuando se alcanzan
+PUNTAJES_FLUSH_TAMANO entradas o cada PUNTAJES_FLUSH_INTERVALO segundos.
+
+Al cerrar el proceso de forma ordenada se hace un último volcado; si MySQL no
+está disponible, lo pendiente se añade a PUNTAJES_SPOOL_PATH (una fila JSON por
+línea; varios workers pueden escribir en él) y el primer worker que arranca lo
+reclama y lo recupera. Volcar dos veces la misma fila es inofensivo porque el
+UPDATE conserva el máximo.
+
+Si MySQL rechaza el lote por sus datos (DataError/IntegrityError, p. ej. un
+usuario borrado), se reintenta fila a fila y solo se descartan las inválidas;
+ante cualquier otro error el lote completo vuelve al buffer.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import traceback
+
+import MySQLdb
+
+from db_pool import mysql
+
+PUNTAJES_FLUSH_TAMANO = int(os.getenv('PUNTAJES_FLUSH_TAMANO', '500'))
+PUNTAJES_FLUSH_INTERVALO = float(os.getenv('PUNTAJES_FLUSH_INTERVALO', '2'))
+PUNTAJES_SPOOL_PATH = os.getenv('PUNTAJES_SPOOL_PATH', 'puntajes_pendientes.jsonl')
+# Dificultades aceptadas por /player (no hay tabla de dificultades) y tope de las columnas INT de partidas.
+PUNTAJES_DIFICULTADES = frozenset(
+    int(d) for d in os.getenv('PUNTAJES_DIFICULTADES', '1,2,3').split(',') if d.strip()
+)
+PUNTAJE_MAXIMO = 2**31 - 1
+
+
+class IngestaPuntajes:
+    def __init__(self):
+        self._buffer = {} # (user_id, dificultad_id) -> mejor puntaje pendiente
+        self._lock = threading.Lock()
+        self._lock_volcado = threading.Lock() # Un solo volcado a la vez
+        self._despertar = threading.Event()
+        self._detenida = threading.Event()
+        self._app = None
+        self._hilo = None
+
+    def iniciar(self, app):
+        """Arranca el hilo de volcado (idempotente); el hilo recupera lo pendiente de un cierre anterior."""
+        if self._hilo is not None:
+            return
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._app = app
+            self._hilo = threading.Thread(target=self._bucle, name='volcado-puntajes', daemon=True)
+            self._hilo.start()
+
+    @staticmethod
+    def _fusionar(destino, origen):
+        for clave, puntaje in origen.items():
+            if puntaje > destino.get(clave, puntaje - 1):
+                destino[clave] = puntaje
+
+    def registrar(self, user_id, dificultad_id, puntaje):
+        with self._lock:
+            self._fusionar(self._buffer, {(user_id, dificultad_id): puntaje})
+            lleno = len(self._buffer) >= PUNTAJES_FLUSH_TAMANO
+        if lleno:
+            self._despertar.set()
+
+    def pendientes_de_usuario(self, user_id):
+        """Puntajes aún no volcados de un usuario, por dificultad."""
+        with self._lock:
+            return {dificultad: puntaje for (uid, dificultad), puntaje in self._buffer.items() if uid == user_id}
+
+    def estadisticas(self):
+        with self._lock:
+            return {"pendientes": len(self._buffer)}
+
+    def _bucle(self):
+        # Se llama desde /player: la recuperación y su volcado no deben hacer esperar a esa solicitud.
+        self._cargar_spool()
+        self.volcar()
+        while not self._detenida.is_set():
+            self._despertar.wait(PUNTAJES_FLUSH_INTERVALO)
+            self._despertar.clear()
+            self.volcar()
+
+    def _escribir(self, filas):
+        with self._app.app_context():
+            cursor = mysql.connection.cursor()
+            try:
+                # MySQLdb convierte executemany de un INSERT en una sola sentencia de varias filas.
+                cursor.executemany("""
+                    INSERT INTO partidas (user_id, dificultad_id, puntaje_actual) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE puntaje_actual = GREATEST(puntaje_actual, VALUES(puntaje_actual))
+                """, filas)
+                mysql.connection.commit()
+            except Exception:
+                mysql.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def volcar(self):
+        """Escribe el buffer en `partidas`. Si falla, lo devuelve al buffer. Retorna las filas escritas."""
+        with self._lock_volcado:
+            with self._lock:
+                lote, self._buffer = self._buffer, {}
+            if not lote:
+                return 0
+            filas = [(user_id, dificultad_id, puntaje) for (user_id, dificultad_id), puntaje in lote.items()]
+            try:
+                self._escribir(filas)
+                return len(filas)
+            except (MySQLdb.DataError, MySQLdb.IntegrityError) as e:
+                print(f"Lote de {len(filas)} puntajes rechazado ({e}); se reintenta fila a fila.", file=sys.stderr)
+                return self._escribir_por_fila(filas)
+            except Exception as e:
+                with self._lock:
+                    self._fusionar(self._buffer, lote)
+                print(f"Error al volcar {len(lote)} puntajes a partidas: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+                return 0
+
+    def _escribir_por_fila(self, filas):
+        # Una fila inválida no debe bloquear ni reintentar indefinidamente al resto del lote.
+        escritas = 0
+        for i, fila in enumerate(filas):
+            try:
+                self._escribir([fila])
+                escritas += 1
+            except (MySQLdb.DataError, MySQLdb.IntegrityError) as e:
+                print(f"Puntaje descartado {fila}: {e}", file=sys.stderr)
+            except Exception as e:
+                with self._lock:
+                    self._fusionar(self._buffer, {(u, d): p for u, d, p in filas[i:]})
+                print(f"Error al volcar puntajes a partidas: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+                break
+        return escritas
+
+    def _cargar_spool(self):
+        # Primero se reclama el archivo con un rename atómico a un nombre propio del proceso: otro worker
+        # que arranque a la vez no lo recupera también, y lo que un 'detener' añada después va a un spool nuevo.
+        reclamado = f"{PUNTAJES_SPOOL_PATH}.{os.getpid()}"
+        try:
+            os.replace(PUNTAJES_SPOOL_PATH, reclamado)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Error al reclamar los puntajes pendientes de {PUNTAJES_SPOOL_PATH}: {e}", file=sys.stderr)
+            return
+        try:
+            with open(reclamado, encoding='utf-8') as f:
+                filas = [json.loads(linea) for linea in f if linea.strip()]
+            with self._lock:
+                self._fusionar(self._buffer, {(u, d): p for u, d, p in filas})
+            os.remove(reclamado)
+        except (OSError, ValueError) as e:
+            print(f"Error al recuperar puntajes pendientes de {reclamado}: {e}", file=sys.stderr)
+
+    def detener(self):
+        """Último volcado al cerrar; lo que no pueda escribirse queda en el archivo spool."""
+        if self._hilo is None:
+            return
+        self._detenida.set()
+        self._despertar.set()
+        self._hilo.join(timeout=PUNTAJES_FLUSH_INTERVALO + 5)
+        self.volcar()
+        with self._lock:
+            restantes = [[u, d, p] for (u, d), p in self._buffer.items()]
+        if restantes:
+            try:
+                with open(PUNTAJES_SPOOL_PATH, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(fila) + '\n' for fila in restantes)
+            except OSError as e:
+                print(f"Se perdieron {len(restantes)} puntajes al cerrar: {e}", file=sys.stderr)
+
+
+ingesta_puntajes = IngestaPuntajes()
+atexit.register(ingesta_puntajes.detener)
@@ -0,0 +1,308 @@
+"""
+Índice invertido en memoria para buscar publicaciones por título y texto.
+
+- Normaliza a minúsculas y elimina acentos ("canción" y "cancion" coinciden).
+- Ordena los resultados con BM25; el título pesa más que el texto.
+- El último término de la consulta se busca también como prefijo ("drag" -> "dragon").
+- Se actualiza de forma incremental desde crear/editar/eliminar_publicacion y se
+  guarda en SEARCH_INDEX_PATH (escritura atómica) para no reconstruirlo al reiniciar.
+- Guarda con el índice la versión del registro de cambios (change_log) que refleja.
+  Al cargarlo, y como mucho cada SEARCH_SINCRONIZAR_INTERVALO segundos al buscar,
+  reindexa las publicaciones que cambiaron después de esa versión, incluidas las
+  escritas por otros workers. Si son más de SEARCH_REPLAY_MAX o el registro ya se
+  podó, reconstruye el índice completo.
+"""
+import atexit
+import bisect
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'indice_busqueda.json')
+SEARCH_GUARDADO_INTERVALO = float(os.getenv('SEARCH_GUARDADO_INTERVALO', '30'))
+SEARCH_SINCRONIZAR_INTERVALO = float(os.getenv('SEARCH_SINCRONIZAR_INTERVALO', '5'))
+SEARCH_REPLAY_MAX = int(os.getenv('SEARCH_REPLAY_MAX', '5000'))
+VERSION_FORMATO = 2
+
+PESO_TITULO = 3 # Cada término del título cuenta como si apareciera 3 veces
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_EXPANSION_PREFIJO = 50
+
+_PATRON_TERMINO = re.compile(r"\w+", re.UNICODE)
+
+
+def normalizar(texto):
+    """Minúsculas y sin marcas diacríticas (la ñ queda como n)."""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return _PATRON_TERMINO.findall(normalizar(texto or ''))
+
+
+def _columnas(fila, *nombres):
+    """Valores de una fila de DictCursor o de un cursor de tuplas, en el orden de 'nombres'."""
+    return tuple(fila[nombre] for nombre in nombres) if isinstance(fila, dict) else tuple(fila)
+
+
+class IndiceBusqueda:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._lock_sincronizacion = threading.Lock()
+        self._hilo_guardado = None
+        self.cargado = False
+        self.version_cambios = 0 # Versión del registro de cambios que refleja el índice
+        self._ultima_sincronizacion = 0.0
+        self._vaciar()
+
+    def _vaciar(self):
+        self._postings = {}    # término -> {publicacion_id: frecuencia ponderada}
+        self._documentos = {}  # publicacion_id -> {término: frecuencia ponderada}
+        self._longitudes = {}  # publicacion_id -> longitud ponderada
+        self._total_longitud = 0
+        self._terminos = []    # Términos ordenados, para la búsqueda por prefijo
+        self._terminos_sucios = False
+        self._modificado = False
+
+    def __len__(self):
+        return len(self._documentos)
+
+    def _frecuencias(self, titulo, texto):
+        frecuencias = Counter(tokenizar(texto))
+        for termino in tokenizar(titulo):
+            frecuencias[termino] += PESO_TITULO
+        return frecuencias
+
+    def _quitar(self, publicacion_id):
+        frecuencias = self._documentos.pop(publicacion_id, None)
+        if frecuencias is None:
+            return
+        for termino in frecuencias:
+            posting = self._postings[termino]
+            del posting[publicacion_id]
+            if not posting:
+                del self._postings[termino]
+                self._terminos_sucios = True
+        self._total_longitud -= self._longitudes.pop(publicacion_id)
+
+    def indexar(self, publicacion_id, titulo, texto):
+        """Agrega o reemplaza una publicación en el índice. No hace nada si el índice aún no se cargó."""
+        frecuencias = self._frecuencias(titulo, texto)
+        with self._lock:
+            if not self.cargado:
+                return
+            self._quitar(publicacion_id)
+            for termino, frecuencia in frecuencias.items():
+                if termino not in self._postings:
+                    self._postings[termino] = {}
+                    self._terminos_sucios = True
+                self._postings[termino][publicacion_id] = frecuencia
+            self._documentos[publicacion_id] = dict(frecuencias)
+            longitud = sum(frecuencias.values())
+            self._longitudes[publicacion_id] = longitud
+            self._total_longitud += longitud
+            self._modificado = True
+
+    def eliminar(self, publicacion_id):
+        with self._lock:
+            if not self.cargado:
+                return
+            self._quitar(publicacion_id)
+            self._modificado = True
+
+    def _expandir_prefijo(self, prefijo):
+        if self._terminos_sucios:
+            self._terminos = sorted(self._postings)
+            self._terminos_sucios = False
+        inicio = bisect.bisect_left(self._terminos, prefijo)
+        expansion = []
+        for termino in self._terminos[inicio:inicio + MAX_EXPANSION_PREFIJO]:
+            if not termino.startswith(prefijo):
+                break
+            expansion.append(termino)
+        return expansion
+
+    def buscar(self, consulta, limite=20):
+        """Retorna una lista de (publicacion_id, puntuación) ordenada por relevancia BM25."""
+        terminos = tokenizar(consulta)
+        if not terminos:
+            return []
+        with self._lock:
+            n = len(self._documentos)
+            if n == 0:
+                return []
+            longitud_media = self._total_longitud / n
+            # Cada término de la consulta aporta por sí mismo; el último también por sus prefijos.
+            grupos = [[t] for t in terminos[:-1]] + [self._expandir_prefijo(terminos[-1]) or [terminos[-1]]]
+            puntuaciones = Counter()
+            for grupo in grupos:
+                mejor_por_documento = {}
+                for termino in grupo:
+                    posting = self._postings.get(termino)
+                    if not posting:
+                        continue
+                    idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for publicacion_id, frecuencia in posting.items():
+                        norma = BM25_K1 * (1 - BM25_B + BM25_B * self._longitudes[publicacion_id] / longitud_media)
+                        puntuacion = idf * frecuencia * (BM25_K1 + 1) / (frecuencia + norma)
+                        if puntuacion > mejor_por_documento.get(publicacion_id, 0):
+                            mejor_por_documento[publicacion_id] = puntuacion
+                puntuaciones.update(mejor_por_documento)
+            return [(pid, round(p, 4)) for pid, p in puntuaciones.most_common(limite)]
+
+    # --- Persistencia ---
+
+    def guardar(self, ruta=SEARCH_INDEX_PATH):
+        """Escribe el índice a disco si cambió desde el último guardado."""
+        with self._lock:
+            if not self._modificado:
+                return False
+            datos = {
+                "version": VERSION_FORMATO,
+                "version_cambios": self.version_cambios,
+                "documentos": {str(k): v for k, v in self._documentos.items()},
+            }
+            self._modificado = False
+        temporal = None
+        try:
+            # Un temporal propio en la misma carpeta: varios workers pueden guardar a la vez.
+            descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ruta)), suffix='.tmp')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+                json.dump(datos, f, ensure_ascii=False)
+            os.replace(temporal, ruta) # Reemplazo atómico: nunca queda un índice a medio escribir
+            return True
+        except OSError as e:
+            if temporal and os.path.exists(temporal):
+                os.remove(temporal)
+            with self._lock:
+                self._modificado = True
+            print(f"Error al guardar el índice de búsqueda en {ruta}: {e}", file=sys.stderr)
+            return False
+
+    def _cargar_documentos(self, documentos, version_cambios):
+        with self._lock:
+            self._vaciar()
+            self.version_cambios = version_cambios
+            for publicacion_id, frecuencias in documentos.items():
+                for termino, frecuencia in frecuencias.items():
+                    self._postings.setdefault(termino, {})[publicacion_id] = frecuencia
+                self._documentos[publicacion_id] = frecuencias
+                longitud = sum(frecuencias.values())
+                self._longitudes[publicacion_id] = longitud
+                self._total_longitud += longitud
+            self._terminos_sucios = True
+            self.cargado = True
+        self._iniciar_guardado_periodico()
+
+    def _iniciar_guardado_periodico(self):
+        with self._lock:
+            if self._hilo_guardado is None:
+                self._hilo_guardado = threading.Thread(target=self._guardado_periodico, name='guardado-indice', daemon=True)
+                self._hilo_guardado.start()
+
+    def _guardado_periodico(self):
+        while True:
+            time.sleep(SEARCH_GUARDADO_INTERVALO)
+            self.guardar()
+
+    def cargar(self, ruta=SEARCH_INDEX_PATH):
+        """Carga el índice guardado. Retorna False si no existe o tiene otro formato."""
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if datos.get("version") != VERSION_FORMATO:
+            return False
+        self._cargar_documentos({int(k): v for k, v in datos["documentos"].items()}, datos["version_cambios"])
+        return True
+
+    def asegurar_cargado(self, cursor):
+        """
+        Carga el índice guardado o, si no existe, lo construye desde MySQL. Después lo pone al día
+        con el registro de cambios, como mucho cada SEARCH_SINCRONIZAR_INTERVALO segundos.
+        """
+        if not self.cargado:
+            with self._lock:
+                if not self.cargado and not self.cargar():
+                    self.reconstruir(cursor)
+        if time.monotonic() - self._ultima_sincronizacion >= SEARCH_SINCRONIZAR_INTERVALO:
+            self.sincronizar(cursor)
+
+    def _version_actual(self, cursor):
+        cursor.execute("SELECT version, podado_hasta FROM cambios_secuencia WHERE id = 1")
+        return _columnas(cursor.fetchone(), 'version', 'podado_hasta')
+
+    def sincronizar(self, cursor):
+        """
+        Reindexa las publicaciones que cambiaron después de version_cambios, según el registro de cambios.
+        Las consultas se hacen sin retener el lock del índice; si otro hilo ya está sincronizando, no hace nada.
+        """
+        if not self._lock_sincronizacion.acquire(blocking=False):
+            return
+        try:
+            # Todo cambio con versión <= 'version' ya está confirmado: la versión se asigna bloqueando
+            # cambios_secuencia hasta el commit. Así lo leído hasta ahí no se vuelve a necesitar.
+            version, podado_hasta = self._version_actual(cursor)
+            desde = self.version_cambios
+            if version <= desde:
+                self._ultima_sincronizacion = time.monotonic()
+                return
+            if desde < podado_hasta:
+                self.reconstruir(cursor)
+                return
+            cursor.execute("""
+                SELECT DISTINCT entidad_id FROM cambios
+                WHERE version > %s AND version <= %s AND entidad = 'publicacion'
+                LIMIT %s
+            """, (desde, version, SEARCH_REPLAY_MAX + 1))
+            ids = [_columnas(fila, 'entidad_id')[0] for fila in cursor.fetchall()]
+            if len(ids) > SEARCH_REPLAY_MAX:
+                self.reconstruir(cursor)
+                return
+            filas = []
+            if ids:
+                marcadores = ', '.join(['%s'] * len(ids))
+                cursor.execute(f"SELECT id, titulo, texto FROM publicaciones WHERE id IN ({marcadores})", ids)
+                filas = [_columnas(fila, 'id', 'titulo', 'texto') for fila in cursor.fetchall()]
+            existentes = {pid: (titulo, texto) for pid, titulo, texto in filas}
+            with self._lock:
+                for publicacion_id in ids:
+                    if publicacion_id in existentes:
+                        self.indexar(publicacion_id, *existentes[publicacion_id])
+                    else:
+                        self.eliminar(publicacion_id)
+                self.version_cambios = max(self.version_cambios, version)
+                self._modificado = True
+            self._ultima_sincronizacion = time.monotonic()
+        finally:
+            self._lock_sincronizacion.release()
+
+    def reconstruir(self, cursor):
+        """Reindexa todas las publicaciones desde MySQL con el cursor dado."""
+        # La versión se lee antes que las publicaciones: lo que cambie entre ambas consultas se repite
+        # en la siguiente sincronización, y reindexar una publicación dos veces no tiene efecto.
+        version, _ = self._version_actual(cursor)
+        cursor.execute("SELECT id, titulo, texto FROM publicaciones")
+        documentos = {}
+        for fila in cursor.fetchall():
+            pid, titulo, texto = _columnas(fila, 'id', 'titulo', 'texto')
+            documentos[pid] = dict(self._frecuencias(titulo, texto))
+        self._cargar_documentos(documentos, version)
+        with self._lock:
+            self._modificado = True
+        self._ultima_sincronizacion = time.monotonic()
+
+
+indice_busqueda = IndiceBusqueda()
+
+atexit.register(indice_busqueda.guardar)
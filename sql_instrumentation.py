@@ -0,0 +1,222 @@
+"""
+Instrumentación de consultas SQL por solicitud.
+
+db_pool envuelve cada conexión prestada en ConexionInstrumentada; sus cursores
+miden cada execute/executemany y lo acumulan en `g` por huella de la sentencia
+(el SQL con literales, números y listas IN normalizados). Al terminar la
+solicitud:
+- se añade la cabecera `Server-Timing: db;dur=<ms>;desc="<n> consultas"`;
+- si una misma huella se ejecutó SQL_N_MAS_1_UMBRAL veces o más, se avisa de
+  un posible N+1 en stderr con la ruta y la sentencia;
+- las consultas de más de SQL_LENTA_MS milisegundos se registran con
+  probabilidad SQL_MUESTREO_LENTAS como JSON por línea en SQL_LOG_LENTAS
+  (o en stderr si no está configurado).
+
+Con SQL_EXPLICAR (solo para pruebas: duplica cada consulta) cada SELECT,
+UPDATE y DELETE se ejecuta antes con EXPLAIN, y las tablas leídas con un
+escaneo completo (type = ALL) se acumulan en `escaneos_completos`; lo usa
+benchmarks/planes.py.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+import MySQLdb.cursors
+from flask import current_app, g, has_request_context, request
+
+_PATRONES_HUELLA = (
+    (re.compile(r"--[^\n]*|/\*.*?\*/", re.S), ' '),                  # Comentarios
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\""), '?'), # Cadenas literales
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), '?'),                          # Números
+    (re.compile(r"%s|%\(\w+\)s"), '?'),                               # Marcadores de parámetros
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), '(...)'),             # Listas IN (?, ?, ...) de cualquier largo
+    (re.compile(r"\s+"), ' '),
+)
+
+_lock_log = threading.Lock()
+_SENTENCIAS_EXPLICABLES = ('select', 'update', 'delete')
+
+escaneos_completos = [] # Con SQL_EXPLICAR: {ruta, huella, tabla, filas}
+
+
+@lru_cache(maxsize=2048)
+def huella(sql):
+    """Forma normalizada de una sentencia, igual para todas las ejecuciones de la misma consulta."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    for patron, reemplazo in _PATRONES_HUELLA:
+        sql = patron.sub(reemplazo, sql)
+    return sql.strip()
+
+
+class EstadisticasSQL:
+    __slots__ = ('consultas', 'duracion', 'por_huella')
+
+    def __init__(self):
+        self.consultas = 0
+        self.duracion = 0.0
+        self.por_huella = Counter()
+
+    def registrar(self, sql, duracion):
+        self.consultas += 1
+        self.duracion += duracion
+        self.por_huella[huella(sql)] += 1
+
+
+def estadisticas_actuales():
+    """Estadísticas SQL del contexto de aplicación actual."""
+    estadisticas = g.get('_sql_estadisticas')
+    if estadisticas is None:
+        estadisticas = g._sql_estadisticas = EstadisticasSQL()
+    return estadisticas
+
+
+def _registrar_lenta(sql, parametros, duracion, origen):
+    config = current_app.config
+    if random.random() >= config['SQL_MUESTREO_LENTAS']:
+        return
+    registro = {
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "duracion_ms": round(duracion * 1000, 2),
+        "origen": origen,
+        "ruta": request.path if has_request_context() else None,
+        "huella": huella(sql),
+        "parametros": repr(parametros)[:500] if parametros is not None else None,
+    }
+    linea = json.dumps(registro, ensure_ascii=False)
+    ruta_log = config['SQL_LOG_LENTAS']
+    if not ruta_log:
+        print(f"Consulta lenta: {linea}", file=sys.stderr)
+        return
+    try:
+        with _lock_log, open(ruta_log, 'a', encoding='utf-8') as f:
+            f.write(linea + '\n')
+    except OSError as e:
+        print(f"Error al escribir en {ruta_log}: {e}", file=sys.stderr)
+
+
+def _explicar(conexion, sql, parametros):
+    """Ejecuta EXPLAIN de la sentencia y registra las tablas que se leen con un escaneo completo."""
+    texto = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else sql
+    if not texto.lstrip().lower().startswith(_SENTENCIAS_EXPLICABLES):
+        return
+    cursor = conexion.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute(f"EXPLAIN {texto}", parametros)
+        filas = cursor.fetchall()
+    except Exception as e:
+        print(f"No se pudo explicar la consulta {huella(sql)[:200]}: {e}", file=sys.stderr)
+        return
+    finally:
+        cursor.close()
+    for fila in filas:
+        tabla = fila.get('table') or ''
+        # Las tablas derivadas (<derived2>, <subquery3>...) se materializan y se recorren enteras por diseño.
+        if fila.get('type') == 'ALL' and not tabla.startswith('<'):
+            with _lock_log:
+                escaneos_completos.append({
+                    "ruta": f"{request.method} {request.path}" if has_request_context() else None,
+                    "huella": huella(sql),
+                    "tabla": tabla,
+                    "filas": fila.get('rows'),
+                })
+
+
+class CursorInstrumentado:
+    """Proxy de un cursor MySQLdb que mide execute y executemany."""
+
+    def __init__(self, cursor, origen, conexion=None):
+        self._cursor = cursor
+        self._origen = origen
+        self._conexion = conexion
+
+    def _medir(self, metodo, sql, parametros, explicable=False):
+        if explicable and self._conexion is not None and current_app.config['SQL_EXPLICAR']:
+            _explicar(self._conexion, sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, parametros)
+        finally:
+            duracion = time.perf_counter() - inicio
+            estadisticas_actuales().registrar(sql, duracion)
+            if duracion * 1000 >= current_app.config['SQL_LENTA_MS']:
+                _registrar_lenta(sql, parametros, duracion, self._origen)
+
+    def execute(self, sql, parametros=None):
+        return self._medir(self._cursor.execute, sql, parametros, explicable=True)
+
+    def executemany(self, sql, parametros):
+        return self._medir(self._cursor.executemany, sql, parametros)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class ConexionInstrumentada:
+    """Proxy de una conexión MySQLdb cuyos cursores son CursorInstrumentado."""
+
+    def __init__(self, conexion, origen):
+        self.conexion_real = conexion
+        self._origen = origen
+
+    def cursor(self, *args, **kwargs):
+        return CursorInstrumentado(self.conexion_real.cursor(*args, **kwargs), self._origen, self.conexion_real)
+
+    def __getattr__(self, nombre):
+        return getattr(self.conexion_real, nombre)
+
+
+def conexion_real(conexion):
+    """La conexión MySQLdb detrás de un proxy (o la misma si no está instrumentada)."""
+    return getattr(conexion, 'conexion_real', conexion)
+
+
+class InstrumentacionSQL:
+    def init_app(self, app):
+        app.config.setdefault('SQL_INSTRUMENTACION', True)
+        app.config.setdefault('SQL_N_MAS_1_UMBRAL', 5)      # Ejecuciones de una misma huella en una solicitud
+        app.config.setdefault('SQL_LENTA_MS', 200)
+        app.config.setdefault('SQL_MUESTREO_LENTAS', 1.0)   # Fracción de consultas lentas que se registran
+        app.config.setdefault('SQL_LOG_LENTAS', None)
+        app.config.setdefault('SQL_EXPLICAR', False)
+        if app.config['SQL_INSTRUMENTACION']:
+            app.after_request(self._despues_de_solicitud)
+
+    @staticmethod
+    def envolver(conexion, origen):
+        if not current_app.config['SQL_INSTRUMENTACION']:
+            return conexion
+        return ConexionInstrumentada(conexion, origen)
+
+    @staticmethod
+    def _despues_de_solicitud(respuesta):
+        estadisticas = g.get('_sql_estadisticas')
+        if estadisticas is None:
+            return respuesta
+        respuesta.headers.add(
+            'Server-Timing',
+            f'db;dur={estadisticas.duracion * 1000:.2f};desc="{estadisticas.consultas} consultas"'
+        )
+        umbral = current_app.config['SQL_N_MAS_1_UMBRAL']
+        for sentencia, veces in estadisticas.por_huella.items():
+            if veces >= umbral:
+                print(f"Posible N+1 en {request.method} {request.path}: {veces} ejecuciones de: {sentencia[:300]}", file=sys.stderr)
+        return respuesta
+
+
+instrumentacion_sql = InstrumentacionSQL()
@@ -1,13 +1,13 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect } from 'react';
 // eslint-disable-next-line no-unused-vars
 import { motion, AnimatePresence } from "framer-motion";
 import Comment from './Comment';
 import { useAuth } from '../context/AuthContext'; // Asegúrate de que la ruta sea correcta
 
 
-// Agregamos 'token' a las props que recibe BlogPost
-const BlogPost = ({ post, currentUser, token, onDeletePost, onEditClick, showNotification }) => {
-    const [comments, setComments] = useState([]); // Inicializamos los comentarios como un array vacío
+// Los comentarios llegan desde BlogPage, que los carga en lote para todos los posts visibles.
+// Tras añadir, editar o borrar, 'onCommentsChanged' trae los cambios desde la última sincronización.
+const BlogPost = ({ post, comments, onCommentsChanged, currentUser, token, onDeletePost, onEditClick, showNotification }) => {
     const [newComment, setNewComment] = useState('');
 
     // Obtener la URL base de la API
@@ -30,28 +30,6 @@ const BlogPost = ({ post, currentUser, token, onDeletePost, onEditClick, showNot
     }, [currentUser, post.autor_id, isPostOwner, token, post.id]); // Añadimos post.id y token a las dependencias
     // ------------------------------------------------------------------
 
-    // Función para obtener comentarios de la API
-    const fetchComments = useCallback(async () => {
-        try {
-            const response = await fetch(`${API_URL}/publicaciones/${post.id}/comentarios`);
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'No se pudieron obtener los comentarios.');
-            }
-            const data = await response.json();
-            setComments(data);
-        } catch (error) {
-            console.error("Error fetching comments:", error);
-            showNotification(`Error al cargar comentarios: ${error.message}`, 'error');
-            setComments([]); // Asegurarse de que los comentarios estén vacíos en caso de error
-        }
-    }, [API_URL, post.id, showNotification]);
-
-    // Efecto para cargar los comentarios cuando el componente se monta o el post.id cambia
-    useEffect(() => {
-        fetchComments();
-    }, [fetchComments]);
-
     // Manejador para añadir un comentario
     const handleAddComment = async (e) => {
         e.preventDefault();
@@ -82,7 +60,7 @@ const BlogPost = ({ post, currentUser, token, onDeletePost, onEditClick, showNot
             const responseData = await response.json();
             showNotification(responseData.message || "Comentario añadido exitosamente.", 'success');
             setNewComment(''); // Limpiar el campo de texto
-            fetchComments(); // Volver a cargar los comentarios para ver el nuevo
+            onCommentsChanged(); // Volver a cargar los comentarios para ver el nuevo
         } catch (error) {
             console.error("Error adding comment:", error);
             showNotification(`Error al añadir comentario: ${error.message}`, 'error');
@@ -111,7 +89,7 @@ const BlogPost = ({ post, currentUser, token, onDeletePost, onEditClick, showNot
 
                 const responseData = await response.json();
                 showNotification(responseData.message || "Comentario eliminado exitosamente.", 'success');
-                fetchComments(); // Volver a cargar los comentarios
+                onCommentsChanged(); // Volver a cargar los comentarios
             } catch (error) {
                 console.error("Error deleting comment:", error);
                 showNotification(`Error al eliminar comentario: ${error.message}`, 'error');
@@ -147,7 +125,7 @@ const BlogPost = ({ post, currentUser, token, onDeletePost, onEditClick, showNot
 
             const responseData = await response.json();
             showNotification(responseData.message || "Comentario editado exitosamente.", 'success');
-            fetchComments(); // Volver a cargar los comentarios
+            onCommentsChanged(); // Volver a cargar los comentarios
         } catch (error) {
             console.error("Error editing comment:", error);
             showNotification(`Error al editar comentario: ${error.message}`, 'error');
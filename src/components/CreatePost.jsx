@@ -4,8 +4,8 @@ const CreatePost = ({ onPostCreated, postToEdit, onPostUpdated, onCancelEdit, on
     // --- ESTADOS INTERNOS DEL FORMULARIO ---
     const [title, setTitle] = useState('');
     const [content, setContent] = useState('');
-    const [imageFile, setImageFile] = useState(null); // Guarda el archivo de imagen para subirlo
-    const [imagePreview, setImagePreview] = useState(''); // Guarda la URL de previsualización
+    const [imageFiles, setImageFiles] = useState([]); // Guarda los archivos de imagen para subirlos juntos
+    const [imagePreviews, setImagePreviews] = useState([]); // Guarda las URLs de previsualización
 
     const isEditing = !!postToEdit; // Determina si estamos en modo "edición"
 
@@ -14,27 +14,29 @@ const CreatePost = ({ onPostCreated, postToEdit, onPostUpdated, onCancelEdit, on
         if (isEditing) {
             setTitle(postToEdit.title);
             setContent(postToEdit.content);
-            setImagePreview(postToEdit.imageUrl);
-            setImageFile(null); // Reseteamos el archivo
+            setImagePreviews(postToEdit.imageUrl ? [postToEdit.imageUrl] : []);
+            setImageFiles([]); // Reseteamos los archivos
         } else {
             // Limpiar el formulario si no estamos editando
             setTitle('');
             setContent('');
-            setImageFile(null);
-            setImagePreview('');
+            setImageFiles([]);
+            setImagePreviews([]);
         }
     }, [postToEdit, isEditing]);
 
-    // Maneja la selección de un nuevo archivo de imagen
+    // Libera las URLs locales de las vistas previas cuando se reemplazan o se desmonta el formulario
+    useEffect(() => {
+        return () => imagePreviews.forEach((url) => {
+            if (url.startsWith('blob:')) URL.revokeObjectURL(url);
+        });
+    }, [imagePreviews]);
+
+    // Maneja la selección de nuevos archivos de imagen (se pueden elegir varios a la vez)
     const handleImageChange = (e) => {
-        const file = e.target.files && e.target.files[0];
-        if (file) {
-            setImageFile(file); // Guardamos el objeto del archivo para la subida
-            setImagePreview(URL.createObjectURL(file)); // Creamos una URL local para la vista previa
-        } else {
-            setImageFile(null);
-            setImagePreview('');
-        }
+        const files = Array.from(e.target.files || []);
+        setImageFiles(files); // Guardamos los archivos para subirlos en una sola solicitud
+        setImagePreviews(files.map((file) => URL.createObjectURL(file))); // URLs locales para las vistas previas
     };
 
     // Maneja el envío del formulario
@@ -49,10 +51,10 @@ const CreatePost = ({ onPostCreated, postToEdit, onPostUpdated, onCancelEdit, on
 
         if (isEditing) {
             // En modo edición, pasa los datos actualizados al padre
-            onPostUpdated(postToEdit.id, { title, content, imageFile });
+            onPostUpdated(postToEdit.id, { title, content, imageFiles });
         } else {
             // En modo creación, pasa los datos nuevos al padre
-            onPostCreated({ title, content, imageFile });
+            onPostCreated({ title, content, imageFiles });
         }
     };
 
@@ -96,20 +98,21 @@ const CreatePost = ({ onPostCreated, postToEdit, onPostUpdated, onCancelEdit, on
 
                 <div className="input-group">
                     <label htmlFor="imageUpload" className="image-upload-label">
-                        {imagePreview ? 'Cambiar Estandarte (Imagen)' : 'Seleccionar un Estandarte (Imagen)'}
+                        {imagePreviews.length > 0 ? 'Cambiar Estandartes (Imágenes)' : 'Seleccionar Estandartes (Imágenes)'}
                     </label>
                     <input
                         id="imageUpload"
                         type="file"
                         accept="image/*"
+                        multiple
                         onChange={handleImageChange}
                     />
                     <p className="image-recommendation">
                         Para mejor calidad, se recomienda una imagen de al menos 800px de ancho.
                     </p>
-                    {imagePreview && (
-                        <img src={imagePreview} alt="Vista previa" className="image-preview" />
-                    )}
+                    {imagePreviews.map((url, index) => (
+                        <img key={url} src={url} alt={`Vista previa ${index + 1}`} className="image-preview" />
+                    ))}
                 </div>
 
                 <div className="button-group">
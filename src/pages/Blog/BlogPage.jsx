@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from "react";
+import React, { useState, useEffect, useCallback, useRef } from "react";
 // eslint-disable-next-line no-unused-vars
 import { motion, AnimatePresence } from "framer-motion";
 import BlogPost from '../../components/BlogPost';
@@ -6,14 +6,30 @@ import CreatePost from '../../components/CreatePost';
 import { useAuth } from '../../context/AuthContext';
 import './Blog.css'; // Asegúrate de que este archivo CSS contenga los estilos que hemos discutido
 
+const POSTS_PER_PAGE = 20; // Tamaño de página del feed paginado por cursor
+const SYNC_INTERVAL_MS = 30000; // Sin eventos en vivo, cada cuánto se piden los cambios con la pestaña visible
+const SYNC_DEBOUNCE_MS = 300; // Agrupa en una sola sincronización los eventos que llegan seguidos
+
+// Orden del feed: más recientes primero, desempatando por ID
+const compareFeedOrder = (a, b) =>
+    (new Date(b.created_at) - new Date(a.created_at)) || (b.id - a.id);
+
+const compareCommentOrder = (a, b) =>
+    (new Date(a.created_at) - new Date(b.created_at)) || (a.id - b.id);
+
 const BlogPage = () => {
     // --- ESTADOS ---
     const [posts, setPosts] = useState([]); // Inicia vacío, se cargará desde la API
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null); // Cursor opaco de la siguiente página del feed
+    const [loadingMore, setLoadingMore] = useState(false);
+    const [commentsByPost, setCommentsByPost] = useState({}); // Comentarios indexados por ID de post
     const { user, token } = useAuth(); // Obtener el 'user' y el 'token' directamente
     const [notification, setNotification] = useState({ message: '', type: '' });
     const [editingPostId, setEditingPostId] = useState(null);
     const [isCreating, setIsCreating] = useState(false);
+    const syncVersion = useRef(null); // Última versión del registro de cambios aplicada
+    const liveEvents = useRef(false); // true mientras la conexión a /eventos está abierta
     const API_URL = import.meta.env.VITE_API_URL;
 
     // --- EFECTOS ---
@@ -36,35 +52,191 @@ const BlogPage = () => {
         setNotification({ message, type });
     }, []); // Dependencia vacía significa que la función solo se crea una vez
 
-    // Función para obtener todos los posts
+    // Obtiene los comentarios de varios posts en una sola solicitud
+    const fetchComments = useCallback(async (postIds) => {
+        if (!postIds.length) return;
+        try {
+            const response = await fetch(`${API_URL}/publicaciones/comentarios?ids=${postIds.join(',')}`);
+            if (!response.ok) {
+                const errorData = await response.json();
+                throw new Error(errorData.error || 'No se pudieron obtener los comentarios.');
+            }
+            const data = await response.json();
+            setCommentsByPost((prev) => ({ ...prev, ...data.comentarios }));
+        } catch (error) {
+            console.error("Error fetching comments:", error);
+            showNotification(`Error al cargar comentarios: ${error.message}`, 'error');
+        }
+    }, [API_URL, showNotification]);
+
+    // Función para obtener la primera página de posts
     const fetchPosts = useCallback(async () => {
         setLoading(true);
         try {
-            const response = await fetch(`${API_URL}/publicaciones`);
+            // La versión se pide antes que el feed: un cambio intermedio se volverá a recibir, nunca se pierde
+            const responseVersion = await fetch(`${API_URL}/publicaciones/sync`);
+            syncVersion.current = responseVersion.ok ? (await responseVersion.json()).version : null;
+
+            const response = await fetch(`${API_URL}/publicaciones?limit=${POSTS_PER_PAGE}`);
             if (!response.ok) {
                 const errorData = await response.json();
                 throw new Error(errorData.error || "No se pudieron cargar las crónicas.");
             }
             const data = await response.json();
-            setPosts(data);
-            console.log("DEBUG: Publicaciones cargadas:", data); // <--- NUEVO CONSOLE.LOG AQUÍ
+            setPosts(data.publicaciones);
+            setNextCursor(data.next_cursor);
+            fetchComments(data.publicaciones.map((post) => post.id));
         } catch (error) {
             showNotification(error.message, 'error');
-            console.error("Error al cargar publicaciones:", error); // <--- NUEVO CONSOLE.LOG DE ERROR
+            console.error("Error al cargar publicaciones:", error);
         } finally {
             setLoading(false);
         }
-    }, [API_URL, showNotification]); // showNotification ahora es una dependencia estable
+    }, [API_URL, showNotification, fetchComments]); // showNotification ahora es una dependencia estable
+
+    // Función para cargar la siguiente página a partir del cursor devuelto por la API
+    const fetchMorePosts = async () => {
+        if (!nextCursor || loadingMore) return;
+        setLoadingMore(true);
+        try {
+            const response = await fetch(`${API_URL}/publicaciones?limit=${POSTS_PER_PAGE}&cursor=${encodeURIComponent(nextCursor)}`);
+            if (!response.ok) {
+                const errorData = await response.json();
+                throw new Error(errorData.error || "No se pudieron cargar más crónicas.");
+            }
+            const data = await response.json();
+            setPosts((prevPosts) => [...prevPosts, ...data.publicaciones]);
+            setNextCursor(data.next_cursor);
+            fetchComments(data.publicaciones.map((post) => post.id));
+        } catch (error) {
+            showNotification(error.message, 'error');
+            console.error("Error al cargar más publicaciones:", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
+    // Aplica solo lo que cambió desde la última versión, en lugar de recargar el feed y los comentarios
+    const syncChanges = useCallback(async () => {
+        if (syncVersion.current === null) {
+            await fetchPosts();
+            return;
+        }
+        try {
+            let hasMore = true;
+            while (hasMore) {
+                const response = await fetch(`${API_URL}/publicaciones/sync?since=${syncVersion.current}`);
+                if (response.status === 410) { // Versión demasiado antigua: recarga completa
+                    await fetchPosts();
+                    return;
+                }
+                if (!response.ok) {
+                    const errorData = await response.json();
+                    throw new Error(errorData.error || 'No se pudieron sincronizar las crónicas.');
+                }
+                const data = await response.json();
+                const deletedPosts = new Set(data.eliminados.publicaciones);
+                const deletedComments = new Set(data.eliminados.comentarios);
+
+                setPosts((prevPosts) => {
+                    const changed = new Map(data.publicaciones.map((post) => [post.id, post]));
+                    const oldest = prevPosts[prevPosts.length - 1];
+                    const updated = prevPosts
+                        .filter((post) => !deletedPosts.has(post.id))
+                        .map((post) => {
+                            const fresh = changed.get(post.id);
+                            changed.delete(post.id);
+                            return fresh || post;
+                        });
+                    // Las publicaciones que no estaban cargadas se agregan solo si caen en el rango ya mostrado
+                    const added = [...changed.values()].filter((post) =>
+                        !nextCursor || !oldest || compareFeedOrder(post, oldest) <= 0);
+                    return added.length ? [...updated, ...added].sort(compareFeedOrder) : updated;
+                });
+
+                setCommentsByPost((prev) => {
+                    const next = {};
+                    for (const [postId, comments] of Object.entries(prev)) {
+                        if (deletedPosts.has(Number(postId))) continue;
+                        next[postId] = comments.filter((comment) => !deletedComments.has(comment.id));
+                    }
+                    for (const comment of data.comentarios) {
+                        const list = (next[comment.publicacion_id] || []).filter((c) => c.id !== comment.id);
+                        next[comment.publicacion_id] = [...list, comment].sort(compareCommentOrder);
+                    }
+                    return next;
+                });
+
+                syncVersion.current = data.version;
+                hasMore = data.mas;
+            }
+        } catch (error) {
+            console.error("Error al sincronizar publicaciones:", error);
+            showNotification(error.message, 'error');
+        }
+    }, [API_URL, fetchPosts, nextCursor, showNotification]);
 
     // Carga los posts iniciales al montar el componente
     useEffect(() => {
         fetchPosts();
     }, [fetchPosts]);
 
+    // La conexión de eventos usa siempre la última syncChanges sin tener que reconectarse
+    const syncRef = useRef(syncChanges);
+    useEffect(() => {
+        syncRef.current = syncChanges;
+    }, [syncChanges]);
+
+    // Eventos en vivo: un cambio de cualquier usuario dispara una sincronización incremental.
+    // EventSource reconecta solo y envía Last-Event-ID para recibir lo que se perdió.
+    useEffect(() => {
+        if (typeof EventSource === 'undefined') return;
+        const source = new EventSource(`${API_URL}/eventos`);
+        let timerId = null;
+        const scheduleSync = () => {
+            clearTimeout(timerId);
+            timerId = setTimeout(() => syncRef.current(), SYNC_DEBOUNCE_MS);
+        };
+        source.onopen = () => { liveEvents.current = true; };
+        source.onerror = () => { liveEvents.current = false; };
+        source.addEventListener('cambio', scheduleSync);
+        source.addEventListener('sincronizar', scheduleSync);
+        return () => {
+            clearTimeout(timerId);
+            source.close();
+            liveEvents.current = false;
+        };
+    }, [API_URL]);
+
+    // Sincronización periódica mientras no hay eventos en vivo: sin cambios, cuesta una respuesta casi vacía
+    useEffect(() => {
+        const intervalId = setInterval(() => {
+            if (document.visibilityState === 'visible' && !liveEvents.current) syncChanges();
+        }, SYNC_INTERVAL_MS);
+        return () => clearInterval(intervalId);
+    }, [syncChanges]);
+
     // --- MANEJADORES DE EVENTOS ---
 
+    // Sube todas las imágenes de una publicación en una sola solicitud multipart
+    const uploadImages = async (postId, imageFiles, errorMessage) => {
+        const formData = new FormData();
+        imageFiles.forEach((file) => formData.append('imagenes_publicacion', file));
+
+        const responseImg = await fetch(`${API_URL}/publicaciones/${postId}/upload_imagenes`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` },
+            body: formData
+        });
+
+        if (!responseImg.ok) {
+            const imgError = await responseImg.json();
+            throw new Error(imgError.error || errorMessage);
+        }
+    };
+
     // Manejador para la creación de posts (proceso de 2 pasos)
-    const handlePostCreated = async ({ title, content, imageFile }) => {
+    const handlePostCreated = async ({ title, content, imageFiles }) => {
         if (!token) {
             showNotification("Debes iniciar sesión para publicar.", "error");
             return;
@@ -88,26 +260,14 @@ const BlogPage = () => {
 
             const newPostId = dataText.publicacion_id;
 
-            // PASO 2: Si hay un archivo de imagen, subirlo al post recién creado
-            if (imageFile && newPostId) {
-                const formData = new FormData();
-                formData.append('imagen_publicacion', imageFile);
-
-                const responseImg = await fetch(`${API_URL}/publicaciones/${newPostId}/upload_imagen`, {
-                    method: 'POST',
-                    headers: { 'Authorization': `Bearer ${token}` },
-                    body: formData
-                });
-
-                if (!responseImg.ok) {
-                    const imgError = await responseImg.json();
-                    throw new Error(imgError.error || "El texto se guardó, pero falló la subida de la imagen.");
-                }
+            // PASO 2: Si hay imágenes, subirlas juntas al post recién creado
+            if (imageFiles.length > 0 && newPostId) {
+                await uploadImages(newPostId, imageFiles, "El texto se guardó, pero falló la subida de las imágenes.");
             }
 
-            // Éxito: Cierra el modal, recarga los posts y muestra notificación de éxito
+            // Éxito: Cierra el modal, trae los cambios y muestra notificación de éxito
             setIsCreating(false);
-            await fetchPosts();
+            await syncChanges();
             showNotification('¡Nueva crónica forjada con éxito!', 'success');
 
         } catch (error) {
@@ -134,23 +294,13 @@ const BlogPage = () => {
             const data = await response.json();
             if (!response.ok) throw new Error(data.error || "Error al actualizar la publicación.");
 
-            // Si hay una nueva imagen, subirla
-            if (updatedData.imageFile) {
-                const formData = new FormData();
-                formData.append('imagen_publicacion', updatedData.imageFile);
-                const responseImg = await fetch(`${API_URL}/publicaciones/${postId}/upload_imagen`, {
-                    method: 'POST', // O PUT si tu backend lo soporta para reemplazar
-                    headers: { 'Authorization': `Bearer ${token}` },
-                    body: formData
-                });
-                if (!responseImg.ok) {
-                    const imgError = await responseImg.json();
-                    throw new Error(imgError.error || "El texto se actualizó, pero falló la subida de la nueva imagen.");
-                }
+            // Si hay nuevas imágenes, agregarlas a la publicación
+            if (updatedData.imageFiles.length > 0) {
+                await uploadImages(postId, updatedData.imageFiles, "El texto se actualizó, pero falló la subida de las nuevas imágenes.");
             }
 
             setEditingPostId(null);
-            await fetchPosts(); // Recargar posts
+            await syncChanges(); // Traer solo la publicación editada
             showNotification('Crónica actualizada con éxito.', 'success');
         } catch (error) {
             showNotification(error.message, 'error');
@@ -173,7 +323,7 @@ const BlogPage = () => {
                 if (!response.ok) throw new Error(data.error);
                 
                 showNotification('La crónica ha sido borrada.', 'success');
-                fetchPosts(); // Recargar la lista de posts
+                syncChanges(); // Quitarla de la lista sin recargar el feed
             } catch (error) {
                 showNotification(error.message, 'error');
             }
@@ -224,6 +374,8 @@ const BlogPage = () => {
                             <BlogPost
                                 key={post.id}
                                 post={post}
+                                comments={commentsByPost[post.id] || []}
+                                onCommentsChanged={syncChanges}
                                 currentUser={user}
                                 token={token}
                                 onDeletePost={handleDeletePost}
@@ -235,6 +387,12 @@ const BlogPage = () => {
                 ) : (
                     <p>Aún no se han escrito crónicas. ¡Sé el primero en forjar una leyenda!</p>
                 )}
+
+                {nextCursor && (
+                    <button className="load-more-button" onClick={fetchMorePosts} disabled={loadingMore}>
+                        {loadingMore ? 'Cargando...' : 'Cargar más crónicas'}
+                    </button>
+                )}
             </div>
 
             <AnimatePresence>
@@ -0,0 +1,354 @@
+"""
+Borrado diferido de archivos subidos y reconciliación de UPLOAD_FOLDER con la base.
+
+Las rutas que dejan archivos sin uso (eliminar una publicación, cambiar la foto
+de perfil) no los borran mientras la solicitud espera: los anotan con
+programar_borrado en `archivos_pendientes`, en la misma transacción que libera
+sus referencias, y después del commit avisan al recolector. Si la transacción
+falla no queda nada anotado y los archivos siguen en su sitio.
+
+Los blobs que creó una subida fallida tampoco se borran directamente: mientras
+tanto otra subida idéntica pudo encontrarlos y referenciarlos. descartar_nuevos
+los anota en una transacción propia y el recolector los borra solo si siguen
+sin fila en `blobs`; si ni siquiera se pueden anotar, los recoge la
+reconciliación.
+
+- El recolector es un hilo por proceso que toma lotes de ARCHIVOS_LOTE con
+  FOR UPDATE SKIP LOCKED (varios workers no se pisan), vuelve a comprobar en
+  `blobs` que cada archivo siga sin referencias y lo borra. Se despierta con
+  cada aviso y cada ARCHIVOS_GC_INTERVALO segundos.
+- El reconciliador recorre UPLOAD_FOLDER y anota como pendientes los archivos
+  con más de ARCHIVOS_GRACIA segundos que nada referencia: blobs sin fila en
+  `blobs`, temporales abandonados en blobs/tmp y archivos anteriores al
+  almacén de blobs que no aparecen en imagenes_publicacion.url ni en
+  users.foto_perfil. También informa de las filas de `blobs` cuyo archivo
+  falta. Se ejecuta cada ARCHIVOS_RECONCILIAR_HORAS horas (0 lo desactiva),
+  en un solo proceso a la vez.
+
+Comandos (con el blueprint registrado en la aplicación):
+    flask archivos recolectar
+    flask archivos reconciliar [--aplicar]
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+
+import click
+from flask import Blueprint, current_app
+
+from db_pool import mysql
+from blob_store import CARPETA_BLOBS
+
+archivos_bp = Blueprint('archivos', __name__)
+
+ARCHIVOS_LOTE = int(os.getenv('ARCHIVOS_LOTE', '100'))
+ARCHIVOS_MAX_INTENTOS = int(os.getenv('ARCHIVOS_MAX_INTENTOS', '5'))
+ARCHIVOS_GC_INTERVALO = float(os.getenv('ARCHIVOS_GC_INTERVALO', '60'))
+ARCHIVOS_GRACIA = float(os.getenv('ARCHIVOS_GRACIA', '3600'))        # Antigüedad mínima de un huérfano en disco
+ARCHIVOS_RECONCILIAR_HORAS = float(os.getenv('ARCHIVOS_RECONCILIAR_HORAS', '24'))
+BLOQUEO_RECONCILIACION = 'upload_gc_reconciliar'
+CARPETA_TMP = f"{CARPETA_BLOBS}/tmp/"
+
+
+def programar_borrado(cursor, rutas):
+    """
+    Anota archivos para borrar dentro de la transacción actual; no hace commit.
+    Las rutas son relativas a UPLOAD_FOLDER (las absolutas, de archivos anteriores al almacén de blobs, también valen).
+    """
+    rutas = [ruta for ruta in rutas if ruta]
+    if not rutas:
+        return
+    cursor.executemany(
+        "INSERT INTO archivos_pendientes (ruta) VALUES (%s) ON DUPLICATE KEY UPDATE intentos = 0",
+        [(ruta,) for ruta in rutas]
+    )
+
+
+def descartar_nuevos(blobs):
+    """
+    Anota para borrar los blobs que creó una operación que terminó fallando (Blob.nuevo),
+    hace commit en una transacción propia y avisa al recolector. Llamar después del rollback.
+    """
+    rutas = [blob.ruta_relativa for blob in blobs if blob.nuevo]
+    if not rutas:
+        return
+    cursor = mysql.connection.cursor()
+    try:
+        programar_borrado(cursor, rutas)
+        mysql.connection.commit()
+    except Exception as e:
+        print(f"No se pudieron anotar {len(rutas)} archivos descartados; los recogerá la reconciliación: {e}", file=sys.stderr)
+        return
+    finally:
+        cursor.close()
+    recolector_archivos.avisar(current_app._get_current_object())
+
+
+def _marcadores(valores):
+    return ', '.join(['%s'] * len(valores))
+
+
+def recolectar_lote(upload_folder, lote=ARCHIVOS_LOTE):
+    """
+    Borra del disco un lote de archivos pendientes y hace commit.
+    Retorna (borrados, conservados porque volvieron a usarse, errores).
+    """
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, ruta FROM archivos_pendientes
+            WHERE intentos < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (ARCHIVOS_MAX_INTENTOS, lote))
+        pendientes = cursor.fetchall()
+        if not pendientes:
+            mysql.connection.rollback()
+            return 0, 0, 0
+
+        # Una subida idéntica pudo volver a referenciar el blob después de anotarlo. El bloqueo de estas
+        # filas (o del hueco, si no existen) hace esperar a un INSERT en `blobs` hasta el commit, y
+        # blob_store.comprobar_reutilizados detecta del otro lado un archivo borrado mientras tanto.
+        rutas_blob = [ruta for _, ruta in pendientes if ruta.startswith(f"{CARPETA_BLOBS}/")]
+        en_uso = set()
+        if rutas_blob:
+            cursor.execute(f"SELECT ruta FROM blobs WHERE ruta IN ({_marcadores(rutas_blob)}) FOR UPDATE", rutas_blob)
+            en_uso = {fila[0] for fila in cursor.fetchall()}
+
+        terminados = []
+        fallidos = []
+        borrados = 0
+        for pendiente_id, ruta in pendientes:
+            if ruta not in en_uso:
+                try:
+                    os.remove(os.path.join(upload_folder, ruta))
+                    borrados += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error al borrar el archivo pendiente {ruta}: {e}", file=sys.stderr)
+                    fallidos.append(pendiente_id)
+                    continue
+            terminados.append(pendiente_id)
+
+        if terminados:
+            cursor.execute(f"DELETE FROM archivos_pendientes WHERE id IN ({_marcadores(terminados)})", terminados)
+        if fallidos:
+            cursor.execute(f"UPDATE archivos_pendientes SET intentos = intentos + 1 WHERE id IN ({_marcadores(fallidos)})", fallidos)
+        mysql.connection.commit()
+        return borrados, len(en_uso), len(fallidos)
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _archivos_antiguos(upload_folder, limite):
+    """Rutas relativas (con '/') de los archivos de upload_folder modificados antes de 'limite'."""
+    for raiz, _, nombres in os.walk(upload_folder):
+        for nombre in nombres:
+            ruta_local = os.path.join(raiz, nombre)
+            try:
+                if os.path.getmtime(ruta_local) >= limite:
+                    continue
+            except FileNotFoundError:
+                continue
+            yield os.path.relpath(ruta_local, upload_folder).replace(os.sep, '/')
+
+
+def _ruta_en_uploads(url):
+    marcador = '/uploads/'
+    if not url or marcador not in url:
+        return None
+    return url[url.index(marcador) + len(marcador):]
+
+
+def _rutas_heredadas_en_uso(cursor):
+    """Rutas relativas de los archivos fuera del almacén de blobs que la base todavía referencia."""
+    patron_blob = f"%/uploads/{CARPETA_BLOBS}/%"
+    cursor.execute("""
+        SELECT url FROM imagenes_publicacion WHERE url NOT LIKE %s
+        UNION ALL
+        SELECT foto_perfil FROM users WHERE foto_perfil IS NOT NULL AND foto_perfil NOT LIKE %s
+    """, (patron_blob, patron_blob))
+    return {_ruta_en_uploads(fila[0]) for fila in cursor.fetchall()}
+
+
+def _blobs_faltantes(cursor, upload_folder, lote):
+    """Filas de `blobs` cuyo archivo no está en disco (sus URLs responden 404)."""
+    faltantes = []
+    ultima = ''
+    while True:
+        cursor.execute("SELECT ruta FROM blobs WHERE ruta > %s ORDER BY ruta LIMIT %s", (ultima, lote))
+        rutas = [fila[0] for fila in cursor.fetchall()]
+        if not rutas:
+            return faltantes
+        faltantes.extend(ruta for ruta in rutas if not os.path.exists(os.path.join(upload_folder, ruta)))
+        ultima = rutas[-1]
+
+
+def reconciliar(upload_folder, aplicar=False, gracia=ARCHIVOS_GRACIA, lote=ARCHIVOS_LOTE):
+    """
+    Compara UPLOAD_FOLDER con la base. Retorna (huérfanos, blobs faltantes), ambos como rutas relativas.
+    Con aplicar=True los huérfanos se anotan en archivos_pendientes (un commit por lote) para el recolector.
+    """
+    huerfanos = []
+    cursor = mysql.connection.cursor()
+    try:
+        heredadas_en_uso = _rutas_heredadas_en_uso(cursor)
+        archivos = _archivos_antiguos(upload_folder, time.time() - gracia)
+        while True:
+            rutas = list(itertools.islice(archivos, lote))
+            if not rutas:
+                break
+            # Los temporales de guardar_stream no llegan a tener fila: pasada la gracia, la subida se abandonó.
+            nuevos = [ruta for ruta in rutas if ruta.startswith(CARPETA_TMP)]
+            nuevos.extend(ruta for ruta in rutas if not ruta.startswith(f"{CARPETA_BLOBS}/") and ruta not in heredadas_en_uso)
+            rutas_blob = [ruta for ruta in rutas if ruta.startswith(f"{CARPETA_BLOBS}/") and not ruta.startswith(CARPETA_TMP)]
+            if rutas_blob:
+                cursor.execute(f"SELECT ruta FROM blobs WHERE ruta IN ({_marcadores(rutas_blob)})", rutas_blob)
+                con_fila = {fila[0] for fila in cursor.fetchall()}
+                nuevos.extend(ruta for ruta in rutas_blob if ruta not in con_fila)
+            if aplicar and nuevos:
+                programar_borrado(cursor, nuevos)
+                mysql.connection.commit()
+            huerfanos.extend(nuevos)
+        faltantes = _blobs_faltantes(cursor, upload_folder, lote)
+        return huerfanos, faltantes
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+class RecolectorArchivos:
+    def __init__(self, intervalo=ARCHIVOS_GC_INTERVALO, horas_reconciliacion=ARCHIVOS_RECONCILIAR_HORAS):
+        self.intervalo = intervalo
+        self.horas_reconciliacion = horas_reconciliacion
+        self._app = None
+        self._hilo = None
+        self._avisado = False
+        self._cond = threading.Condition()
+        self.borrados = 0
+        self.conservados = 0
+        self.errores = 0
+        self.huerfanos = 0
+        self.blobs_faltantes = 0
+        self.reconciliaciones = 0
+
+    def init_app(self, app):
+        """Inicia el hilo al crear la aplicación, para que la recolección y la reconciliación periódicas corran aunque nadie avise."""
+        self.avisar(app)
+
+    def avisar(self, app):
+        """Pide una recolección en cuanto sea posible; llamar después del commit que anotó los archivos."""
+        with self._cond:
+            self._app = app
+            self._avisado = True
+            # El hilo se crea con el primer aviso para no arrancarlo al solo importar el módulo.
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._ciclo, name='recolector-archivos', daemon=True)
+                self._hilo.start()
+            self._cond.notify()
+
+    def _ciclo(self):
+        proxima_reconciliacion = time.monotonic() + self.horas_reconciliacion * 3600
+        while True:
+            with self._cond:
+                if not self._avisado:
+                    self._cond.wait(self.intervalo)
+                self._avisado = False
+                app = self._app
+            try:
+                with app.app_context():
+                    upload_folder = app.config.get('UPLOAD_FOLDER')
+                    if not upload_folder:
+                        continue
+                    self._recolectar(upload_folder)
+                    if self.horas_reconciliacion > 0 and time.monotonic() >= proxima_reconciliacion:
+                        proxima_reconciliacion = time.monotonic() + self.horas_reconciliacion * 3600
+                        self._reconciliar(upload_folder)
+            except Exception as e:
+                print(f"Error en el recolector de archivos: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+
+    def _recolectar(self, upload_folder):
+        while True:
+            borrados, conservados, errores = recolectar_lote(upload_folder)
+            with self._cond:
+                self.borrados += borrados
+                self.conservados += conservados
+                self.errores += errores
+            if borrados + conservados + errores < ARCHIVOS_LOTE:
+                return
+
+    def _reconciliar(self, upload_folder):
+        # Un bloqueo con nombre de MySQL: con varios workers, solo uno recorre el disco.
+        cursor = mysql.connection.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (BLOQUEO_RECONCILIACION,))
+            if not cursor.fetchone()[0]:
+                return
+            try:
+                huerfanos, faltantes = reconciliar(upload_folder, aplicar=True)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (BLOQUEO_RECONCILIACION,))
+                cursor.fetchone()
+        finally:
+            cursor.close()
+        if faltantes:
+            print(f"Reconciliación de archivos: {len(faltantes)} blobs sin archivo en disco, p. ej. {faltantes[0]}", file=sys.stderr)
+        with self._cond:
+            self.reconciliaciones += 1
+            self.huerfanos += len(huerfanos)
+            self.blobs_faltantes = len(faltantes)
+        self._recolectar(upload_folder)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "borrados": self.borrados,
+                "conservados": self.conservados,
+                "errores": self.errores,
+                "huerfanos": self.huerfanos,
+                "blobs_faltantes": self.blobs_faltantes,
+                "reconciliaciones": self.reconciliaciones,
+            }
+
+
+recolector_archivos = RecolectorArchivos()
+
+
+@archivos_bp.cli.command('recolectar')
+def recolectar():
+    """Borra ahora todos los archivos pendientes."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    total = [0, 0, 0]
+    while True:
+        resultado = recolectar_lote(upload_folder)
+        total = [t + r for t, r in zip(total, resultado)]
+        if sum(resultado) < ARCHIVOS_LOTE:
+            break
+    click.echo(f"{total[0]} archivos borrados, {total[1]} conservados por estar en uso, {total[2]} con errores.")
+
+
+@archivos_bp.cli.command('reconciliar')
+@click.option('--aplicar', is_flag=True, help='Anotar los huérfanos para borrarlos (por defecto solo se listan).')
+@click.option('--gracia', type=float, default=ARCHIVOS_GRACIA, show_default=True, help='Ignorar archivos modificados hace menos de estos segundos.')
+def reconciliar_uploads(aplicar, gracia):
+    """Busca en UPLOAD_FOLDER archivos que la base no referencia y blobs cuyo archivo falta."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    huerfanos, faltantes = reconciliar(upload_folder, aplicar=aplicar, gracia=gracia)
+    for ruta in huerfanos:
+        click.echo(f"huérfano  {ruta}")
+    for ruta in faltantes:
+        click.echo(f"faltante  {ruta}")
+    click.echo(f"{len(huerfanos)} huérfanos, {len(faltantes)} blobs sin archivo.", err=True)
+    if aplicar and huerfanos:
+        click.echo("Anotados en archivos_pendientes; ejecuta 'flask archivos recolectar' para borrarlos ya.", err=True)
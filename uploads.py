@@ -0,0 +1,53 @@
+"""
+Blueprint que sirve los archivos subidos bajo /uploads/.
+
+Con UPLOADS_X_ACCEL_PREFIX configurado (p. ej. '/_uploads_internos/') la respuesta
+solo lleva la cabecera X-Accel-Redirect y nginx envía el archivo con sendfile,
+incluyendo Range, validación condicional y Content-Length. Sin ella se usa
+send_from_directory con conditional=True: Werkzeug responde Range (206),
+If-None-Match / If-Modified-Since (304) y entrega el archivo mediante
+wsgi.file_wrapper, que servidores como gunicorn implementan con sendfile.
+USE_X_SENDFILE = True en app.config delega el envío a Apache/lighttpd.
+
+Los archivos de blobs/ tienen URL direccionada por contenido y se sirven como
+inmutables; el resto (rutas anteriores al almacén de blobs) con caché corta.
+"""
+import mimetypes
+import os
+import posixpath
+from urllib.parse import quote
+
+from flask import Blueprint, abort, current_app, send_from_directory
+from werkzeug.security import safe_join
+
+from blob_store import CARPETA_BLOBS
+
+uploads_bp = Blueprint('uploads', __name__)
+
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_MUTABLE = 'public, max-age=300, must-revalidate'
+
+
+@uploads_bp.route('/uploads/<path:filename>', methods=['GET', 'HEAD'])
+def servir_upload(filename):
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    # Se normaliza antes de comparar prefijos: 'blobs/./tmp/x' o 'blobs//tmp/x' también son temporales.
+    filename = posixpath.normpath(filename)
+    if not upload_folder or filename.startswith(('..', f"{CARPETA_BLOBS}/tmp/")):
+        abort(404)
+
+    inmutable = filename.startswith(f"{CARPETA_BLOBS}/")
+    prefijo_x_accel = current_app.config.get('UPLOADS_X_ACCEL_PREFIX')
+
+    if prefijo_x_accel:
+        ruta = safe_join(upload_folder, filename)
+        if ruta is None or not os.path.isfile(ruta):
+            abort(404)
+        respuesta = current_app.response_class()
+        respuesta.headers['X-Accel-Redirect'] = f"{prefijo_x_accel.rstrip('/')}/{quote(filename)}"
+        respuesta.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    else:
+        respuesta = send_from_directory(upload_folder, filename, conditional=True, etag=True)
+
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE if inmutable else CACHE_MUTABLE
+    return respuesta
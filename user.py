@@ -1,123 +1,111 @@
-from flask import Blueprint, request, jsonify, current_app
-from extensions import mysql
+from flask import Blueprint, request, jsonify, current_app, g
+from db_pool import mysql
 from MySQLdb.cursors import DictCursor
-from werkzeug.utils import secure_filename
 import os
 import sys
+import json
+import base64
 import traceback
 from datetime import datetime
-
-# Importar PyJWT
-import jwt
-
-user_bp = Blueprint('user', _name_)
-
-# --- Configuración JWT ---
-# Definiendo una función auxiliar para obtener el payload del JWT
-def get_user_from_jwt(auth_header):
-    """
-    Extrae el token del encabezado de autorización y decodifica el JWT.
-    Retorna el payload decodificado o None en caso de error/token inválido.
-    """
-    token = None
-    if auth_header and "Bearer " in auth_header:
-        token = auth_header.split(" ")[1]
-    else:
-        print("Advertencia: Encabezado de autorización sin 'Bearer ' o no proporcionado.", file=sys.stderr)
-        return None
-
-    if not token:
-        print("Advertencia: Token real no extraído del encabezado de autorización.", file=sys.stderr)
-        return None
-
-    try:
-        # Usar la JWT_SECRET_KEY configurada globalmente en app.py
-        jwt_secret_key = current_app.config.get('JWT_SECRET_KEY')
-        if not jwt_secret_key:
-            print("ERROR: JWT_SECRET_KEY no está configurada en app.config.", file=sys.stderr)
-            return None
-
-        payload = jwt.decode(token, jwt_secret_key, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        print("Advertencia: Token expirado.", file=sys.stderr)
-        return None
-    except jwt.InvalidTokenError:
-        print("Advertencia: Token inválido.", file=sys.stderr)
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+from jwt_auth import requiere_auth, usuario_desde_request
+from feed_cache import feed_cache
+from metrics import duracion_guardado_upload, bytes_upload
+from search_index import indice_busqueda
+from leaderboard import clasificaciones
+from score_ingest import ingesta_puntajes, PUNTAJES_DIFICULTADES, PUNTAJE_MAXIMO
+from image_variants import programar_variantes_publicacion, programar_variantes_perfil, rutas_de_variantes
+from blob_store import (
+    guardar_stream,
+    url_de_blob,
+    ruta_relativa_de_url,
+    agregar_referencia,
+    agregar_referencias,
+    comprobar_reutilizados,
+    liberar_referencias,
+)
+from comment_counts import (
+    incrementar_comentarios,
+    decrementar_comentarios,
+    eliminar_contadores,
+    reconstruir_contadores,
+)
+from change_log import registrar_cambio, registrar_cambios, estado_secuencia, cambios_desde, podar_cambios
+from eventos import publicar_cambio
+from upload_gc import programar_borrado, descartar_nuevos, recolector_archivos
+
+user_bp = Blueprint('user', __name__)
+
+def _url_a_ruta_local(url):
+    """Traduce una URL bajo API_BASE_URL a la ruta del archivo en disco, o None si no es local."""
+    base_url = current_app.config.get('API_BASE_URL')
+    if not url or not base_url or not url.startswith(base_url):
         return None
-    except Exception as e:
-        print(f"Error al decodificar JWT: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        return None
-
-# Función auxiliar para obtener detalles completos del usuario desde la DB
-def get_user_details(user_id):
-    cursor = mysql.connection.cursor(DictCursor)
-    try:
-        cursor.execute("SELECT id, username, email, DescripUsuario, verificado, foto_perfil FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        return user
-    except Exception as e:
-        print(f"Error al obtener detalles del usuario {user_id}: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        return None
-    finally:
-        cursor.close()
+    relative_path = url.replace(base_url, '').lstrip('/')
+    return os.path.join(current_app.root_path, relative_path)
 
 # --- Rutas protegidas ---
 
 @user_bp.route('/logeado', methods=['GET'])
 def logeado():
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
+    usuario = usuario_desde_request()
 
-    if not user_payload:
+    if not usuario:
         return jsonify({"logeado": 0, "error": "Token de autorización inválido o ausente."}), 401
 
-    if not user_payload.get('verificado'):
+    if not usuario.verificado:
         return jsonify({"logeado": 0, "error": "Cuenta no verificada."}), 403
 
     return jsonify({
         "logeado": 1,
-        "user_id": user_payload.get('user_id'),
-        "username": user_payload.get('username'),
-        "email": user_payload.get('email')
+        "user_id": usuario.user_id,
+        "username": usuario.username,
+        "email": usuario.email
     }), 200
 
+def _puntajes_con_pendientes(user_id, filas):
+    """Combina los puntajes de partidas con los que aún esperan el volcado diferido."""
+    puntajes = {f[2]: f[3] for f in filas if f[2] is not None}
+    for dificultad, puntaje in ingesta_puntajes.pendientes_de_usuario(user_id).items():
+        if puntaje > puntajes.get(dificultad, puntaje - 1):
+            puntajes[dificultad] = puntaje
+    return [{"dificultad": dificultad, "puntaje": puntaje} for dificultad, puntaje in puntajes.items()]
+
 @user_bp.route('/perfil', methods=['GET', 'PUT'])
+@requiere_auth()
 def perfil():
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
+    current_user_id = g.usuario.user_id
 
-    if not user_payload.get('verificado'):
-        return jsonify({"error": "Usuario no verificado."}), 403
-
-    current_user_id = user_payload.get('user_id')
-    username_from_jwt = user_payload.get('username')
-    email_from_jwt = user_payload.get('email')
-
-    user_details_from_db = get_user_details(current_user_id)
-    if not user_details_from_db:
-        return jsonify({"error": "Usuario no encontrado en la base de datos."}), 404
-
-    descripcion = user_details_from_db.get('DescripUsuario')
-    foto_perfil = user_details_from_db.get('foto_perfil')
-
-    cursor = mysql.connection.cursor()
+    # El GET es de solo lectura y puede ir a la réplica; el PUT siempre al primario.
+    conexion = mysql.lectura() if request.method == 'GET' else mysql.connection
+    cursor = conexion.cursor()
     try:
         if request.method == 'GET':
-            cursor.execute("SELECT dificultad_id, puntaje_actual FROM partidas WHERE user_id = %s", (current_user_id,))
-            puntajes = cursor.fetchall()
+            # Descripción, foto y puntajes en una sola consulta; username y email vienen del JWT.
+            cursor.execute("""
+                SELECT
+                    u.DescripUsuario,
+                    COALESCE(JSON_UNQUOTE(JSON_EXTRACT(u.foto_perfil_variantes, '$.thumb.webp')), u.foto_perfil),
+                    pa.dificultad_id,
+                    pa.puntaje_actual,
+                    u.foto_perfil
+                FROM users u
+                LEFT JOIN partidas pa ON pa.user_id = u.id
+                WHERE u.id = %s
+            """, (current_user_id,))
+            filas = cursor.fetchall()
+            if not filas:
+                return jsonify({"error": "Usuario no encontrado en la base de datos."}), 404
 
             return jsonify({
-                "username": username_from_jwt, # Usamos el username del JWT
-                "email": email_from_jwt,     # Usamos el email del JWT
-                "descripcion": descripcion,  # Obtenido de la DB
-                "foto_perfil": foto_perfil,  # Obtenido de la DB
-                "puntajes": [{"dificultad": p[0], "puntaje": p[1]} for p in puntajes]
+                "username": g.usuario.username, # Usamos el username del JWT
+                "email": g.usuario.email,       # Usamos el email del JWT
+                "descripcion": filas[0][0],     # Obtenido de la DB
+                "foto_perfil": filas[0][1],     # Miniatura WebP si ya se generó; si no, la original
+                "foto_perfil_original": filas[0][4],
+                "puntajes": _puntajes_con_pendientes(current_user_id, filas)
             }), 200
 
         elif request.method == 'PUT':
@@ -133,8 +121,27 @@ def perfil():
             if cursor.fetchone():
                 return jsonify({"error": "El nombre de usuario ya está en uso."}), 409
 
+            cursor.execute("SELECT username FROM users WHERE id = %s FOR UPDATE", (current_user_id,))
+            fila = cursor.fetchone()
+            if not fila:
+                return jsonify({"error": "Usuario no encontrado en la base de datos."}), 404
+            renombrado = fila[0] != nuevo_username
+
             cursor.execute("UPDATE users SET DescripUsuario = %s, username = %s WHERE id = %s", (nueva_descripcion, nuevo_username, current_user_id))
+            cambios = []
+            if renombrado:
+                # El autor aparece en el feed y en los comentarios: los clientes sincronizados deben volver a pedirlos.
+                cursor.execute("SELECT id FROM publicaciones WHERE autor_id = %s", (current_user_id,))
+                por_registrar = [('publicacion', publicacion_id, publicacion_id, 'editar') for (publicacion_id,) in cursor.fetchall()]
+                cursor.execute("SELECT id, publicacion_id FROM comentarios WHERE autor_id = %s", (current_user_id,))
+                por_registrar += [('comentario', comentario_id, publicacion_id, 'editar') for comentario_id, publicacion_id in cursor.fetchall()]
+                cambios = registrar_cambios(cursor, por_registrar)
             mysql.connection.commit()
+            if renombrado:
+                clasificaciones.renombrar(current_user_id, nuevo_username)
+                feed_cache.invalidar()
+                for cambio in cambios:
+                    publicar_cambio(cambio)
 
             # Nota: Si el username cambia, el JWT actual seguirá teniendo el viejo.
             # Para reflejar el cambio inmediatamente, el cliente debería solicitar un nuevo JWT (volver a iniciar sesión).
@@ -148,49 +155,176 @@ def perfil():
         cursor.close()
 
 
+@user_bp.route('/player', methods=['POST'])
+@requiere_auth()
+def registrar_partida():
+    # El puntaje se acumula en memoria y se escribe en partidas por lotes (score_ingest).
+    data = request.get_json(silent=True) or {}
+    try:
+        dificultad_id = int(data.get('dificultad_id', data.get('dificultad')))
+        puntaje = int(data.get('puntaje'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Se requieren 'dificultad_id' y 'puntaje' numéricos."}), 400
+    if puntaje < 0:
+        return jsonify({"error": "El puntaje no puede ser negativo."}), 400
+    if puntaje > PUNTAJE_MAXIMO:
+        return jsonify({"error": f"El puntaje no puede superar {PUNTAJE_MAXIMO}."}), 400
+    if dificultad_id not in PUNTAJES_DIFICULTADES:
+        return jsonify({"error": "Dificultad desconocida."}), 400
+
+    try:
+        ingesta_puntajes.iniciar(current_app._get_current_object())
+        ingesta_puntajes.registrar(g.usuario.user_id, dificultad_id, puntaje)
+        clasificaciones.registrar_puntaje(g.usuario.user_id, dificultad_id, puntaje, g.usuario.username)
+        return jsonify({"message": "Puntaje registrado."}), 202
+    except Exception as e:
+        print(f"Error en /player: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al registrar el puntaje."}), 500
+
+
+# --- Paginación del feed ---
+FEED_LIMITE_POR_DEFECTO = 20
+FEED_LIMITE_MAXIMO = 100
+
+def _codificar_cursor(created_at, publicacion_id):
+    """Genera un cursor opaco a partir de la clave (created_at, id) de la última publicación."""
+    crudo = json.dumps([created_at.isoformat(), publicacion_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+def _decodificar_cursor(cursor_param):
+    """
+    Decodifica un cursor generado por _codificar_cursor.
+    Retorna la tupla (created_at, id) o lanza ValueError si el cursor no es válido.
+    """
+    try:
+        relleno = '=' * (-len(cursor_param) % 4)
+        created_at_iso, publicacion_id = json.loads(base64.urlsafe_b64decode(cursor_param + relleno))
+        return datetime.fromisoformat(created_at_iso), int(publicacion_id)
+    except Exception as e:
+        raise ValueError("Cursor inválido.") from e
+
+def _respuesta_feed(cuerpo, etag):
+    """Construye la respuesta del feed con ETag fuerte, o 304 si el cliente ya tiene esa versión."""
+    if request.if_none_match.contains(etag):
+        respuesta = current_app.response_class(status=304)
+    else:
+        respuesta = current_app.response_class(cuerpo, status=200, mimetype='application/json')
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache' # El navegador revalida siempre con If-None-Match
+    return respuesta
+
+def _consultar_publicaciones(cursor, subconsulta_ids, params):
+    """
+    Une autor, contador de comentarios e imágenes a las publicaciones cuyos IDs
+    devuelve 'subconsulta_ids'. Retorna las filas ordenadas por (created_at, id) descendente.
+    """
+    cursor.execute(f"""
+        SELECT
+            p.id,
+            p.autor_id,
+            u.username AS author,
+            p.titulo AS title,
+            p.texto AS content,
+            p.created_at,
+            COALESCE(pc.cantidad_comentarios, 0) AS cantidad_comentarios, -- Contador mantenido en escritura
+            -- URLs ordenadas de la variante más pequeña adecuada (o la original si aún no hay variantes):
+            -- 'card' para la imagen principal y 'thumb' para las adicionales.
+            GROUP_CONCAT(COALESCE(JSON_UNQUOTE(JSON_EXTRACT(ip.variantes, '$.card.webp')), ip.url) ORDER BY ip.orden ASC) AS card_image_urls,
+            GROUP_CONCAT(COALESCE(JSON_UNQUOTE(JSON_EXTRACT(ip.variantes, '$.thumb.webp')), ip.url) ORDER BY ip.orden ASC) AS thumb_image_urls
+        FROM ({subconsulta_ids}) pagina
+        JOIN publicaciones p ON p.id = pagina.id
+        JOIN users u ON p.autor_id = u.id
+        LEFT JOIN publicacion_contadores pc ON pc.publicacion_id = p.id
+        LEFT JOIN imagenes_publicacion ip ON p.id = ip.publicacion_id
+        GROUP BY p.id, p.autor_id, u.username, p.titulo, p.texto, p.created_at, pc.cantidad_comentarios
+        ORDER BY p.created_at DESC, p.id DESC
+    """, params)
+    return list(cursor.fetchall())
+
+def _serializar_publicacion(pub):
+    """Convierte una fila de _consultar_publicaciones al formato JSON del feed."""
+    pub['created_at'] = pub['created_at'].isoformat() if pub['created_at'] else None
+
+    # Procesar las URLs de las imágenes en Python
+    # Filtrar valores None/vacíos que puedan resultar de GROUP_CONCAT con datos inconsistentes
+    card_urls = [url for url in (pub.pop('card_image_urls') or '').split(',') if url]
+    thumb_urls = [url for url in (pub.pop('thumb_image_urls') or '').split(',') if url]
+    pub['imageUrl'] = card_urls[0] if card_urls else None # La primera imagen, en tamaño tarjeta
+    pub['imagenes_adicionales_urls'] = thumb_urls[1:] # El resto como miniaturas
+    return pub
+
+@user_bp.route('/publicaciones/cache/estadisticas', methods=['GET'])
+def estadisticas_cache_feed():
+    return jsonify(feed_cache.estadisticas()), 200
+
+@user_bp.route('/db/pool/estadisticas', methods=['GET'])
+def estadisticas_pool_mysql():
+    return jsonify(mysql.estadisticas()), 200
+
 @user_bp.route('/publicaciones', methods=['GET'])
 def publicaciones():
     # Este endpoint ahora es público, no requiere autenticación JWT.
-    cursor = mysql.connection.cursor(DictCursor)
+    # Paginación por cursor sobre (created_at, id): cada página recorre solo un rango acotado del índice.
     try:
-        # Obtener todas las publicaciones y todas sus URLs de imágenes asociadas
-        cursor.execute("""
-            SELECT
-                p.id,
-                p.autor_id,
-                u.username AS author,
-                p.titulo AS title,
-                p.texto AS content,
-                p.created_at,
-                GROUP_CONCAT(ip.url ORDER BY ip.orden ASC) AS all_image_urls -- Obtener todas las URLs de imágenes ordenadas
-            FROM publicaciones p
-            JOIN users u ON p.autor_id = u.id
-            LEFT JOIN imagenes_publicacion ip ON p.id = ip.publicacion_id
-            GROUP BY p.id, p.autor_id, u.username, p.titulo, p.texto, p.created_at
-            ORDER BY p.created_at DESC
-        """)
-        publicaciones = cursor.fetchall()
+        limite = int(request.args.get('limit', FEED_LIMITE_POR_DEFECTO))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'limit' debe ser un número entero."}), 400
+    limite = max(1, min(limite, FEED_LIMITE_MAXIMO))
 
-        for pub in publicaciones:
-            # Obtener cantidad de comentarios para cada publicación
-            cursor.execute("SELECT COUNT(*) AS cantidad FROM comentarios WHERE publicacion_id = %s", (pub['id'],))
-            pub['cantidad_comentarios'] = cursor.fetchone()['cantidad']
+    cursor_param = request.args.get('cursor')
+    if cursor_param:
+        try:
+            cursor_created_at, cursor_id = _decodificar_cursor(cursor_param)
+        except ValueError:
+            return jsonify({"error": "Cursor de paginación inválido."}), 400
+        filtro_cursor = "WHERE created_at < %s OR (created_at = %s AND id < %s)"
+        params = (cursor_created_at, cursor_created_at, cursor_id, limite + 1)
+    else:
+        filtro_cursor = ""
+        params = (limite + 1,)
 
-            pub['created_at'] = pub['created_at'].isoformat() if pub['created_at'] else None
+    # Las páginas ya serializadas se sirven desde la caché mientras la versión del registro de cambios
+    # (compartida por todos los workers) no cambie; con If-None-Match coincidente se responde 304.
+    clave_cache = (limite, cursor_param or None)
+    try:
+        cursor_version = mysql.connection.cursor()
+        try:
+            version = estado_secuencia(cursor_version)[0]
+        finally:
+            cursor_version.close()
+    except Exception as e:
+        print(f"Error en /publicaciones al leer la versión de cambios: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al obtener publicaciones."}), 500
+    en_cache = feed_cache.obtener(clave_cache, version)
+    if en_cache:
+        return _respuesta_feed(*en_cache)
 
-            # Procesar las URLs de las imágenes en Python
-            all_urls_str = pub.pop('all_image_urls') # Eliminar la cadena combinada del diccionario
-            if all_urls_str:
-                # Filtrar valores None/vacíos que puedan resultar de GROUP_CONCAT con datos inconsistentes
-                all_urls = [url for url in all_urls_str.split(',') if url]
-                pub['imageUrl'] = all_urls[0] if all_urls else None # La primera URL como imagen principal
-                pub['imagenes_adicionales_urls'] = all_urls[1:] if len(all_urls) > 1 else [] # El resto como adicionales
-            else:
-                pub['imageUrl'] = None
-                pub['imagenes_adicionales_urls'] = []
+    # La página se guarda en la caché compartida: solo se lee de la réplica si ya aplicó esa versión.
+    cursor = mysql.lectura(compartida=True, version=version).cursor(DictCursor)
+    try:
+        # Primero se selecciona la página de IDs (limite + 1 para saber si hay más)
+        # y solo después se unen autor e imágenes de esas publicaciones.
+        publicaciones = _consultar_publicaciones(cursor, f"""
+            SELECT id FROM publicaciones
+            {filtro_cursor}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, params)
+
+        next_cursor = None
+        if len(publicaciones) > limite:
+            publicaciones = publicaciones[:limite]
+            ultima = publicaciones[-1]
+            next_cursor = _codificar_cursor(ultima['created_at'], ultima['id'])
 
+        for pub in publicaciones:
+            _serializar_publicacion(pub)
 
-        return jsonify(publicaciones), 200
+        cuerpo = current_app.json.dumps({"publicaciones": publicaciones, "next_cursor": next_cursor}).encode('utf-8')
+        etag = feed_cache.guardar(clave_cache, cuerpo, version)
+        return _respuesta_feed(cuerpo, etag)
     except Exception as e:
         print(f"Error en /publicaciones: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -198,18 +332,213 @@ def publicaciones():
     finally:
         cursor.close()
 
-@user_bp.route('/crear-publicacion', methods=['POST'])
-def crear_publicacion():
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
+# --- Comentarios de varias publicaciones en una sola consulta ---
+COMENTARIOS_MAX_PUBLICACIONES = 50     # IDs de publicación aceptados por solicitud
+COMENTARIOS_POR_PUBLICACION = 20       # Tope por publicación si no se indica 'limite'
+COMENTARIOS_POR_PUBLICACION_MAX = 100
+COMENTARIOS_MAX_TOTAL = 1000           # Tope total de comentarios en la respuesta
+
+@user_bp.route('/publicaciones/comentarios', methods=['GET'])
+def comentarios_de_publicaciones():
+    # Público, igual que /publicaciones. Uso: /publicaciones/comentarios?ids=1,2,3&limite=20
+    try:
+        ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+        limite = int(request.args.get('limite', COMENTARIOS_POR_PUBLICACION))
+    except ValueError:
+        return jsonify({"error": "Los parámetros 'ids' y 'limite' deben ser números enteros."}), 400
+
+    if not ids:
+        return jsonify({"error": "Se requiere al menos un ID de publicación en 'ids'."}), 400
+    if len(ids) > COMENTARIOS_MAX_PUBLICACIONES:
+        return jsonify({"error": f"Se permiten como máximo {COMENTARIOS_MAX_PUBLICACIONES} publicaciones por solicitud."}), 400
+    limite = max(1, min(limite, COMENTARIOS_POR_PUBLICACION_MAX))
+
+    cursor = mysql.lectura().cursor(DictCursor)
+    try:
+        # Filas intercaladas (la primera de cada publicación, luego la segunda...): el LIMIT total recorta
+        # por igual y nunca deja fuera a una publicación entera. COUNT(*) OVER dice cuáles quedaron truncadas.
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            SELECT id, publicacion_id, autor_id, author, text, created_at, total_comentarios
+            FROM (
+                SELECT
+                    c.id,
+                    c.publicacion_id,
+                    c.autor_id,
+                    u.username AS author,
+                    c.texto AS text,
+                    c.created_at,
+                    ROW_NUMBER() OVER (PARTITION BY c.publicacion_id ORDER BY c.created_at ASC, c.id ASC) AS posicion,
+                    COUNT(*) OVER (PARTITION BY c.publicacion_id) AS total_comentarios
+                FROM comentarios c
+                JOIN users u ON c.autor_id = u.id
+                WHERE c.publicacion_id IN ({marcadores})
+            ) numerados
+            WHERE posicion <= %s
+            ORDER BY posicion, publicacion_id
+            LIMIT %s
+        """, (*ids, limite, COMENTARIOS_MAX_TOTAL))
+        filas = cursor.fetchall()
+
+        comentarios = {str(publicacion_id): [] for publicacion_id in ids}
+        totales = {}
+        for fila in filas:
+            totales[fila['publicacion_id']] = fila.pop('total_comentarios')
+            fila['created_at'] = fila['created_at'].isoformat() if fila['created_at'] else None
+            comentarios[str(fila['publicacion_id'])].append(fila)
+        # Toda publicación con comentarios tiene al menos una fila (hay menos IDs que COMENTARIOS_MAX_TOTAL),
+        # así que una truncada por el límite por publicación o por el tope total siempre se detecta aquí.
+        truncadas = [pid for pid, total in totales.items() if total > len(comentarios[str(pid)])]
+        total = len(filas)
+
+        return jsonify({
+            "comentarios": comentarios,
+            "truncadas": sorted(truncadas), # Publicaciones con más comentarios que los devueltos
+            "limite_total_alcanzado": total >= COMENTARIOS_MAX_TOTAL
+        }), 200
+    except Exception as e:
+        print(f"Error en /publicaciones/comentarios: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al obtener comentarios."}), 500
+    finally:
+        cursor.close()
 
-    if not user_payload:
-        return jsonify({"error": "No autorizado"}), 401
+# --- Búsqueda de texto completo ---
+BUSQUEDA_LIMITE_POR_DEFECTO = 20
+BUSQUEDA_LIMITE_MAXIMO = 50
 
-    if not user_payload.get('verificado'):
-        return jsonify({"error": "Usuario no verificado."}), 403
+def _actualizar_indice_busqueda(cursor, publicacion_id, titulo=None, texto=None):
+    """Indexa (o con titulo=None elimina) una publicación ya confirmada en MySQL."""
+    try:
+        indice_busqueda.asegurar_cargado(cursor)
+        if titulo is None:
+            indice_busqueda.eliminar(publicacion_id)
+        else:
+            indice_busqueda.indexar(publicacion_id, titulo, texto)
+    except Exception as e:
+        # El índice se puede reconstruir con 'flask user reindexar-busqueda'; no se falla la escritura.
+        print(f"Error al actualizar el índice de búsqueda para la publicación {publicacion_id}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
 
-    current_user_id = user_payload.get('user_id')
+@user_bp.route('/publicaciones/buscar', methods=['GET'])
+def buscar_publicaciones():
+    # Público, igual que /publicaciones. Uso: /publicaciones/buscar?q=dragon&limite=20
+    consulta = request.args.get('q', '').strip()
+    if not consulta:
+        return jsonify({"error": "El parámetro 'q' es requerido."}), 400
+    try:
+        limite = int(request.args.get('limite', BUSQUEDA_LIMITE_POR_DEFECTO))
+    except ValueError:
+        return jsonify({"error": "El parámetro 'limite' debe ser un número entero."}), 400
+    limite = max(1, min(limite, BUSQUEDA_LIMITE_MAXIMO))
+
+    # Si el índice se construye aquí, queda compartido por todos: se trata como lectura compartida.
+    cursor = mysql.lectura(compartida=True).cursor(DictCursor)
+    try:
+        indice_busqueda.asegurar_cargado(cursor)
+        resultados = indice_busqueda.buscar(consulta, limite)
+        if not resultados:
+            return jsonify({"publicaciones": [], "total": 0}), 200
+
+        puntuaciones = dict(resultados)
+        marcadores = ', '.join(['%s'] * len(puntuaciones))
+        filas = _consultar_publicaciones(cursor, f"SELECT id FROM publicaciones WHERE id IN ({marcadores})", tuple(puntuaciones))
+        # Se conserva el orden por relevancia; las publicaciones que ya no existen simplemente no aparecen.
+        filas.sort(key=lambda pub: puntuaciones[pub['id']], reverse=True)
+        publicaciones = []
+        for pub in filas:
+            pub['relevancia'] = puntuaciones[pub['id']]
+            publicaciones.append(_serializar_publicacion(pub))
+        return jsonify({"publicaciones": publicaciones, "total": len(publicaciones)}), 200
+    except Exception as e:
+        print(f"Error en /publicaciones/buscar: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al buscar publicaciones."}), 500
+    finally:
+        cursor.close()
+
+# --- Sincronización incremental (registro de cambios) ---
+SYNC_LIMITE_POR_DEFECTO = 200
+SYNC_LIMITE_MAXIMO = 1000
+
+@user_bp.route('/publicaciones/sync', methods=['GET'])
+def sincronizar_publicaciones():
+    # Público. Uso: /publicaciones/sync?since=120&limite=200
+    # Sin 'since' retorna solo la versión actual: el cliente la pide antes de cargar el feed completo.
+    # Con since=N retorna el estado actual de lo que cambió después de N, los IDs eliminados (eliminar una
+    # publicación elimina también sus comentarios) y la versión desde la que seguir; con 'mas' quedan
+    # cambios pendientes. Si N es anterior a lo podado del registro responde 410: hay que recargar el feed.
+    try:
+        desde = request.args.get('since')
+        desde = int(desde) if desde is not None else None
+        limite = int(request.args.get('limite', SYNC_LIMITE_POR_DEFECTO))
+    except ValueError:
+        return jsonify({"error": "Los parámetros 'since' y 'limite' deben ser números enteros."}), 400
+    limite = max(1, min(limite, SYNC_LIMITE_MAXIMO))
+
+    # Ambos cursores leen en la misma transacción: el registro y las filas son de la misma instantánea.
+    conexion = mysql.lectura()
+    cursor = conexion.cursor()
+    cursor_filas = conexion.cursor(DictCursor)
+    try:
+        version_actual, podado_hasta = estado_secuencia(cursor)
+        if desde is None:
+            return jsonify({"version": version_actual}), 200
+        if desde < podado_hasta:
+            return jsonify({"error": "La versión es demasiado antigua; recarga el feed completo.", "version": version_actual}), 410
+
+        cambios = cambios_desde(cursor, desde, limite)
+        mas = len(cambios) == limite
+        version = cambios[-1][0] if mas else max(version_actual, desde)
+        ids_publicaciones = list(dict.fromkeys(entidad_id for _, entidad, entidad_id, _, _ in cambios if entidad == 'publicacion'))
+        ids_comentarios = list(dict.fromkeys(entidad_id for _, entidad, entidad_id, _, _ in cambios if entidad == 'comentario'))
+
+        publicaciones = []
+        if ids_publicaciones:
+            marcadores = ', '.join(['%s'] * len(ids_publicaciones))
+            publicaciones = [
+                _serializar_publicacion(pub)
+                for pub in _consultar_publicaciones(cursor_filas, f"SELECT id FROM publicaciones WHERE id IN ({marcadores})", tuple(ids_publicaciones))
+            ]
+        comentarios = []
+        if ids_comentarios:
+            marcadores = ', '.join(['%s'] * len(ids_comentarios))
+            cursor_filas.execute(f"""
+                SELECT c.id, c.publicacion_id, c.autor_id, u.username AS author, c.texto AS text, c.created_at
+                FROM comentarios c
+                JOIN users u ON c.autor_id = u.id
+                WHERE c.id IN ({marcadores})
+                ORDER BY c.created_at ASC, c.id ASC
+            """, tuple(ids_comentarios))
+            comentarios = list(cursor_filas.fetchall())
+            for comentario in comentarios:
+                comentario['created_at'] = comentario['created_at'].isoformat() if comentario['created_at'] else None
+
+        # Lo que cambió y ya no existe fue eliminado.
+        vigentes_publicaciones = {pub['id'] for pub in publicaciones}
+        vigentes_comentarios = {comentario['id'] for comentario in comentarios}
+        return jsonify({
+            "version": version,
+            "mas": mas,
+            "publicaciones": publicaciones,
+            "comentarios": comentarios,
+            "eliminados": {
+                "publicaciones": [i for i in ids_publicaciones if i not in vigentes_publicaciones],
+                "comentarios": [i for i in ids_comentarios if i not in vigentes_comentarios],
+            }
+        }), 200
+    except Exception as e:
+        print(f"Error en /publicaciones/sync: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al sincronizar publicaciones."}), 500
+    finally:
+        cursor.close()
+        cursor_filas.close()
+
+@user_bp.route('/crear-publicacion', methods=['POST'])
+@requiere_auth()
+def crear_publicacion():
+    current_user_id = g.usuario.user_id
     texto = request.json.get('texto')
     titulo = request.json.get('titulo') # NUEVO: Recibimos el título también
 
@@ -220,10 +549,14 @@ def crear_publicacion():
     try:
         # NUEVO: Insertamos el título
         cursor.execute("INSERT INTO publicaciones (autor_id, titulo, texto) VALUES (%s, %s, %s)", (current_user_id, titulo, texto))
-        mysql.connection.commit()
-
         # CLAVE: Devolvemos el ID de la publicación recién creada
         new_post_id = cursor.lastrowid
+        cambio = registrar_cambio(cursor, 'publicacion', new_post_id, new_post_id, 'crear')
+        mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
+
+        _actualizar_indice_busqueda(cursor, new_post_id, titulo, texto)
         return jsonify({"message": "Publicación creada exitosamente.", "publicacion_id": new_post_id}), 201
     except Exception as e:
         print(f"Error al crear publicación: {e}", file=sys.stderr)
@@ -233,14 +566,9 @@ def crear_publicacion():
         cursor.close()
 
 @user_bp.route('/editar-publicacion/<int:publicacion_id>', methods=['PUT'])
+@requiere_auth(verificado=False)
 def editar_publicacion(publicacion_id):
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    current_user_id = user_payload.get('user_id')
+    current_user_id = g.usuario.user_id
     nuevo_texto = request.json.get('texto')
     nuevo_titulo = request.json.get('titulo') # Añadido para edición
 
@@ -256,7 +584,11 @@ def editar_publicacion(publicacion_id):
 
         # Actualizar título y texto
         cursor.execute("UPDATE publicaciones SET texto = %s, titulo = %s WHERE id = %s", (nuevo_texto, nuevo_titulo, publicacion_id))
+        cambio = registrar_cambio(cursor, 'publicacion', publicacion_id, publicacion_id, 'editar')
         mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
+        _actualizar_indice_busqueda(cursor, publicacion_id, nuevo_titulo, nuevo_texto)
         return jsonify({"message": "Publicación editada correctamente."}), 200
     except Exception as e:
         print(f"Error al editar publicación: {e}", file=sys.stderr)
@@ -266,14 +598,9 @@ def editar_publicacion(publicacion_id):
         cursor.close()
 
 @user_bp.route('/eliminar-publicacion/<int:publicacion_id>', methods=['DELETE'])
+@requiere_auth(verificado=False)
 def eliminar_publicacion(publicacion_id):
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    current_user_id = user_payload.get('user_id')
+    current_user_id = g.usuario.user_id
 
     cursor = mysql.connection.cursor()
     try:
@@ -282,24 +609,25 @@ def eliminar_publicacion(publicacion_id):
         if not resultado or resultado[0] != current_user_id:
             return jsonify({"error": "No autorizado para eliminar esta publicación."}), 403
 
-        # Traer todas las URLs de imágenes asociadas a esta publicación desde imagenes_publicacion
-        cursor.execute("SELECT url FROM imagenes_publicacion WHERE publicacion_id = %s", (publicacion_id,))
-        image_urls_to_delete = cursor.fetchall()
-
-        for img_url_tuple in image_urls_to_delete:
-            img_url = img_url_tuple[0]
-            if current_app.config.get('API_BASE_URL') and img_url.startswith(current_app.config.get('API_BASE_URL')):
-                relative_path = img_url.replace(current_app.config.get('API_BASE_URL'), '').lstrip('/')
-                filepath_to_delete = os.path.join(current_app.root_path, relative_path)
-                if os.path.exists(filepath_to_delete):
-                    os.remove(filepath_to_delete)
-                    print(f"Imagen de publicación eliminada del disco: {filepath_to_delete}", file=sys.stderr)
-
+        # Traer todas las URLs de imágenes (y de sus variantes) asociadas a esta publicación
+        cursor.execute("SELECT url, variantes FROM imagenes_publicacion WHERE publicacion_id = %s", (publicacion_id,))
+        imagenes = cursor.fetchall()
 
+        cursor.execute("DELETE FROM imagenes_publicacion WHERE publicacion_id = %s", (publicacion_id,))
+        # Los archivos que ningún otro registro referencia se anotan para borrarlos en segundo plano
+        programar_borrado(cursor, _liberar_imagenes(cursor, imagenes))
         cursor.execute("DELETE FROM publicaciones WHERE id = %s", (publicacion_id,))
+        eliminar_contadores(cursor, publicacion_id)
+        # Sus comentarios se borran en cascada: el tombstone de la publicación los cubre.
+        cambio = registrar_cambio(cursor, 'publicacion', publicacion_id, publicacion_id, 'eliminar')
         mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
+        _actualizar_indice_busqueda(cursor, publicacion_id)
+        recolector_archivos.avisar(current_app._get_current_object())
         return jsonify({"message": "Publicación eliminada correctamente."}), 200
     except Exception as e:
+        mysql.connection.rollback()
         print(f"Error al eliminar publicación: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         return jsonify({"error": "Error interno del servidor al eliminar publicación."}), 500
@@ -307,17 +635,9 @@ def eliminar_publicacion(publicacion_id):
         cursor.close()
 
 @user_bp.route('/comentar-publicacion', methods=['POST'])
+@requiere_auth()
 def comentar_publicacion():
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    if not user_payload.get('verificado'):
-        return jsonify({"error": "Usuario no verificado."}), 403
-
-    current_user_id = user_payload.get('user_id')
+    current_user_id = g.usuario.user_id
     publicacion_id = request.json.get('publicacion_id')
     comentario = request.json.get('comentario')
 
@@ -327,14 +647,21 @@ def comentar_publicacion():
     cursor = mysql.connection.cursor()
     try:
         cursor.execute("SELECT id FROM publicaciones WHERE id = %s", (publicacion_id,))
-        if not cursor.fetchone():
+        publicacion = cursor.fetchone()
+        if not publicacion:
             return jsonify({"error": "La publicación no existe."}), 404
+        publicacion_id = publicacion[0] # El ID entero de MySQL, aunque el JSON lo enviara como texto
 
         cursor.execute(
             "INSERT INTO comentarios (publicacion_id, autor_id, texto) VALUES (%s, %s, %s)",
             (publicacion_id, current_user_id, comentario)
         )
+        comentario_id = cursor.lastrowid
+        incrementar_comentarios(cursor, publicacion_id)
+        cambio = registrar_cambio(cursor, 'comentario', comentario_id, publicacion_id, 'crear')
         mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
         return jsonify({"message": "Comentario publicado exitosamente."}), 201
     except Exception as e:
         print(f"Error al comentar publicación: {e}", file=sys.stderr)
@@ -345,14 +672,9 @@ def comentar_publicacion():
 
 
 @user_bp.route('/editar-comentario/<int:comentario_id>', methods=['PUT'])
+@requiere_auth(verificado=False)
 def editar_comentario(comentario_id):
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    current_user_id = user_payload.get('user_id')
+    current_user_id = g.usuario.user_id
     nuevo_texto = request.json.get('comentario')
 
     if not nuevo_texto:
@@ -360,13 +682,16 @@ def editar_comentario(comentario_id):
 
     cursor = mysql.connection.cursor()
     try:
-        cursor.execute("SELECT autor_id FROM comentarios WHERE id = %s", (comentario_id,))
+        cursor.execute("SELECT autor_id, publicacion_id FROM comentarios WHERE id = %s", (comentario_id,))
         resultado = cursor.fetchone()
         if not resultado or resultado[0] != current_user_id:
             return jsonify({"error": "No autorizado para editar este comentario."}), 403
 
         cursor.execute("UPDATE comentarios SET texto = %s WHERE id = %s", (nuevo_texto, comentario_id))
+        cambio = registrar_cambio(cursor, 'comentario', comentario_id, resultado[1], 'editar')
         mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
         return jsonify({"message": "Comentario editado correctamente."}), 200
     except Exception as e:
         print(f"Error al editar comentario: {e}", file=sys.stderr)
@@ -376,24 +701,23 @@ def editar_comentario(comentario_id):
         cursor.close()
 
 @user_bp.route('/eliminar-comentario/<int:comentario_id>', methods=['DELETE'])
+@requiere_auth(verificado=False)
 def eliminar_comentario(comentario_id):
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    current_user_id = user_payload.get('user_id')
+    current_user_id = g.usuario.user_id
 
     cursor = mysql.connection.cursor()
     try:
-        cursor.execute("SELECT autor_id FROM comentarios WHERE id = %s", (comentario_id,))
+        cursor.execute("SELECT autor_id, publicacion_id FROM comentarios WHERE id = %s", (comentario_id,))
         resultado = cursor.fetchone()
         if not resultado or resultado[0] != current_user_id:
             return jsonify({"error": "No autorizado para eliminar este comentario."}), 403
 
         cursor.execute("DELETE FROM comentarios WHERE id = %s", (comentario_id,))
+        decrementar_comentarios(cursor, resultado[1])
+        cambio = registrar_cambio(cursor, 'comentario', comentario_id, resultado[1], 'eliminar')
         mysql.connection.commit()
+        publicar_cambio(cambio)
+        feed_cache.invalidar()
         return jsonify({"message": "Comentario eliminado correctamente."}), 200
     except Exception as e:
         print(f"Error al eliminar comentario: {e}", file=sys.stderr)
@@ -403,32 +727,37 @@ def eliminar_comentario(comentario_id):
         cursor.close()
 
 
-@user_bp.route('/perfil/foto', methods=['PUT'])
-def upload_profile_picture():
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
-
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
+def _extension_permitida(filename):
+    """Retorna la extensión en minúsculas si está permitida, o None."""
+    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
+    if filename and '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions:
+        return filename.rsplit('.', 1)[1].lower()
+    return None
 
-    if not user_payload.get('verificado'):
-        return jsonify({"error": "Usuario no verificado."}), 403
+def _mensaje_extension_no_permitida():
+    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
+    return f"Tipo de archivo no permitido o nombre de archivo inválido. Solo se permiten {', '.join(allowed_extensions)}."
 
-    current_user_id = user_payload.get('user_id')
-    username = user_payload.get('username') # Obtener el username del payload del JWT
+def _liberar_imagenes(cursor, imagenes):
+    """
+    Libera las referencias de blob de una lista de (url, variantes_json) dentro de la transacción actual.
+    Retorna las rutas que ya no usa nadie: blobs sin referencias y archivos locales anteriores al almacén de blobs.
+    """
+    rutas_blob = []
+    rutas_heredadas = []
+    for url, variantes in imagenes:
+        ruta_blob = ruta_relativa_de_url(url)
+        if ruta_blob:
+            rutas_blob.append(ruta_blob)
+        elif _url_a_ruta_local(url):
+            rutas_heredadas.append(_url_a_ruta_local(url))
+        rutas_blob.extend(ruta for ruta in rutas_de_variantes(variantes) if ruta)
+    return liberar_referencias(cursor, rutas_blob) + rutas_heredadas
 
-    # Obtener la URL de la foto de perfil actual desde la base de datos
-    cursor = mysql.connection.cursor()
-    try:
-        cursor.execute("SELECT foto_perfil FROM users WHERE id = %s", (current_user_id,))
-        result = cursor.fetchone()
-        old_profile_picture_url = result[0] if result else None
-    except Exception as e:
-        print(f"Error al obtener foto_perfil antigua para user {current_user_id}: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        return jsonify({"error": "Error interno al obtener la foto de perfil existente."}), 500
-    finally:
-        cursor.close()
+@user_bp.route('/perfil/foto', methods=['PUT'])
+@requiere_auth()
+def upload_profile_picture():
+    current_user_id = g.usuario.user_id
 
     if 'profile_picture' not in request.files:
         return jsonify({'error': 'No se encontró el archivo de imagen en la solicitud. El campo esperado es "profile_picture".'}), 400
@@ -438,92 +767,121 @@ def upload_profile_picture():
     if file.filename == '':
         return jsonify({'error': 'No se seleccionó ningún archivo.'}), 400
 
-    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
+    file_extension = _extension_permitida(file.filename)
+    if not file_extension:
+        return jsonify({'error': _mensaje_extension_no_permitida()}), 400
 
-    if file and '.' in file.filename and \
-       file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    if not upload_folder:
+        print("ERROR: UPLOAD_FOLDER no está configurado en app.config.", file=sys.stderr)
+        return jsonify({"error": "Error de configuración del servidor (UPLOAD_FOLDER no definido)."}), 500
 
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
+    # El archivo se guarda por su hash: la URL es inmutable y una foto idéntica no se duplica en disco.
+    try:
+        with duracion_guardado_upload.medir(tipo='perfil'):
+            blob = guardar_stream(file.stream, file_extension, upload_folder)
+        bytes_upload.incrementar(blob.tamano, tipo='perfil')
+    except Exception as save_e:
+        print(f"Error al guardar el archivo: {save_e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al guardar la imagen."}), 500
 
-        upload_folder = current_app.config.get('UPLOAD_FOLDER')
-        if not upload_folder:
-            print("ERROR: UPLOAD_FOLDER no está configurado en app.config.", file=sys.stderr)
-            return jsonify({"error": "Error de configuración del servidor (UPLOAD_FOLDER no definido)."}, 500)
+    base_url = current_app.config.get('API_BASE_URL', request.url_root.rstrip('/'))
+    image_url = url_de_blob(base_url, blob.ruta_relativa)
 
-        # Crear la carpeta específica para el usuario dentro de 'fotos_perfil': UPLOAD_FOLDER/fotos_perfil/username/
-        base_profile_pictures_path = os.path.join(upload_folder, 'fotos_perfil')
-        user_folder = os.path.join(base_profile_pictures_path, str(username))
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute("SELECT foto_perfil, foto_perfil_variantes FROM users WHERE id = %s FOR UPDATE", (current_user_id,))
+        anterior = cursor.fetchone()
+        if anterior and anterior[0] == image_url:
+            # Es la misma foto que ya tenía: no hay nada que cambiar.
+            mysql.connection.rollback()
+            return jsonify({
+                'message': 'Foto de perfil actualizada exitosamente.',
+                'foto_perfil_url': image_url
+            }), 200
 
-        if not os.path.exists(user_folder):
-            os.makedirs(user_folder)
+        agregar_referencia(cursor, blob)
+        comprobar_reutilizados(upload_folder, [blob])
+        cursor.execute("UPDATE users SET foto_perfil = %s, foto_perfil_variantes = NULL WHERE id = %s", (image_url, current_user_id))
+        # La foto anterior (y sus variantes) se borra en segundo plano solo si ya nadie la referencia.
+        programar_borrado(cursor, _liberar_imagenes(cursor, [anterior] if anterior and anterior[0] else []))
+        mysql.connection.commit()
+    except Exception as db_e:
+        mysql.connection.rollback()
+        descartar_nuevos([blob])
+        print(f"Error DB al actualizar foto de perfil para user {current_user_id}: {db_e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Error interno del servidor al guardar la URL de la foto de perfil."}), 500
+    finally:
+        cursor.close()
 
-        new_filename = secure_filename(f"profile_picture.{file_extension}")
-        filepath = os.path.join(user_folder, new_filename)
+    recolector_archivos.avisar(current_app._get_current_object())
+    # Las miniaturas se generan en segundo plano; mientras tanto /perfil sirve la original.
+    programar_variantes_perfil(current_app._get_current_object(), current_user_id,
+                               os.path.join(upload_folder, blob.ruta_relativa), base_url, image_url)
+    return jsonify({
+        'message': 'Foto de perfil actualizada exitosamente.',
+        'foto_perfil_url': image_url
+    }), 200
 
-        try:
-            # Eliminar la foto de perfil antigua si existe
-            if old_profile_picture_url:
-                # La URL antigua sería como http://base_url/uploads/fotos_perfil/username/old_filename.ext
-                # Necesitamos extraer "/uploads/fotos_perfil/username/old_filename.ext" para construir la ruta local
-                if current_app.config.get('API_BASE_URL') and old_profile_picture_url.startswith(current_app.config.get('API_BASE_URL')):
-                    relative_path = old_profile_picture_url.replace(current_app.config.get('API_BASE_URL'), '').lstrip('/')
-                    old_filepath_from_url = os.path.join(current_app.root_path, relative_path)
-                    if os.path.exists(old_filepath_from_url) and old_filepath_from_url != filepath: # Evitar borrar si es el mismo archivo
-                        os.remove(old_filepath_from_url)
-                        print(f"Old profile picture removed: {old_filepath_from_url}", file=sys.stderr)
-                else: # Si la URL no tiene la API_BASE_URL, intenta derivar la ruta local directamente
-                    old_filename_from_url = os.path.basename(old_profile_picture_url)
-                    # Intentamos construir la ruta asumiendo la estructura actual: UPLOAD_FOLDER/fotos_perfil/username/old_filename
-                    old_filepath = os.path.join(user_folder, old_filename_from_url)
-                    if os.path.exists(old_filepath) and old_filepath != filepath:
-                        os.remove(old_filepath)
-                        print(f"Old profile picture removed (derived path): {old_filepath}", file=sys.stderr)
-
-
-            file.save(filepath)
-
-            base_url = current_app.config.get('API_BASE_URL', request.url_root.rstrip('/'))
-            # Ajustar la URL para reflejar la nueva ruta de fotos de perfil
-            image_url = f"{base_url}/uploads/fotos_perfil/{username}/{new_filename}"
-
-            cursor = mysql.connection.cursor()
-            try:
-                cursor.execute("UPDATE users SET foto_perfil = %s WHERE id = %s", (image_url, current_user_id))
-                mysql.connection.commit()
-                return jsonify({
-                    'message': 'Foto de perfil actualizada exitosamente.',
-                    'foto_perfil_url': image_url
-                }), 200
-            except Exception as db_e:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                print(f"Error DB al actualizar foto de perfil para user {current_user_id}: {db_e}", file=sys.stderr)
-                traceback.print_exc(file=sys.stderr)
-                return jsonify({"error": "Error interno del servidor al guardar la URL de la foto de perfil."}), 500
-            finally:
-                cursor.close()
-
-        except Exception as save_e:
-            print(f"Error al guardar el archivo: {save_e}", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
-            return jsonify({"error": "Error interno del servidor al guardar la imagen."}), 500
-    else:
-        return jsonify({'error': f"Tipo de archivo no permitido o nombre de archivo inválido. Solo se permiten {', '.join(allowed_extensions)}."}), 400
 
+# --- Imágenes de publicaciones ---
+UPLOAD_LOTE_MAX = int(os.getenv('UPLOAD_LOTE_MAX', '10'))    # Archivos por solicitud en upload_imagenes
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))       # Archivos de un lote que se guardan a la vez
+_pool_uploads = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='uploads')
 
-@user_bp.route('/publicaciones/<int:publicacion_id>/upload_imagen', methods=['POST'])
-def upload_publicacion_image(publicacion_id):
-    auth_header = request.headers.get('Authorization')
-    user_payload = get_user_from_jwt(auth_header)
+def _guardar_blob_publicacion(stream, extension, upload_folder):
+    with duracion_guardado_upload.medir(tipo='publicacion'):
+        blob = guardar_stream(stream, extension, upload_folder)
+    bytes_upload.incrementar(blob.tamano, tipo='publicacion')
+    return blob
 
-    if not user_payload:
-        return jsonify({"error": "No autorizado: Token inválido o ausente."}), 401
-
-    if not user_payload.get('verificado'):
-        return jsonify({"error": "Usuario no verificado."}), 403
-
-    current_user_id = user_payload.get('user_id')
-    username = user_payload.get('username')
+def _guardar_blobs_publicacion(archivos, upload_folder):
+    """
+    Guarda en paralelo en el almacén de blobs los archivos [(stream, extensión)] y retorna sus Blob en el mismo orden.
+    Espera a que terminen todos: si alguno falla, descarta los que se crearon y relanza el primer error.
+    """
+    if len(archivos) == 1:
+        return [_guardar_blob_publicacion(*archivos[0], upload_folder)]
+    futuros = [_pool_uploads.submit(_guardar_blob_publicacion, stream, extension, upload_folder) for stream, extension in archivos]
+    blobs = []
+    error = None
+    for futuro in futuros:
+        try:
+            blobs.append(futuro.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        descartar_nuevos(blobs)
+        raise error
+    return blobs
+
+def _insertar_imagenes_publicacion(cursor, publicacion_id, urls):
+    """
+    Agrega las imágenes al final de la publicación, con 'orden' explícito, en una sola sentencia.
+    Requiere haber bloqueado la fila de la publicación (FOR UPDATE) en la transacción actual,
+    para que dos subidas simultáneas no tomen el mismo orden. Retorna los IDs en el orden de 'urls'.
+    """
+    cursor.execute("SELECT COALESCE(MAX(orden), -1) + 1 FROM imagenes_publicacion WHERE publicacion_id = %s", (publicacion_id,))
+    primer_orden = cursor.fetchone()[0]
+    # MySQLdb convierte el executemany de un INSERT ... VALUES en un único INSERT de varias filas.
+    cursor.executemany(
+        "INSERT INTO imagenes_publicacion (publicacion_id, url, orden) VALUES (%s, %s, %s)",
+        [(publicacion_id, url, primer_orden + i) for i, url in enumerate(urls)]
+    )
+    cursor.execute(
+        "SELECT id FROM imagenes_publicacion WHERE publicacion_id = %s AND orden >= %s ORDER BY orden",
+        (publicacion_id, primer_orden)
+    )
+    return [fila[0] for fila in cursor.fetchall()]
+
+def _subir_imagenes_publicacion(publicacion_id, archivos):
+    """
+    Valida los archivos, los guarda en paralelo y registra todas las imágenes en una transacción.
+    Retorna (urls, None) o (None, respuesta de error). Si algo falla, los archivos creados se anotan para borrar.
+    """
+    current_user_id = g.usuario.user_id
 
     cursor = mysql.connection.cursor()
     try:
@@ -531,68 +889,145 @@ def upload_publicacion_image(publicacion_id):
         cursor.execute("SELECT autor_id FROM publicaciones WHERE id = %s", (publicacion_id,))
         publicacion = cursor.fetchone()
         if not publicacion:
-            return jsonify({"error": "Publicación no encontrada."}), 404
+            return None, (jsonify({"error": "Publicación no encontrada."}), 404)
         if publicacion[0] != current_user_id:
-            return jsonify({"error": "No tienes permiso para subir imágenes a esta publicación."}), 403
+            return None, (jsonify({"error": "No tienes permiso para subir imágenes a esta publicación."}), 403)
 
-        if 'imagen_publicacion' not in request.files:
-            return jsonify({'error': 'No se encontró el archivo de imagen en la solicitud. El campo esperado es "imagen_publicacion".'}), 400
+        if any(file.filename == '' for file in archivos):
+            return None, (jsonify({'error': 'No se seleccionó ningún archivo.'}), 400)
+        extensiones = [_extension_permitida(file.filename) for file in archivos]
+        if not all(extensiones):
+            return None, (jsonify({'error': _mensaje_extension_no_permitida()}), 400)
 
-        file = request.files['imagen_publicacion']
-
-        if file.filename == '':
-            return jsonify({'error': 'No se seleccionó ningún archivo.'}), 400
+        upload_folder = current_app.config.get('UPLOAD_FOLDER')
+        if not upload_folder:
+            print("ERROR: UPLOAD_FOLDER no está configurado en app.config.", file=sys.stderr)
+            return None, (jsonify({"error": "Error de configuración del servidor (UPLOAD_FOLDER no definido)."}), 500)
+    finally:
+        cursor.close()
 
-        allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
+    # 2. Guardar los archivos antes de abrir la transacción: no se retienen bloqueos mientras se escribe en disco.
+    try:
+        blobs = _guardar_blobs_publicacion([(file.stream, extension) for file, extension in zip(archivos, extensiones)], upload_folder)
+    except Exception as save_e:
+        print(f"Error al guardar los archivos para publicación {publicacion_id}: {save_e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return None, (jsonify({"error": "Error interno del servidor al guardar la imagen de la publicación."}), 500)
 
-        if file and '.' in file.filename and \
-           file.filename.rsplit('.', 1)[1].lower() in allowed_extensions:
+    base_url = current_app.config.get('API_BASE_URL', request.url_root.rstrip('/'))
+    urls = [url_de_blob(base_url, blob.ruta_relativa) for blob in blobs]
 
-            file_extension = file.filename.rsplit('.', 1)[1].lower()
+    # 3. Registrar todas las imágenes y sus referencias a blobs en una sola transacción
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute("SELECT id FROM publicaciones WHERE id = %s FOR UPDATE", (publicacion_id,))
+        if not cursor.fetchone(): # Se eliminó mientras se guardaban los archivos
+            mysql.connection.rollback()
+            descartar_nuevos(blobs)
+            return None, (jsonify({"error": "Publicación no encontrada."}), 404)
+        agregar_referencias(cursor, blobs)
+        comprobar_reutilizados(upload_folder, blobs)
+        imagen_ids = _insertar_imagenes_publicacion(cursor, publicacion_id, urls)
+        cambio = registrar_cambio(cursor, 'publicacion', publicacion_id, publicacion_id, 'editar')
+        mysql.connection.commit()
+        publicar_cambio(cambio)
+    except Exception as db_e:
+        # Si falla la DB, limpiar solo los archivos que creó esta subida
+        mysql.connection.rollback()
+        descartar_nuevos(blobs)
+        print(f"Error DB al registrar imágenes para publicación {publicacion_id}: {db_e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return None, (jsonify({"error": "Error interno del servidor al guardar la imagen de la publicación."}), 500)
+    finally:
+        cursor.close()
 
-            upload_folder = current_app.config.get('UPLOAD_FOLDER')
-            if not upload_folder:
-                print("ERROR: UPLOAD_FOLDER no está configurado en app.config.", file=sys.stderr)
-                return jsonify({"error": "Error de configuración del servidor (UPLOAD_FOLDER no definido)."}, 500)
+    feed_cache.invalidar()
+    # Las variantes redimensionadas se generan en segundo plano; mientras tanto el feed sirve la original.
+    app = current_app._get_current_object()
+    for imagen_id, blob in zip(imagen_ids, blobs):
+        programar_variantes_publicacion(app, imagen_id, os.path.join(upload_folder, blob.ruta_relativa), base_url)
+    return urls, None
 
-            # Crear la carpeta específica para la publicación: UPLOAD_FOLDER/publicaciones/username-public-publicacion_id/
-            base_publicaciones_path = os.path.join(upload_folder, 'publicaciones')
-            publicacion_folder_name = f"{username}-public-{publicacion_id}"
-            publicacion_folder_path = os.path.join(base_publicaciones_path, publicacion_folder_name)
+@user_bp.route('/publicaciones/<int:publicacion_id>/upload_imagen', methods=['POST'])
+@requiere_auth()
+def upload_publicacion_image(publicacion_id):
+    if 'imagen_publicacion' not in request.files:
+        return jsonify({'error': 'No se encontró el archivo de imagen en la solicitud. El campo esperado es "imagen_publicacion".'}), 400
 
-            if not os.path.exists(publicacion_folder_path):
-                os.makedirs(publicacion_folder_path)
+    urls, error = _subir_imagenes_publicacion(publicacion_id, [request.files['imagen_publicacion']])
+    if error:
+        return error
+    return jsonify({
+        'message': 'Imagen de publicación subida exitosamente.',
+        'imagen_url': urls[0]
+    }), 201
+
+@user_bp.route('/publicaciones/<int:publicacion_id>/upload_imagenes', methods=['POST'])
+@requiere_auth()
+def upload_publicacion_images(publicacion_id):
+    # Varias imágenes en una sola solicitud multipart, todas en el campo "imagenes_publicacion".
+    # Se agregan al final de la publicación en el orden en que vienen; o se guardan todas o ninguna.
+    archivos = request.files.getlist('imagenes_publicacion')
+    if not archivos:
+        return jsonify({'error': 'No se encontraron archivos en la solicitud. El campo esperado es "imagenes_publicacion".'}), 400
+    if len(archivos) > UPLOAD_LOTE_MAX:
+        return jsonify({'error': f'Se permiten como máximo {UPLOAD_LOTE_MAX} imágenes por solicitud.'}), 400
+
+    urls, error = _subir_imagenes_publicacion(publicacion_id, archivos)
+    if error:
+        return error
+    return jsonify({
+        'message': 'Imágenes de publicación subidas exitosamente.',
+        'imagenes_urls': urls
+    }), 201
 
-            # Generar un nombre de archivo seguro y único (puedes añadir un timestamp o UUID si se permite más de una imagen)
-            new_filename = secure_filename(file.filename)
-            filepath = os.path.join(publicacion_folder_path, new_filename)
 
-            try:
-                file.save(filepath)
+# --- Comandos de mantenimiento (flask user <comando>) ---
 
-                base_url = current_app.config.get('API_BASE_URL', request.url_root.rstrip('/'))
-                # Ajustar la URL para reflejar la nueva ruta de publicaciones
-                image_url = f"{base_url}/uploads/publicaciones/{publicacion_folder_name}/{new_filename}"
+@user_bp.cli.command('recontar-comentarios')
+def recontar_comentarios():
+    """Reconstruye publicacion_contadores a partir de la tabla comentarios."""
+    cursor = mysql.connection.cursor()
+    try:
+        filas = reconstruir_contadores(cursor)
+        mysql.connection.commit()
+        click.echo(f"Contadores de comentarios reconstruidos ({filas} filas afectadas).")
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"Error al reconstruir contadores de comentarios: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        cursor.close()
 
-                # Guardar la URL de la imagen en la tabla 'imagenes_publicacion'
-                # Si se permite más de una imagen, se podría pasar un 'orden' en el request o calcularlo
-                # Para esta implementación, asumimos orden=1 si es la primera, o puedes manejarlo como quieras
-                # Aquí, insertaremos un nuevo registro por cada imagen subida.
-                cursor.execute("INSERT INTO imagenes_publicacion (publicacion_id, url) VALUES (%s, %s)", (publicacion_id, image_url))
-                mysql.connection.commit()
+@user_bp.cli.command('podar-cambios')
+@click.option('--dias', type=int, default=30, show_default=True, help='Conservar los cambios de los últimos DIAS días.')
+def podar_registro_cambios(dias):
+    """Elimina del registro de cambios las filas antiguas; los clientes con versiones anteriores recargan el feed."""
+    cursor = mysql.connection.cursor()
+    try:
+        filas = podar_cambios(cursor, dias)
+        mysql.connection.commit()
+        click.echo(f"Registro de cambios podado ({filas} filas eliminadas).")
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"Error al podar el registro de cambios: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        cursor.close()
 
-                return jsonify({
-                    'message': 'Imagen de publicación subida exitosamente.',
-                    'imagen_url': image_url
-                }), 201
-            except Exception as save_e:
-                # Si falla al guardar en disco o DB, intentar limpiar el archivo si ya se había guardado
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                print(f"Error al guardar el archivo o DB para publicación {publicacion_id}: {save_e}", file=sys.stderr)
-                traceback.print_exc(file=sys.stderr)
-                return jsonify({"error": "Error interno del servidor al guardar la imagen de la publicación."}), 500
-        else:
-            return jsonify({'error': f"Tipo de archivo no permitido o nombre de archivo inválido. Solo se permiten {', '.join(allowed_extensions)}."}), 400
+@user_bp.cli.command('reindexar-busqueda')
+def reindexar_busqueda():
+    """Reconstruye el índice de búsqueda desde la tabla publicaciones y lo guarda en disco."""
+    cursor = mysql.connection.cursor()
+    try:
+        indice_busqueda.reconstruir(cursor)
+        indice_busqueda.guardar()
+        click.echo(f"Índice de búsqueda reconstruido ({len(indice_busqueda)} publicaciones).")
+    except Exception as e:
+        print(f"Error al reconstruir el índice de búsqueda: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        raise SystemExit(1)
     finally:
-        cursor.close()
\ No newline at end of file
+        cursor.close()